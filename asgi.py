@@ -0,0 +1,10 @@
+"""
+ASGI entry point, e.g. `uvicorn asgi:app`.
+
+Flask is a WSGI application, so every request runs in a worker thread of the ASGI server. With
+`ASYNC_QUERIES_ENABLED`, the pages that fan out run their independent queries concurrently in an event loop.
+"""
+from asgiref.wsgi import WsgiToAsgi
+from run import app as wsgi_app
+
+app = WsgiToAsgi(wsgi_app)
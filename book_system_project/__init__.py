@@ -1,10 +1,15 @@
 from flask import Flask
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
+import logging
 import logging.config
+import os
+from book_system_project.structured_logging import configure_logging, init_request_logging
+from book_system_project.metrics import init_metrics
+from book_system_project.compression import init_compression
 
-logging.config.fileConfig('logging.conf')
 logger = logging.getLogger('sLogger')
+_logging_configured = False
 
 login_manager = LoginManager()
 login_manager.login_view = "login"
@@ -18,7 +23,14 @@ def create_app(config_filename):
 
     This function sets up a Flask application with configurations from a given
     configuration file, initializes extensions (database, login manager, bcrypt),
-    registers blueprints, and sets up Flask-Admin with views for models.
+    registers blueprints and CLI commands, and sets up Flask-Admin with views for models.
+    The first call sets up the queued JSON logging of `structured_logging`, or reads the
+    `LOGGING_CONFIG` file with `logging.config.fileConfig` when that config value is set.
+    Every app logs its requests and records their metrics, see `metrics.init_metrics`,
+    compresses its responses and fingerprints its static files, see
+    `compression.init_compression`, and can profile slow requests, see
+    `profiling.ProfilerMiddleware`. Ratings, read lists and reviews can be sharded by user
+    over several databases, see `sharding.ShardRouter`.
 
     Args:
         config_filename (str): The path to the configuration file.
@@ -33,8 +45,9 @@ def create_app(config_filename):
        - SQLAlchemy database instance
        - Login manager
        - Bcrypt for password hashing
-    4. Registers the blueprint for the book system project.
-    5. Sets up the Flask-Admin interface and adds views for the following models:
+    4. Registers the blueprint for the book system project and its CLI commands.
+    5. Mounts the Flask-Admin interface at `/admin`, built on the first admin request by
+       `LazyAdminMiddleware` so startup does not pay for it, with views for the following models:
        - User
        - Book
        - Rating
@@ -43,11 +56,25 @@ def create_app(config_filename):
        - ToRead
        - Review
     """
+    global _logging_configured
     app = Flask(__name__)
     app.config.from_pyfile(config_filename)
 
+    if not _logging_configured:
+        if app.config.get('LOGGING_CONFIG'):
+            logging.config.fileConfig(app.config['LOGGING_CONFIG'])
+        else:
+            app.config.setdefault('LOG_FILE', os.path.join(app.instance_path, 'logfile.log'))
+            configure_logging(app.config)
+        _logging_configured = True
+    init_request_logging(app)
+    init_metrics(app)
+    init_compression(app)
+
     from book_system_project.models import db
     db.init_app(app)
+    from book_system_project.sharding import init_sharding
+    init_sharding(app)
     login_manager.init_app(app)
     bcrypt.init_app(app)
 
@@ -55,15 +82,11 @@ def create_app(config_filename):
         from book_system_project.blueprints import bp
         app.register_blueprint(bp)
 
-        from flask_admin import Admin
-        from book_system_project.models import User, Book, Rating, Author, Genre, ToRead, Review
-        admin = Admin(app, name='Book System', template_mode='bootstrap3')
-        from flask_admin.contrib.sqla import ModelView
-        admin.add_view(ModelView(User, db.session))
-        admin.add_view(ModelView(Book, db.session))
-        admin.add_view(ModelView(Rating, db.session))
-        admin.add_view(ModelView(Author, db.session))
-        admin.add_view(ModelView(Genre, db.session))
-        admin.add_view(ModelView(ToRead, db.session))
-        admin.add_view(ModelView(Review, db.session))
+        from book_system_project.commands import register_commands
+        register_commands(app)
+
+    from book_system_project.admin import LazyAdminMiddleware
+    from book_system_project.profiling import ProfilerMiddleware
+    app.wsgi_app = ProfilerMiddleware(app)
+    app.wsgi_app = LazyAdminMiddleware(app)
     return app
@@ -0,0 +1,84 @@
+import threading
+from flask import Flask
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+ADMIN_PREFIX = '/admin'
+
+
+def create_admin_app(app: Flask) -> Flask:
+    """
+    Build the Flask-Admin interface as a separate app serving the `/admin` URL prefix.
+
+    The admin app shares the main app's configuration, so it reads the same database and the same session cookie,
+    and the main app's cache, so edits made in the admin drop the cached users of the main app. Every model gets an
+    `AdminModelView`, which is only accessible to the Admin user. With sharded activity tables, ratings, read lists
+    and reviews get a `ShardModelView` per shard instead, and are left out of the user and book forms.
+
+    Args:
+        app (Flask): The main application.
+
+    Returns:
+        Flask: The admin application, to be mounted at `ADMIN_PREFIX`.
+    """
+    from flask_admin import Admin
+    from book_system_project import login_manager
+    from book_system_project.cache import get_cache
+    from book_system_project.admin_views import AdminModelView, CatalogModelView, ShardModelView
+    from book_system_project.models import db, User, Book, Rating, Author, Genre, ToRead, Review
+    from book_system_project.sharding import ACTIVITY_MODELS, get_router, init_sharding
+
+    admin_app = Flask(__name__)
+    admin_app.config.update(app.config)
+    db.init_app(admin_app)
+    init_sharding(admin_app)
+    login_manager.init_app(admin_app)
+    with app.app_context():
+        get_cache()
+    admin_app.extensions['cache'] = app.extensions['cache']
+    with admin_app.app_context():
+        router = get_router()
+
+    admin = Admin(admin_app, name='Book System', url='/', template_mode='bootstrap3')
+    if not router.sharded:
+        for model in (User, Book, Rating, Author, Genre, ToRead, Review):
+            admin.add_view(AdminModelView(model, db.session))
+        return admin_app
+
+    for model in (User, Book):
+        admin.add_view(CatalogModelView(model, db.session))
+    for model in (Author, Genre):
+        admin.add_view(AdminModelView(model, db.session))
+    for index in range(router.shard_count):
+        for model in ACTIVITY_MODELS:
+            admin.add_view(ShardModelView(model, index, name=model.__name__, category=f'Shard {index + 1}',
+                                          endpoint=f'{model.__tablename__}_shard{index}'))
+    return admin_app
+
+
+class LazyAdminMiddleware:
+    """
+    WSGI middleware that creates the admin interface on the first request to `/admin`.
+
+    Importing Flask-Admin and building the model views is the slowest part of creating the app, and most worker
+    processes never serve an admin page. Until the first admin request, every request goes straight to the main app;
+    from then on, `/admin` requests are dispatched to the admin app by a `DispatcherMiddleware`.
+
+    Attributes:
+        app (Flask): The main application.
+    """
+    def __init__(self, app: Flask):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._dispatcher = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == ADMIN_PREFIX or path.startswith(ADMIN_PREFIX + '/'):
+            if self._dispatcher is None:
+                with self._lock:
+                    if self._dispatcher is None:
+                        self._dispatcher = DispatcherMiddleware(self.wsgi_app,
+                                                                {ADMIN_PREFIX: create_admin_app(self.app)})
+            return self._dispatcher(environ, start_response)
+        return self.wsgi_app(environ, start_response)
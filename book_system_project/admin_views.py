@@ -0,0 +1,77 @@
+from flask import flash
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from book_system_project.cache import get_cache, USER_CACHE_KEY
+from book_system_project.models import User
+from book_system_project.sharding import get_router
+
+
+class AdminModelView(ModelView):
+    """
+    Custom ModelView for administrative access control in Flask-Admin.
+
+    This view overrides the default `is_accessible` method to restrict access to only users with administrative
+    privileges.
+    Specifically, it checks if the current user is authenticated and has the username "Admin".
+
+    Methods:
+        is_accessible():
+            Checks if the current user has administrative access.
+            Returns True if the user is authenticated and their name is "Admin", otherwise False.
+            Displays a flash message if access is denied.
+
+        after_model_change(), after_model_delete():
+            Drop an edited or deleted user from the cache used by the user loader.
+    """
+    def is_accessible(self):
+        is_admin = current_user.is_authenticated and current_user.name == "Admin"
+        if not is_admin:
+            flash("You dont have permits to access this page!", "error")
+        return is_admin
+
+    def after_model_change(self, form, model, is_created):
+        if isinstance(model, User):
+            get_cache().delete(USER_CACHE_KEY.format(user_id=model.id))
+
+    def after_model_delete(self, model):
+        if isinstance(model, User):
+            get_cache().delete(USER_CACHE_KEY.format(user_id=model.id))
+
+
+class CatalogModelView(AdminModelView):
+    """
+    AdminModelView of users or books when the activity tables are sharded, without their ratings, read lists and
+    reviews, which are not in the main database.
+    """
+    form_excluded_columns = ('rating', 'toreads', 'reviews')
+
+
+class ShardSession:
+    """
+    Stands for the session of one shard in the current app context, see `ShardRouter.sessions`, so a view built
+    once can use the sessions opened for each request. Private attributes, which Flask-Admin probes while building
+    the view, are not looked up.
+
+    Attributes:
+        index (int): The index of the shard.
+    """
+    def __init__(self, index: int):
+        self.index = index
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(get_router().sessions()[self.index], name)
+
+
+class ShardModelView(AdminModelView):
+    """
+    AdminModelView of an activity table in one shard.
+
+    The `user` and `book` tables are in the main database, so users and books are shown and edited as plain IDs
+    instead of relationships.
+    """
+    def __init__(self, model, index: int, **kwargs):
+        self.column_list = self.form_columns = [column.name for column in model.__table__.columns
+                                                if column.name != 'id']
+        super().__init__(model, ShardSession(index), **kwargs)
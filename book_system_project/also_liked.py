@@ -0,0 +1,106 @@
+from book_system_project.models import db, Book, Rating, AlsoLiked, insert_ignore
+from book_system_project.recommendation_cache import bump_similarity_epoch
+from book_system_project.sharding import get_router, merge_counts
+from sqlalchemy import func, insert
+from typing import List, Tuple
+
+LIKED_RATING = 5
+
+
+def rebuild_also_liked() -> int:
+    """
+    Recompute the whole `AlsoLiked` table from the `Rating` table.
+
+    Every pair of different books rated 5 by the same user is counted once per user, in both directions. Used after
+    bulk rating imports, where updating the table rating by rating would be wasteful. Every cached recommendation
+    becomes stale. The ratings of a user are all in the same shard, so with sharded activity tables the pairs are
+    counted in each shard and the counts added up.
+
+    Returns:
+        int: The number of rows written to the `AlsoLiked` table.
+    """
+    liked = db.aliased(Rating)
+    other = db.aliased(Rating)
+
+    def pairs(session):
+        return session.query(liked.book_id, other.book_id, func.count()) \
+            .join(other, (other.user_id == liked.user_id) & (other.book_id != liked.book_id)) \
+            .filter(liked.rating == LIKED_RATING, other.rating == LIKED_RATING) \
+            .group_by(liked.book_id, other.book_id)
+
+    router = get_router()
+    AlsoLiked.query.delete()
+    if router.sharded:
+        counts = merge_counts([((book_id, related_id), count) for book_id, related_id, count in pairs(session)]
+                              for session in router.sessions())
+        if counts:
+            db.session.execute(insert(AlsoLiked), [{'book_id': book_id, 'related_book_id': related_id, 'count': count}
+                                                   for (book_id, related_id), count in counts.items()])
+    else:
+        db.session.execute(insert(AlsoLiked).from_select(['book_id', 'related_book_id', 'count'], pairs(db.session)))
+    db.session.commit()
+    bump_similarity_epoch()
+    return AlsoLiked.query.count()
+
+
+def update_also_liked(user_id: int, book_id: int, old_rating, new_rating) -> List[int]:
+    """
+    Apply a single rating change to the `AlsoLiked` table.
+
+    Nothing changes unless the book moves in or out of the user's liked books. If it does, the pair counts between
+    this book and every other book the user likes are increased or decreased by one, in both directions. The user's
+    other liked books are read from their shard. Missing pairs are created with `insert_ignore` and the counts are
+    changed by a single `UPDATE ... SET count = count + 1` (or `- 1`), so concurrent ratings by different users of
+    the same pair of books neither fail on the primary key nor lose an increment. The changes are committed together
+    with the rating.
+
+    Args:
+        user_id (int): The ID of the user who rated the book.
+        book_id (int): The ID of the rated book.
+        old_rating: The previous rating value, or None if the book was not rated before.
+        new_rating: The new rating value, or None if the rating was removed.
+
+    Returns:
+        List[int]: The IDs of the books whose pairs changed, for `bump_similarity_versions` once the change is
+                   committed. Empty if the book did not move in or out of the liked books.
+    """
+    was_liked = old_rating is not None and int(old_rating) == LIKED_RATING
+    is_liked = new_rating is not None and int(new_rating) == LIKED_RATING
+    if was_liked == is_liked:
+        return []
+    delta = 1 if is_liked else -1
+
+    other_ids = [other_id for other_id, in get_router().session(user_id).query(Rating.book_id)
+                 .filter(Rating.user_id == user_id, Rating.rating == LIKED_RATING, Rating.book_id != book_id)
+                 .distinct()]
+    if not other_ids:
+        return [book_id]
+    pairs = ((AlsoLiked.book_id == book_id) & AlsoLiked.related_book_id.in_(other_ids)) | \
+        (AlsoLiked.book_id.in_(other_ids) & (AlsoLiked.related_book_id == book_id))
+    if delta > 0:
+        for key in [(book_id, other_id) for other_id in other_ids] + [(other_id, book_id) for other_id in other_ids]:
+            insert_ignore(AlsoLiked, {'book_id': key[0], 'related_book_id': key[1], 'count': 0},
+                          index_elements=['book_id', 'related_book_id'])
+    db.session.execute(db.update(AlsoLiked).where(pairs).values(count=AlsoLiked.count + delta))
+    if delta < 0:
+        db.session.execute(db.delete(AlsoLiked).where(pairs, AlsoLiked.count <= 0))
+    return [book_id] + other_ids
+
+
+def also_liked_for(book_id: int, limit: int = 5) -> List[Tuple[Book, int]]:
+    """
+    Return the books most often liked together with the given book.
+
+    Args:
+        book_id (int): The ID of the book.
+        limit (int): The maximum number of books to return.
+
+    Returns:
+        List[Tuple[Book, int]]: Tuples of a related `Book` and the number of users who liked both books, most
+                                liked first.
+    """
+    return db.session.query(Book, AlsoLiked.count) \
+        .join(AlsoLiked, AlsoLiked.related_book_id == Book.id) \
+        .filter(AlsoLiked.book_id == book_id) \
+        .order_by(AlsoLiked.count.desc(), Book.id) \
+        .limit(limit).all()
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import math
+from array import array
+from flask import current_app
+from book_system_project.models import db, Book, User, Rating, Review, ToRead, AnalyticsSketch, AnalyticsEvent
+from book_system_project.sharding import get_router
+from typing import Iterable, List, Tuple
+
+READERS_KEY = 'readers:{book_id}'
+ALL_READERS_KEY = 'readers:all'
+REVIEWER_COUNTS_KEY = 'reviewers:count_min'
+TOP_REVIEWERS_KEY = 'reviewers:top'
+
+
+def _hash(item) -> int:
+    """Return a 64-bit hash of the item."""
+    return int.from_bytes(hashlib.blake2b(str(item).encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch estimating the number of distinct items added to it.
+
+    Uses 2 ** `precision` one-byte registers, 1 KiB with the default precision of 10, for a standard error of about
+    1.04 / sqrt(2 ** precision), roughly 3%.
+
+    Attributes:
+        precision (int): Number of hash bits used to select a register.
+        registers (bytearray): The register values.
+    """
+    def __init__(self, precision: int = 10, registers: bytes = None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers else bytearray(2 ** precision)
+
+    def add(self, item) -> bool:
+        """
+        Add an item to the sketch.
+
+        Returns:
+            bool: True if a register changed, meaning the estimate may have changed.
+        """
+        value = _hash(item)
+        index = value >> (64 - self.precision)
+        remaining = value & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def count(self) -> int:
+        """Return the estimated number of distinct items added."""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch estimating how often each item was added, never underestimating.
+
+    Attributes:
+        width (int): Number of counters per row.
+        depth (int): Number of rows, each with its own hash.
+        counters (array): The counters, row after row.
+    """
+    def __init__(self, width: int = 512, depth: int = 4, counters: bytes = None):
+        self.width = width
+        self.depth = depth
+        self.counters = array('I')
+        if counters:
+            self.counters.frombytes(counters)
+        else:
+            self.counters.extend([0] * (width * depth))
+
+    def _cells(self, item) -> List[int]:
+        return [row * self.width + _hash(f'{row}:{item}') % self.width for row in range(self.depth)]
+
+    def add(self, item, count: int = 1) -> None:
+        for cell in self._cells(item):
+            self.counters[cell] += count
+
+    def estimate(self, item) -> int:
+        return min(self.counters[cell] for cell in self._cells(item))
+
+    def to_bytes(self) -> bytes:
+        return self.counters.tobytes()
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary tracking the most frequent items with a fixed number of counters.
+
+    When a new item arrives and all counters are taken, the item with the lowest count is replaced and the new item
+    inherits that count as its possible overestimate. Every item added more than n / `capacity` times is guaranteed to
+    be tracked.
+
+    Attributes:
+        capacity (int): Maximum number of items tracked.
+        counts (dict): Tracked items mapped to [count, overestimate].
+    """
+    def __init__(self, capacity: int = 50, counts: dict = None):
+        self.capacity = capacity
+        self.counts = counts or {}
+
+    def add(self, item) -> None:
+        item = str(item)
+        if item in self.counts:
+            self.counts[item][0] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = [1, 0]
+        else:
+            smallest = min(self.counts, key=lambda key: self.counts[key][0])
+            count, _ = self.counts.pop(smallest)
+            self.counts[item] = [count + 1, count]
+
+    def top(self, n: int = 10) -> List[Tuple[str, int, int]]:
+        """Return the `n` most frequent items as (item, count, overestimate), most frequent first."""
+        ranked = sorted(self.counts.items(), key=lambda entry: entry[1][0], reverse=True)[:n]
+        return [(item, count, error) for item, (count, error) in ranked]
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({'capacity': self.capacity, 'counts': self.counts}).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SpaceSaving':
+        state = json.loads(data)
+        return cls(state['capacity'], state['counts'])
+
+
+def _sketch_row(key: str, book_id: int = None) -> AnalyticsSketch:
+    """Return the sketch row of a key, locked until the end of the transaction, or a new one."""
+    row = db.session.get(AnalyticsSketch, key, with_for_update=True, populate_existing=True)
+    if row is None:
+        row = AnalyticsSketch(key=key, book_id=book_id)
+        db.session.add(row)
+    return row
+
+
+def _add_readers(key: str, user_ids: Iterable[int], book_id: int = None) -> None:
+    row = _sketch_row(key, book_id)
+    sketch = HyperLogLog(registers=row.data)
+    if any([sketch.add(user_id) for user_id in user_ids]) or row.estimate is None:
+        row.data = sketch.to_bytes()
+        row.estimate = sketch.count()
+
+
+def _add_reviews(user_ids: List[int]) -> None:
+    counts_row = _sketch_row(REVIEWER_COUNTS_KEY)
+    counts = CountMinSketch(counters=counts_row.data)
+    top_row = _sketch_row(TOP_REVIEWERS_KEY)
+    top = SpaceSaving.from_bytes(top_row.data) if top_row.data else SpaceSaving()
+    for user_id in user_ids:
+        counts.add(user_id)
+        top.add(user_id)
+    counts_row.data = counts.to_bytes()
+    top_row.data = top.to_bytes()
+
+
+def record_activity(user_id: int, book_id: int, kind: str) -> None:
+    """
+    Record a rating, review or read list addition for the analytics sketches.
+
+    Only appends an `AnalyticsEvent` row, committed together with the write itself, so concurrent writes never
+    contend on the shared sketch rows. The events are folded into the sketches by `fold_analytics`, with every
+    write-behind flush, by `rollup-analytics`, and by the dashboard queries once too many are waiting; until then
+    the dashboard queries count the events not folded yet.
+
+    Args:
+        user_id (int): The ID of the acting user.
+        book_id (int): The ID of the book.
+        kind (str): 'rating', 'review' or 'to_read'.
+    """
+    db.session.add(AnalyticsEvent(user_id=user_id, book_id=book_id, kind=kind))
+
+
+def fold_analytics(limit: int = None) -> int:
+    """
+    Fold the oldest recorded `AnalyticsEvent` rows into the sketches and delete them.
+
+    The events are deleted with `DELETE ... RETURNING`, and only the deleted rows are folded, so concurrent folds
+    split the events between them instead of counting any twice. The sketch rows are locked while they are updated.
+    The changes are committed by the caller, like the rollups.
+
+    Args:
+        limit (int): The maximum number of events to fold, or None for all of them.
+
+    Returns:
+        int: The number of events folded.
+    """
+    oldest = db.select(AnalyticsEvent.id).order_by(AnalyticsEvent.id)
+    if limit is not None:
+        oldest = oldest.limit(limit)
+    deleted = db.session.execute(
+        db.delete(AnalyticsEvent).where(AnalyticsEvent.id.in_(oldest))
+        .returning(AnalyticsEvent.id, AnalyticsEvent.user_id, AnalyticsEvent.book_id, AnalyticsEvent.kind)).all()
+    events = [(user_id, book_id, kind) for _, user_id, book_id, kind in sorted(deleted)]
+    if not events:
+        return 0
+
+    readers = {}
+    for user_id, book_id, _ in events:
+        readers.setdefault(book_id, set()).add(user_id)
+    for book_id, user_ids in readers.items():
+        _add_readers(READERS_KEY.format(book_id=book_id), user_ids, book_id)
+    _add_readers(ALL_READERS_KEY, {user_id for user_id, _, _ in events})
+    reviewers = [user_id for user_id, _, kind in events if kind == 'review']
+    if reviewers:
+        _add_reviews(reviewers)
+    return len(events)
+
+
+def rebuild_analytics() -> None:
+    """
+    Recompute all analytics sketches from the `Rating`, `Review` and `ToRead` tables of every shard.
+
+    Needed once for activity recorded before the sketches existed, and after bulk imports that bypass the views.
+    The events recorded so far are dropped, since the rebuilt sketches already count them.
+    """
+    last_id = db.session.query(db.func.max(AnalyticsEvent.id)).scalar()
+    if last_id is not None:
+        AnalyticsEvent.query.filter(AnalyticsEvent.id <= last_id).delete(synchronize_session=False)
+    AnalyticsSketch.query.delete()
+    readers = {}
+    all_readers = HyperLogLog()
+    router = get_router()
+    for model in (Rating, Review, ToRead):
+        for rows in router.scatter(lambda session: session.query(model.user_id, model.book_id).all()):
+            for user_id, book_id in rows:
+                readers.setdefault(book_id, HyperLogLog()).add(user_id)
+                all_readers.add(user_id)
+    for book_id, sketch in readers.items():
+        db.session.add(AnalyticsSketch(key=READERS_KEY.format(book_id=book_id), book_id=book_id,
+                                       data=sketch.to_bytes(), estimate=sketch.count()))
+    db.session.add(AnalyticsSketch(key=ALL_READERS_KEY, data=all_readers.to_bytes(), estimate=all_readers.count()))
+
+    counts, top = CountMinSketch(), SpaceSaving()
+    for rows in router.scatter(lambda session: session.query(Review.user_id).order_by(Review.id).all()):
+        for user_id, in rows:
+            counts.add(user_id)
+            top.add(user_id)
+    db.session.add(AnalyticsSketch(key=REVIEWER_COUNTS_KEY, data=counts.to_bytes()))
+    db.session.add(AnalyticsSketch(key=TOP_REVIEWERS_KEY, data=top.to_bytes()))
+    db.session.commit()
+
+
+def _pending_events() -> List[Tuple[int, int, str]]:
+    """
+    Return the user ID, book ID and kind of the events not folded yet, oldest first.
+
+    If more than `ANALYTICS_MAX_PENDING` (default 1000) events are waiting, they are folded and committed first, so
+    a dashboard query never reads more than that many.
+    """
+    limit = current_app.config.get('ANALYTICS_MAX_PENDING', 1000)
+    query = db.session.query(AnalyticsEvent.user_id, AnalyticsEvent.book_id, AnalyticsEvent.kind) \
+        .order_by(AnalyticsEvent.id)
+    events = query.limit(limit + 1).all()
+    if len(events) > limit:
+        fold_analytics()
+        db.session.commit()
+        events = query.limit(limit).all()
+    return events
+
+
+def _pending_readers() -> dict:
+    """Return the IDs of the users of each book in the events not folded yet."""
+    readers = {}
+    for user_id, book_id, _ in _pending_events():
+        readers.setdefault(book_id, set()).add(user_id)
+    return readers
+
+
+def books_by_readers(limit: int = 20) -> List[Tuple[Book, int]]:
+    """
+    Return the books with the most estimated distinct readers.
+
+    The estimates are stored next to the sketches, so this is a single query on the estimate index, plus the
+    sketches of the books with events not folded yet.
+
+    Returns:
+        List[Tuple[Book, int]]: Tuples of a `Book` and its estimated number of distinct readers, most read first.
+    """
+    pending = _pending_readers()
+    ranked = db.session.query(Book, AnalyticsSketch.estimate) \
+        .join(AnalyticsSketch, AnalyticsSketch.book_id == Book.id) \
+        .order_by(AnalyticsSketch.estimate.desc(), Book.id) \
+        .limit(limit + len(pending)).all()
+    if not pending:
+        return ranked
+    estimates = {book.id: (book, estimate) for book, estimate in ranked}
+    rows = {row.book_id: row for row in AnalyticsSketch.query.filter(AnalyticsSketch.book_id.in_(list(pending)))}
+    for book in Book.query.filter(Book.id.in_(list(pending))):
+        sketch = HyperLogLog(registers=rows[book.id].data if book.id in rows else None)
+        for user_id in pending[book.id]:
+            sketch.add(user_id)
+        estimates[book.id] = (book, sketch.count())
+    return sorted(estimates.values(), key=lambda entry: (-entry[1], entry[0].id))[:limit]
+
+
+def total_readers() -> int:
+    """Return the estimated number of distinct users with any activity."""
+    pending = {user_id for user_id, _, _ in _pending_events()}
+    row = db.session.get(AnalyticsSketch, ALL_READERS_KEY)
+    if not pending:
+        return row.estimate if row else 0
+    sketch = HyperLogLog(registers=row.data if row else None)
+    for user_id in pending:
+        sketch.add(user_id)
+    return sketch.count()
+
+
+def top_reviewers(limit: int = 10) -> List[Tuple[User, int]]:
+    """
+    Return the most active reviewers.
+
+    Candidates come from the Space-Saving summary, and their review counts are estimated with the Count-Min sketch,
+    taking the lower of the two estimates since both only overestimate. Reviews not folded yet are added to both.
+
+    Returns:
+        List[Tuple[User, int]]: Tuples of a `User` and their estimated number of reviews, most active first.
+    """
+    pending = [user_id for user_id, _, kind in _pending_events() if kind == 'review']
+    top_row = db.session.get(AnalyticsSketch, TOP_REVIEWERS_KEY)
+    counts_row = db.session.get(AnalyticsSketch, REVIEWER_COUNTS_KEY)
+    if (top_row is None or counts_row is None) and not pending:
+        return []
+    counts = CountMinSketch(counters=counts_row.data if counts_row else None)
+    top = SpaceSaving.from_bytes(top_row.data) if top_row else SpaceSaving()
+    for user_id in pending:
+        counts.add(user_id)
+        top.add(user_id)
+    candidates = [(int(user_id), min(count, counts.estimate(int(user_id)))) for user_id, count, _ in top.top(limit)]
+    users = {user.id: user for user in User.query.filter(User.id.in_([user_id for user_id, _ in candidates]))}
+    ranked = sorted(candidates, key=lambda candidate: candidate[1], reverse=True)
+    return [(users[user_id], count) for user_id, count in ranked if user_id in users]
@@ -1,2 +1,7 @@
 SECRET_KEY = "book_system_key"
 SQLALCHEMY_DATABASE_URI: str = 'sqlite:///book_system.db'
+WRITE_BEHIND_ENABLED: bool = False
+RATE_LIMIT_ENABLED: bool = True
+RECOMMENDATIONS_WARM_ENABLED: bool = False
+ACTIVITY_SHARDS: list = []
+ASYNC_QUERIES_ENABLED: bool = False
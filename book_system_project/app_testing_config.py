@@ -1,2 +1,3 @@
 SECRET_KEY = "book_system_key"
 SQLALCHEMY_DATABASE_URI: str = 'sqlite:///:memory:'
+BCRYPT_LOG_ROUNDS: int = 4
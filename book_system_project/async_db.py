@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from flask import Flask, current_app
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import aliased
+from sqlalchemy.pool import NullPool
+from book_system_project.models import db, Book, Rating, Review, User
+from book_system_project.sharding import get_router, merge_averages, shard_index
+
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg', 'mysql': 'aiomysql'}
+"""The asyncio driver used for each database backend."""
+
+
+def async_uri(uri: str) -> str:
+    """Return a database URI with the asyncio driver of its backend, e.g. `sqlite+aiosqlite:///` for SQLite."""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}').render_as_string(hide_password=False)
+
+
+class AsyncDatabases:
+    """
+    Asyncio engines of the main database and of the activity shards, to run independent queries concurrently.
+
+    Flask runs every coroutine in an event loop of its own, and asyncio connections cannot move between event
+    loops, so the engines open a connection per query instead of pooling them.
+
+    Attributes:
+        uris (List[str]): The URIs of the main database and of the shards, in shard order, as configured.
+        main: The engine of the main database.
+        shards (list): The engines of the shards, or only the main database's without shards.
+        pid (int): The process the engines were created in.
+    """
+    def __init__(self, main_uri: str, shard_uris: List[str] = ()):
+        self.uris = [main_uri] + list(shard_uris)
+        self.main = create_async_engine(async_uri(main_uri), poolclass=NullPool)
+        self.shards = [create_async_engine(async_uri(uri), poolclass=NullPool) for uri in shard_uris] or [self.main]
+        self.pid = os.getpid()
+
+    def shard(self, user_id: int):
+        """Return the engine of a user's shard, the same one `ShardRouter.shard_for` picks."""
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    @staticmethod
+    async def fetch(engine, statement) -> list:
+        """Run a statement on its own connection and return all its rows."""
+        async with engine.connect() as connection:
+            return (await connection.execute(statement)).all()
+
+    async def scatter(self, statement) -> List[list]:
+        """Run a statement on every shard at the same time, and return the rows of each shard, in shard order."""
+        return list(await asyncio.gather(*(self.fetch(engine, statement) for engine in self.shards)))
+
+
+def get_async_databases() -> AsyncDatabases:
+    """
+    Return the asyncio engines of the current app, creating them on first use in each process.
+
+    The engines follow the main database and `ACTIVITY_SHARDS`, and are recreated when these change.
+
+    Returns:
+        AsyncDatabases: The app's engines.
+    """
+    uris = [db.engine.url.render_as_string(hide_password=False)] + get_router().uris
+    databases = current_app.extensions.get('async_databases')
+    if databases is None or databases.pid != os.getpid() or databases.uris != uris:
+        databases = current_app.extensions['async_databases'] = AsyncDatabases(uris[0], uris[1:])
+    return databases
+
+
+def _averages_statement(book_ids=None):
+    statement = select(Rating.book_id, func.sum(Rating.rating), func.count(Rating.rating)) \
+        .where(Rating.rating.isnot(None))
+    if book_ids is not None:
+        statement = statement.where(Rating.book_id.in_(list(book_ids)))
+    return statement.group_by(Rating.book_id)
+
+
+async def _nothing():
+    return None
+
+
+async def gather_recommendations(user_id: int) -> Optional[dict]:
+    """
+    Compute the 'sorted' and 'separate' recommendation data of `routes.compute_recommendations` concurrently.
+
+    The user's 5-star books are read first, since every other query depends on them. The seed books, the books
+    liked by like-minded users and the (seed book, recommended book) pairs are then queried at the same time, the
+    last two on every shard at once, and finally the recommended books and their average ratings.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        dict: The same 'sorted' and 'separate' data as `compute_recommendations`, or None if the user has not rated
+              any book 5.
+    """
+    databases = get_async_databases()
+    seed_ids = [book_id for book_id, in await databases.fetch(
+        databases.shard(user_id), select(Rating.book_id).where(Rating.user_id == user_id, Rating.rating == 5))]
+    if not seed_ids:
+        return None
+
+    users_alike = select(Rating.user_id).where(Rating.book_id.in_(seed_ids), Rating.rating == 5,
+                                               Rating.user_id != user_id)
+    books_alike = select(Rating.book_id).where(Rating.user_id.in_(users_alike), Rating.rating == 5,
+                                               Rating.book_id.not_in(seed_ids))
+    seed_rating, other_rating = aliased(Rating), aliased(Rating)
+    pairs = select(seed_rating.book_id, other_rating.book_id) \
+        .join(other_rating, other_rating.user_id == seed_rating.user_id) \
+        .where(seed_rating.book_id.in_(seed_ids), seed_rating.rating == 5, seed_rating.user_id != user_id,
+               other_rating.rating == 5, other_rating.book_id.not_in(seed_ids)) \
+        .distinct()
+    seeds, alike_partials, pair_partials = await asyncio.gather(
+        databases.fetch(databases.main, select(Book.id).where(Book.id.in_(seed_ids)).order_by(Book.id)),
+        databases.scatter(books_alike), databases.scatter(pairs))
+
+    alike = {book_id for rows in alike_partials for book_id, in rows}
+    recommended = {}
+    for rows in pair_partials:
+        for seed_id, book_id in rows:
+            recommended.setdefault(seed_id, set()).add(book_id)
+    wanted = alike | {book_id for book_ids in recommended.values() for book_id in book_ids}
+    average_partials, existing = await asyncio.gather(
+        databases.scatter(_averages_statement(wanted)),
+        databases.fetch(databases.main, select(Book.id).where(Book.id.in_(wanted)).order_by(Book.id)))
+
+    averages = merge_averages(average_partials)
+    ranked = sorted([(book_id, round(averages[book_id], 2)) for book_id, in existing if book_id in averages],
+                    key=lambda x: x[1], reverse=True)
+    return {
+        'sorted': [(book_id, avg) for book_id, avg in ranked if book_id in alike],
+        'separate': [(seed_id, [(book_id, avg) for book_id, avg in ranked if book_id in recommended.get(seed_id, ())])
+                     for seed_id, in seeds],
+    }
+
+
+async def gather_search(catalog, reviewed: bool, rated: bool) -> Tuple[List[int], Optional[set], Dict[int, float]]:
+    """
+    Run the catalog query of a search and the shard queries it needs at the same time.
+
+    Args:
+        catalog: A statement selecting the IDs of the books matching the title, author and genre criteria.
+        reviewed (bool): Whether to gather the IDs of the reviewed books from every shard.
+        rated (bool): Whether to gather the average ratings from every shard.
+
+    Returns:
+        Tuple[List[int], Optional[set], Dict[int, float]]: The IDs of the matching books, the IDs of the reviewed
+        books or None if not gathered, and the average rating of each rated book, empty if not gathered.
+    """
+    databases = get_async_databases()
+    book_ids, reviewed_partials, average_partials = await asyncio.gather(
+        databases.fetch(databases.main, catalog),
+        databases.scatter(select(Review.book_id).distinct()) if reviewed else _nothing(),
+        databases.scatter(_averages_statement()) if rated else _nothing())
+    reviewed_ids = {book_id for rows in reviewed_partials for book_id, in rows} if reviewed else None
+    return [book_id for book_id, in book_ids], reviewed_ids, merge_averages(average_partials or [])
+
+
+def benchmark_async_queries(app: Flask, users: int = 10, requests: int = 20) -> dict:
+    """
+    Measure the recommendation data and a rating search, computed without and with `ASYNC_QUERIES_ENABLED`.
+
+    Recommendations are computed directly, without the cache. The search filters and sorts by average rating, so
+    it gathers the ratings of every shard; without shards it is a single query either way.
+
+    Args:
+        app (Flask): The application whose databases are queried.
+        users (int): Number of users, the first ones by ID, whose recommendations are computed.
+        requests (int): Number of times each is computed per mode.
+
+    Returns:
+        dict: For 'recommendations' and 'search', the mean milliseconds per computation for 'sync' and 'async'.
+    """
+    from book_system_project.routes import compute_recommendations, search_books
+    results = {'recommendations': {}, 'search': {}}
+    with app.app_context():
+        enabled = app.config.get('ASYNC_QUERIES_ENABLED', False)
+        user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id).limit(users)]
+        computations = requests * len(user_ids) or 1
+        try:
+            for mode in ('sync', 'async'):
+                app.config['ASYNC_QUERIES_ENABLED'] = mode == 'async'
+                started = time.perf_counter()
+                for _ in range(requests):
+                    for user_id in user_ids:
+                        compute_recommendations(user_id)
+                results['recommendations'][mode] = (time.perf_counter() - started) * 1000 / computations
+                started = time.perf_counter()
+                for _ in range(requests):
+                    search_books(rating_min=3, sort_by='rating_desc')
+                results['search'][mode] = (time.perf_counter() - started) * 1000 / requests
+        finally:
+            app.config['ASYNC_QUERIES_ENABLED'] = enabled
+    return results
@@ -0,0 +1,293 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List
+from flask import current_app
+
+MISSING = object()
+USER_CACHE_KEY = 'user:{user_id}'
+RECOMMENDATIONS_CACHE_KEY = 'recommendations:{user_id}:{version}'
+RATINGS_VERSION_KEY = 'ratings_version:{user_id}'
+SIMILARITY_VERSION_KEY = 'similarity_version:{book_id}'
+SIMILARITY_EPOCH_KEY = 'similarity_version:all'
+ACTIVITY_VERSION_KEY = 'activity_version'
+ACTIVITY_VERSION_TTL = 7 * 24 * 3600
+
+
+class Cache:
+    """
+    Base class of the cache backends.
+
+    Backends implement `_get`, `_set`, `delete` and `incr`; this class adds hit and miss counting and `get_or_set`,
+    which recomputes a missing value only once while other callers asking for the same key wait for it. Cached
+    values should be plain data such as IDs and numbers rather than ORM objects, which belong to a single session.
+
+    Attributes:
+        default_ttl (int): Seconds a value is kept when `set` is given no TTL.
+        hits (int): Number of lookups that found a value.
+        misses (int): Number of lookups that found nothing.
+        shared (bool): Whether all worker processes see the same values, so a `delete` reaches every one of them.
+    """
+    shared = False
+
+    def __init__(self, default_ttl: int = 60):
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def _get(self, key: str):
+        raise NotImplementedError
+
+    def _set(self, key: str, value, ttl: int) -> None:
+        raise NotImplementedError
+
+    def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, key: str, ttl: int) -> int:
+        """
+        Atomically increment an integer counter, creating it with the value 1 and the given TTL if missing.
+
+        The TTL is not extended by later increments, so the counter covers a fixed window of time.
+
+        Returns:
+            int: The new value of the counter.
+        """
+        raise NotImplementedError
+
+    def evictions(self) -> int:
+        return 0
+
+    def get(self, key: str, default=None):
+        """Return the cached value of a key, or `default` if it is missing or expired."""
+        value = self._get(key)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: List[str]) -> list:
+        """Return the cached values of several keys, None for each missing or expired one."""
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value, ttl: int = None) -> None:
+        """Cache a value for `ttl` seconds, or `default_ttl` if not given."""
+        self._set(key, value, self.default_ttl if ttl is None else ttl)
+
+    def _flight_lock(self, key: str) -> threading.Lock:
+        with self._flights_lock:
+            return self._flights.setdefault(key, threading.Lock())
+
+    def get_or_set(self, key: str, compute, ttl: int = None):
+        """
+        Return the cached value of a key, computing and caching it if missing.
+
+        Concurrent callers missing the same key in this process wait for the first one to compute the value instead
+        of all recomputing it.
+
+        Args:
+            key (str): The cache key.
+            compute (callable): Called without arguments to compute the value.
+            ttl (int): Seconds to keep the computed value, `default_ttl` if not given.
+
+        Returns:
+            The cached or computed value.
+        """
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        lock = self._flight_lock(key)
+        with lock:
+            value = self._get(key)
+            if value is MISSING:
+                value = compute()
+                self.set(key, value, ttl)
+        with self._flights_lock:
+            if self._flights.get(key) is lock and not lock.locked():
+                del self._flights[key]
+        return value
+
+    def stats(self) -> dict:
+        """Return the hit, miss and eviction counts."""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions()}
+
+
+class LocalCache(Cache):
+    """
+    In-process LRU cache with per-entry expiry.
+
+    Every worker process has its own copy, so values may differ between workers until they expire.
+
+    Attributes:
+        max_entries (int): Number of entries kept; the least recently used one is evicted beyond it.
+    """
+    def __init__(self, max_entries: int = 1024, default_ttl: int = 60):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def incr(self, key: str, ttl: int) -> int:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                entry = (time.monotonic() + ttl, 0)
+            entry = (entry[0], entry[1] + 1)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            return entry[1]
+
+    def evictions(self) -> int:
+        return self._evictions
+
+
+class RedisCache(Cache):
+    """
+    Cache shared by all worker processes, stored in Redis or any server speaking its protocol.
+
+    Values are pickled. Besides the in-process wait of `get_or_set`, a short-lived lock key in Redis makes workers in
+    other processes wait for the value too, polling until it appears or the lock expires.
+
+    Attributes:
+        client (redis.Redis): The Redis client.
+        prefix (str): Prefix added to every key, so several apps can share a server.
+        lock_timeout (float): Seconds the recompute lock is held at most.
+    """
+    shared = True
+
+    def __init__(self, client, prefix: str = '', default_ttl: int = 60, lock_timeout: float = 10.0):
+        super().__init__(default_ttl)
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+
+    def _get(self, key: str):
+        data = self.client.get(self.prefix + key)
+        return MISSING if data is None else pickle.loads(data)
+
+    def get_many(self, keys: List[str]) -> list:
+        values = [MISSING if data is None else pickle.loads(data)
+                  for data in self.client.mget([self.prefix + key for key in keys])] if keys else []
+        misses = values.count(MISSING)
+        self.misses += misses
+        self.hits += len(values) - misses
+        return [None if value is MISSING else value for value in values]
+
+    def _set(self, key: str, value, ttl: int) -> None:
+        self.client.set(self.prefix + key, pickle.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def incr(self, key: str, ttl: int) -> int:
+        pipeline = self.client.pipeline()
+        pipeline.set(self.prefix + key, 0, nx=True, px=int(ttl * 1000))
+        pipeline.incr(self.prefix + key)
+        return int(pipeline.execute()[1])
+
+    def get_or_set(self, key: str, compute, ttl: int = None):
+        def compute_once():
+            lock_key = f'{self.prefix}lock:{key}'
+            deadline = time.monotonic() + self.lock_timeout
+            while not self.client.set(lock_key, os.getpid(), nx=True, px=int(self.lock_timeout * 1000)):
+                if time.monotonic() >= deadline:
+                    return compute()
+                time.sleep(0.05)
+                value = self._get(key)
+                if value is not MISSING:
+                    return value
+            try:
+                return compute()
+            finally:
+                self.client.delete(lock_key)
+        return super().get_or_set(key, compute_once, ttl)
+
+    def evictions(self) -> int:
+        """Return the number of keys the server evicted for lack of memory, across all its clients."""
+        try:
+            return int(self.client.info('stats').get('evicted_keys', 0))
+        except Exception:
+            return 0
+
+
+def get_cache() -> Cache:
+    """
+    Return the cache of the current app, creating it on first use in each process.
+
+    `CACHE_TYPE` selects the backend: 'local' (default) for an in-process `LocalCache` of `CACHE_MAX_ENTRIES`
+    entries (default 1024), or 'redis' for a `RedisCache` connected to `CACHE_REDIS_URL`, which needs the `redis`
+    package. `CACHE_DEFAULT_TTL` (default 60) sets the expiry in seconds and `CACHE_KEY_PREFIX` (default
+    'book_system:') the Redis key prefix.
+
+    Returns:
+        Cache: The app's cache.
+    """
+    cache = current_app.extensions.get('cache')
+    if cache is None or cache[0] != os.getpid():
+        config = current_app.config
+        ttl = config.get('CACHE_DEFAULT_TTL', 60)
+        if config.get('CACHE_TYPE', 'local') == 'redis':
+            import redis
+            backend = RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']),
+                                 prefix=config.get('CACHE_KEY_PREFIX', 'book_system:'), default_ttl=ttl)
+        else:
+            backend = LocalCache(max_entries=config.get('CACHE_MAX_ENTRIES', 1024), default_ttl=ttl)
+        cache = current_app.extensions['cache'] = (os.getpid(), backend)
+    return cache[1]
+
+
+def activity_version() -> str:
+    """
+    Return the version stamp of the ratings, reviews and read lists, part of the keys of the cached leaderboards and
+    search results, creating one if it is missing.
+
+    With a per-process cache, the stamp only changes in the worker that handled a write, and the other workers see
+    the write once their entries expire after `CACHE_DEFAULT_TTL` seconds.
+    """
+    cache = get_cache()
+    version = cache.get(ACTIVITY_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(ACTIVITY_VERSION_KEY, version, ttl=ACTIVITY_VERSION_TTL)
+    return version
+
+
+def bump_activity_version() -> None:
+    """Give the ratings, reviews and read lists a new version, so cached leaderboards and searches are recomputed."""
+    get_cache().set(ACTIVITY_VERSION_KEY, uuid.uuid4().hex, ttl=ACTIVITY_VERSION_TTL)
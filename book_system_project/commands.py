@@ -0,0 +1,165 @@
+import click
+from flask import current_app
+from book_system_project.also_liked import rebuild_also_liked
+from book_system_project.models import dedupe_activity
+
+
+@click.command("rebuild-also-liked")
+def rebuild_also_liked_command():
+    """Recompute the "users who liked this also liked" table from all ratings."""
+    rows = rebuild_also_liked()
+    click.echo(f"Also liked table rebuilt with {rows} rows.")
+
+
+@click.command("rebuild-analytics")
+def rebuild_analytics_command():
+    """Recompute the analytics dashboard sketches from all ratings, reviews and read lists."""
+    from book_system_project.analytics import rebuild_analytics
+    rebuild_analytics()
+    click.echo("Analytics sketches rebuilt.")
+
+
+@click.command("rollup-analytics")
+@click.option("--full", is_flag=True, help="Recompute the daily activity of every day, not only the recent ones.")
+def rollup_analytics_command(full):
+    """Fold the recorded analytics events into the sketches and refresh the analytics dashboard rollup tables."""
+    from book_system_project.analytics import fold_analytics
+    from book_system_project.rollups import run_rollups
+    click.echo(f"Folded {fold_analytics()} analytics event(s) into the sketches.")
+    for table, count in run_rollups(full=full).items():
+        click.echo(f"Wrote {count} row(s) to {table}.")
+
+
+@click.command("train-recommender")
+@click.option("--factors", default=16, show_default=True, help="Number of latent factors.")
+@click.option("--reg", default=0.1, show_default=True, help="L2 regularization strength.")
+@click.option("--iterations", default=15, show_default=True, help="Number of ALS iterations.")
+@click.option("--holdout", default=0.1, show_default=True, help="Fraction of ratings held out for the RMSE.")
+@click.option("--seed", default=0, show_default=True, help="Random seed.")
+def train_recommender_command(factors, reg, iterations, holdout, seed):
+    """Train the matrix factorization recommender on all ratings and publish it to the model store."""
+    from book_system_project.factorization import train_model
+    from book_system_project.model_store import get_model_store
+    store = get_model_store()
+    version = store.new_version()
+    meta = train_model(store.version_dir(version), factors=factors, reg=reg, iterations=iterations, holdout=holdout,
+                       seed=seed)
+    store.publish(version)
+    click.echo(f"Trained on {meta['ratings']} ratings, published as version {version}.")
+    click.echo(f"Train RMSE: {meta['train_rmse']:.4f}")
+    if meta['holdout_rmse'] is not None:
+        click.echo(f"Held-out RMSE: {meta['holdout_rmse']:.4f}")
+
+
+@click.command("dedupe-activity")
+def dedupe_activity_command():
+    """Remove duplicate ratings, reviews and read list entries and add the unique indexes preventing them."""
+    deleted = dedupe_activity()
+    for table, count in deleted.items():
+        click.echo(f"Deleted {count} duplicate row(s) from {table}.")
+    if deleted['rating']:
+        rebuild_also_liked()
+        click.echo("Also liked table rebuilt.")
+
+
+@click.command("seed-books")
+def seed_books_command():
+    """Add the demo books with their authors and genres."""
+    from book_system_project.seed import seed_books
+    click.echo(f"Added {seed_books()} book(s).")
+
+
+@click.command("seed-users")
+def seed_users_command():
+    """Add the demo users."""
+    from book_system_project.seed import seed_users
+    click.echo(f"Added {seed_users()} user(s).")
+
+
+@click.command("seed-ratings")
+def seed_ratings_command():
+    """Add random ratings, read list entries and reviews for every user."""
+    from book_system_project.seed import seed_ratings
+    seed_ratings()
+    click.echo("Ratings, read list and reviews have been added.")
+
+
+@click.command("benchmark-logging")
+@click.option("--requests", "requests_count", default=500, show_default=True, help="Requests per setup.")
+@click.option("--records", default=10000, show_default=True, help="Log calls per setup.")
+@click.option("--path", default="/", show_default=True, help="URL to request.")
+@click.option("--stall-ms", default=0.0, show_default=True, help="Milliseconds added to every log file write.")
+def benchmark_logging_command(requests_count, records, path, stall_ms):
+    """Compare request and log call latency with a synchronous file handler and with the queued logging."""
+    from book_system_project.structured_logging import benchmark_logging
+    results = benchmark_logging(current_app._get_current_object(), requests_count, records, path, stall_ms)
+    for setup, result in results.items():
+        click.echo(f"{setup}: {result['ms_per_request']:.3f} ms per request, "
+                   f"{result['us_per_log_call']:.1f} us per log call, {result['dropped']} record(s) dropped")
+
+
+@click.command("compress-static")
+def compress_static_command():
+    """Write the pre-compressed .gz (and .br, with brotli installed) variants of the static files."""
+    from book_system_project.compression import compress_static
+    written = compress_static(current_app.static_folder)
+    click.echo(f"Wrote {len(written)} pre-compressed file(s).")
+
+
+@click.command("benchmark-compression")
+@click.option("--path", "paths", multiple=True, default=["/", "/all_ratings"], show_default=True,
+              help="URL to request, can be repeated.")
+@click.option("--requests", "requests_count", default=200, show_default=True, help="Requests per path and encoding.")
+def benchmark_compression_command(paths, requests_count):
+    """Compare response sizes and server time with and without compression."""
+    from book_system_project.compression import benchmark_compression
+    results = benchmark_compression(current_app._get_current_object(), list(paths), requests_count)
+    for path, encodings in results.items():
+        identity = encodings['identity']['bytes']
+        for encoding, result in encodings.items():
+            saved = 1 - result['bytes'] / identity if identity else 0
+            click.echo(f"{path} {encoding}: {result['bytes']} bytes ({saved:.0%} saved), "
+                       f"{result['ms_per_request']:.3f} ms per request")
+
+
+@click.command("benchmark-async-queries")
+@click.option("--users", default=10, show_default=True, help="Number of users whose recommendations are computed.")
+@click.option("--requests", "requests_count", default=20, show_default=True, help="Computations per user and mode.")
+def benchmark_async_queries_command(users, requests_count):
+    """Compare the recommendation and rating search queries run one after the other and concurrently."""
+    from book_system_project.async_db import benchmark_async_queries
+    results = benchmark_async_queries(current_app._get_current_object(), users, requests_count)
+    for page, modes in results.items():
+        click.echo(f"{page}: {modes['sync']:.3f} ms sequential, {modes['async']:.3f} ms concurrent")
+
+
+@click.command("shard-activity")
+def shard_activity_command():
+    """Copy the ratings, read lists and reviews of the main database to the shards listed in ACTIVITY_SHARDS."""
+    from book_system_project.sharding import copy_activity_to_shards, get_router
+    if not get_router().sharded:
+        raise click.UsageError("Set ACTIVITY_SHARDS to the database URIs of the shards first.")
+    for table, count in copy_activity_to_shards().items():
+        click.echo(f"Copied {count} row(s) of {table} to {get_router().shard_count} shards.")
+
+
+def register_commands(app):
+    """
+    Register the application's CLI commands with the Flask app.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+    app.cli.add_command(rebuild_also_liked_command)
+    app.cli.add_command(rebuild_analytics_command)
+    app.cli.add_command(rollup_analytics_command)
+    app.cli.add_command(train_recommender_command)
+    app.cli.add_command(dedupe_activity_command)
+    app.cli.add_command(seed_books_command)
+    app.cli.add_command(seed_users_command)
+    app.cli.add_command(seed_ratings_command)
+    app.cli.add_command(benchmark_logging_command)
+    app.cli.add_command(compress_static_command)
+    app.cli.add_command(benchmark_compression_command)
+    app.cli.add_command(benchmark_async_queries_command)
+    app.cli.add_command(shard_activity_command)
@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+import zlib
+from typing import Iterable, Iterator, List
+from flask import Flask, Response, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                          'application/json', 'image/svg+xml'}
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def available_encodings() -> List[str]:
+    """Return the content encodings this process can produce, the preferred first: brotli if installed, and gzip."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    """
+    Compress data with 'br' or 'gzip'.
+
+    Args:
+        data (bytes): The data to compress.
+        encoding (str): The content encoding.
+        level (int): The brotli quality (0-11, default 5) or gzip level (1-9, default 6).
+
+    Returns:
+        bytes: The compressed data.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=5 if level is None else level)
+    return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+
+
+def compress_stream(chunks: Iterable, encoding: str, level: int = None) -> Iterator[bytes]:
+    """
+    Compress the chunks of a streamed response with 'br' or 'gzip', flushing the compressor after every chunk.
+
+    Each compressed chunk can be decoded as soon as it arrives, so the browser still renders a streamed page
+    progressively. Closing the returned generator closes `chunks` too.
+
+    Args:
+        chunks: The chunks of the response, as bytes or strings encoded in UTF-8.
+        encoding (str): The content encoding.
+        level (int): The brotli quality (0-11, default 5) or gzip level (1-9, default 6).
+
+    Yields:
+        bytes: The compressed chunks, ending with the end of the compressed stream.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5 if level is None else level)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    try:
+        for chunk in chunks:
+            data = process(chunk.encode() if isinstance(chunk, str) else chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def static_hash(app: Flask, filename: str):
+    """
+    Return a short hash of the content of a static file, or None if there is no such file.
+
+    Hashes are kept per file modification time, so a changed file gets a new hash without a restart.
+    """
+    path = safe_join(app.static_folder, filename) if app.static_folder else None
+    if path is None or not os.path.isfile(path):
+        return None
+    hashes = app.extensions.setdefault('static_hashes', {})
+    mtime = os.path.getmtime(path)
+    cached = hashes.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as file:
+            cached = hashes[path] = (mtime, hashlib.sha256(file.read()).hexdigest()[:12])
+    return cached[1]
+
+
+def _precompressed(filename: str):
+    """Return the response of the pre-compressed variant of a static file the client accepts, or None."""
+    static_folder = current_app.static_folder
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+        variant = path + suffix
+        if request.accept_encodings[encoding] and os.path.isfile(variant) \
+                and os.path.getmtime(variant) >= os.path.getmtime(path):
+            response = send_from_directory(static_folder, filename + suffix,
+                                           mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+
+def init_compression(app: Flask) -> None:
+    """
+    Compress responses and let browsers cache static files for a year.
+
+    HTML, CSS, JavaScript, JSON and plain text responses of at least `COMPRESS_MIN_SIZE` bytes (default 500) are
+    compressed with brotli, when the `brotli` package is installed and the client accepts it, or else gzip, at
+    `COMPRESS_BR_LEVEL` (default 5) and `COMPRESS_LEVEL` (default 6). Streamed responses are compressed chunk by
+    chunk whatever their size, see `compress_stream`, and file responses are left alone.
+    Static files are served from their pre-compressed `.br` or `.gz` variants when these exist and are not older
+    than the file, see `compress_static`. `COMPRESS_ENABLED` (default True) turns compression off.
+
+    `url_for('static', ...)` adds the `v` argument, a hash of the file's content, so a changed file gets a new URL.
+    Requests carrying the current hash are answered with a far-future `Cache-Control` of `STATIC_MAX_AGE` seconds
+    (default one year). `STATIC_FINGERPRINT` (default True) turns fingerprinting off.
+
+    Args:
+        app (Flask): The application.
+    """
+    @app.url_defaults
+    def add_static_hash(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values \
+                and current_app.config.get('STATIC_FINGERPRINT', True):
+            version = static_hash(current_app, values['filename'])
+            if version:
+                values['v'] = version
+
+    @app.before_request
+    def serve_precompressed():
+        if request.endpoint == 'static' and current_app.config.get('COMPRESS_ENABLED', True):
+            return _precompressed(request.view_args['filename'])
+
+    @app.after_request
+    def compress_response(response: Response) -> Response:
+        config = current_app.config
+        if request.endpoint == 'static':
+            version = request.args.get('v')
+            if version and version == static_hash(current_app, request.view_args['filename']):
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = config.get('STATIC_MAX_AGE', STATIC_MAX_AGE)
+                response.cache_control.immutable = True
+            return response
+        if not config.get('COMPRESS_ENABLED', True) or response.direct_passthrough \
+                or response.status_code != 200 or 'Content-Encoding' in response.headers \
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES \
+                or not response.is_streamed and len(response.get_data()) < config.get('COMPRESS_MIN_SIZE', 500):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return response
+        level = config.get('COMPRESS_BR_LEVEL' if encoding == 'br' else 'COMPRESS_LEVEL')
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress(response.get_data(), encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def compress_static(static_folder: str, min_size: int = 500) -> List[str]:
+    """
+    Write the pre-compressed variants of the compressible static files of a folder, at the highest levels.
+
+    A `.gz` variant is written for every CSS, JavaScript, SVG, JSON or text file of at least `min_size` bytes, and a
+    `.br` variant too when the `brotli` package is installed. Up to date variants are skipped.
+
+    Args:
+        static_folder (str): The static folder.
+        min_size (int): Smaller files are not compressed.
+
+    Returns:
+        List[str]: The paths of the variants written.
+    """
+    written = []
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if mimetypes.guess_type(filename)[0] not in COMPRESSIBLE_MIMETYPES or os.path.getsize(path) < min_size:
+                continue
+            for encoding in available_encodings():
+                variant = path + PRECOMPRESSED_SUFFIXES[encoding]
+                if os.path.isfile(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+                    continue
+                with open(path, 'rb') as file:
+                    data = compress(file.read(), encoding, 11 if encoding == 'br' else 9)
+                with open(variant, 'wb') as file:
+                    file.write(data)
+                written.append(variant)
+    return written
+
+
+def benchmark_compression(app: Flask, paths: List[str], requests: int = 200) -> dict:
+    """
+    Measure the size and the server time of responses with and without compression, with the test client.
+
+    Args:
+        app (Flask): The application to send the requests to.
+        paths (List[str]): The URLs requested.
+        requests (int): Number of requests per path and encoding.
+
+    Returns:
+        dict: For each path, and for 'identity' and each available encoding, the response size in bytes and the
+        mean milliseconds per request.
+    """
+    client = app.test_client()
+    results = {}
+    for path in paths:
+        results[path] = {}
+        for encoding in ['identity'] + available_encodings():
+            headers = {'Accept-Encoding': encoding}
+            response = client.get(path, headers=headers)
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get(path, headers=headers).get_data()
+            results[path][encoding] = {'bytes': len(response.get_data()),
+                                       'ms_per_request': (time.perf_counter() - started) * 1000 / requests}
+    return results
@@ -0,0 +1,230 @@
+import json
+import os
+import numpy as np
+from book_system_project.models import Rating, ToRead
+from book_system_project.sharding import get_router
+from typing import List, Tuple
+
+USER_FACTORS_FILE = 'user_factors.npy'
+ITEM_FACTORS_FILE = 'item_factors.npy'
+USER_IDS_FILE = 'user_ids.npy'
+BOOK_IDS_FILE = 'book_ids.npy'
+META_FILE = 'meta.json'
+
+
+def load_ratings() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read all ratings of every shard as parallel arrays.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The user IDs, book IDs and rating values of every rating.
+    """
+    def partial(session):
+        return session.query(Rating.user_id, Rating.book_id, Rating.rating).filter(Rating.rating.isnot(None)).all()
+    rows = [row for partial_rows in get_router().scatter(partial) for row in partial_rows]
+    data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+def _solve_factors(fixed: np.ndarray, index: np.ndarray, other_index: np.ndarray, values: np.ndarray,
+                   size: int, reg: float) -> np.ndarray:
+    """
+    Solve the regularized least squares problem of one ALS half-step.
+
+    Args:
+        fixed (np.ndarray): The factor matrix held fixed in this half-step.
+        index (np.ndarray): For every rating, the row of the factor matrix being solved.
+        other_index (np.ndarray): For every rating, the row of the fixed factor matrix.
+        values (np.ndarray): The (centered) rating values.
+        size (int): Number of rows of the factor matrix being solved.
+        reg (float): L2 regularization strength.
+
+    Returns:
+        np.ndarray: The new factor matrix, of shape (size, factors).
+    """
+    factors = fixed.shape[1]
+    result = np.zeros((size, factors))
+    order = np.argsort(index, kind='stable')
+    bounds = np.searchsorted(index[order], np.arange(size + 1))
+    identity = reg * np.eye(factors)
+    for row in range(size):
+        selected = order[bounds[row]:bounds[row + 1]]
+        if not len(selected):
+            continue
+        other = fixed[other_index[selected]]
+        result[row] = np.linalg.solve(other.T @ other + identity * len(selected), other.T @ values[selected])
+    return result
+
+
+def train_als(user_index: np.ndarray, book_index: np.ndarray, values: np.ndarray, n_users: int, n_books: int,
+              factors: int = 16, reg: float = 0.1, iterations: int = 15,
+              seed: int = 0) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Factorize the rating matrix with alternating least squares.
+
+    Ratings are centered on their global mean, and a rating is predicted as the mean plus the dot product of the
+    user's and the book's factor vectors.
+
+    Args:
+        user_index (np.ndarray): Row of the user factor matrix for every rating.
+        book_index (np.ndarray): Row of the item factor matrix for every rating.
+        values (np.ndarray): Rating values.
+        n_users (int): Number of users.
+        n_books (int): Number of books.
+        factors (int): Number of latent factors.
+        reg (float): L2 regularization strength, scaled by the number of ratings of each user or book.
+        iterations (int): Number of ALS iterations.
+        seed (int): Seed for the random initialization.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, float]: The user factors, the item factors and the global mean rating.
+    """
+    rng = np.random.default_rng(seed)
+    global_mean = float(values.mean()) if len(values) else 0.0
+    centered = values - global_mean
+    user_factors = rng.normal(scale=0.1, size=(n_users, factors))
+    item_factors = rng.normal(scale=0.1, size=(n_books, factors))
+    for _ in range(iterations):
+        user_factors = _solve_factors(item_factors, user_index, book_index, centered, n_users, reg)
+        item_factors = _solve_factors(user_factors, book_index, user_index, centered, n_books, reg)
+    return user_factors, item_factors, global_mean
+
+
+def rmse(user_factors: np.ndarray, item_factors: np.ndarray, global_mean: float, user_index: np.ndarray,
+         book_index: np.ndarray, values: np.ndarray) -> float:
+    """
+    Compute the root mean squared error of the model on the given ratings.
+
+    Predictions are clipped to the 1-5 rating scale before comparing.
+
+    Returns:
+        float: The RMSE, or NaN if no ratings are given.
+    """
+    if not len(values):
+        return float('nan')
+    predicted = global_mean + np.einsum('ij,ij->i', user_factors[user_index], item_factors[book_index])
+    return float(np.sqrt(np.mean((np.clip(predicted, 1, 5) - values) ** 2)))
+
+
+def train_model(model_dir: str, factors: int = 16, reg: float = 0.1, iterations: int = 15, holdout: float = 0.1,
+                seed: int = 0) -> dict:
+    """
+    Train the matrix factorization model on all ratings and save it to `model_dir`.
+
+    If `holdout` is above zero, a model is first trained without that fraction of the ratings and evaluated on it,
+    then the saved model is trained on all ratings. Factor matrices and the ID mappings are saved as `.npy` files,
+    which `load_model` opens memory-mapped.
+
+    Args:
+        model_dir (str): Directory to save the model files to, created if missing.
+        factors (int): Number of latent factors.
+        reg (float): L2 regularization strength.
+        iterations (int): Number of ALS iterations.
+        holdout (float): Fraction of ratings held out to report the RMSE on.
+        seed (int): Seed for the split and the initialization.
+
+    Returns:
+        dict: Model metadata, including the number of ratings, training RMSE and held-out RMSE.
+    """
+    user_ids, book_ids, values = load_ratings()
+    unique_users, user_index = np.unique(user_ids, return_inverse=True)
+    unique_books, book_index = np.unique(book_ids, return_inverse=True)
+    n_users, n_books = len(unique_users), len(unique_books)
+
+    holdout_rmse = None
+    if holdout > 0 and len(values) > 1:
+        test = np.random.default_rng(seed).random(len(values)) < holdout
+        train = ~test
+        user_factors, item_factors, global_mean = train_als(user_index[train], book_index[train], values[train],
+                                                            n_users, n_books, factors, reg, iterations, seed)
+        holdout_rmse = rmse(user_factors, item_factors, global_mean,
+                            user_index[test], book_index[test], values[test])
+
+    user_factors, item_factors, global_mean = train_als(user_index, book_index, values, n_users, n_books,
+                                                        factors, reg, iterations, seed)
+    meta = {
+        'factors': factors,
+        'ratings': int(len(values)),
+        'global_mean': global_mean,
+        'train_rmse': rmse(user_factors, item_factors, global_mean, user_index, book_index, values),
+        'holdout_rmse': holdout_rmse,
+    }
+
+    os.makedirs(model_dir, exist_ok=True)
+    np.save(os.path.join(model_dir, USER_FACTORS_FILE), user_factors.astype(np.float32))
+    np.save(os.path.join(model_dir, ITEM_FACTORS_FILE), item_factors.astype(np.float32))
+    np.save(os.path.join(model_dir, USER_IDS_FILE), unique_users)
+    np.save(os.path.join(model_dir, BOOK_IDS_FILE), unique_books)
+    with open(os.path.join(model_dir, META_FILE), 'w') as file:
+        json.dump(meta, file, indent=4)
+    return meta
+
+
+def load_model(model_dir: str) -> dict:
+    """
+    Open a saved model with its factor matrices and ID mappings memory-mapped.
+
+    Args:
+        model_dir (str): Directory the model was saved to by `train_model`.
+
+    Returns:
+        dict: The arrays under the keys 'user_factors', 'item_factors', 'user_ids' and 'book_ids', and the
+              metadata under 'meta'.
+    """
+    model = {name: np.load(os.path.join(model_dir, f'{name}.npy'), mmap_mode='r')
+             for name in ('user_factors', 'item_factors', 'user_ids', 'book_ids')}
+    with open(os.path.join(model_dir, META_FILE)) as file:
+        model['meta'] = json.load(file)
+    return model
+
+
+def recommend(model: dict, user_id: int, k: int = 10, exclude_book_ids=()) -> List[Tuple[int, float]]:
+    """
+    Score every book for a user and return the top `k`.
+
+    Scores are the dot products of the user's factor vector with all item factors, computed in one matrix-vector
+    product. `np.argpartition` selects the top `k` without sorting all books.
+
+    Args:
+        model (dict): A model opened by `load_model`.
+        user_id (int): The ID of the user to recommend books for.
+        k (int): Number of books to return.
+        exclude_book_ids: Book IDs never to recommend, such as books already rated or read listed.
+
+    Returns:
+        List[Tuple[int, float]]: Book IDs with their predicted ratings, best first. Empty if the user had no
+                                 ratings when the model was trained.
+    """
+    user_ids, book_ids = model['user_ids'], model['book_ids']
+    position = np.searchsorted(user_ids, user_id)
+    if position >= len(user_ids) or user_ids[position] != user_id:
+        return []
+    scores = model['item_factors'] @ model['user_factors'][position] + model['meta']['global_mean']
+    excluded = np.isin(book_ids, np.fromiter(exclude_book_ids, dtype=np.int64))
+    scores[excluded] = -np.inf
+    k = min(k, int((~excluded).sum()))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(int(book_ids[i]), float(scores[i])) for i in top]
+
+
+def recommend_for_user(model: dict, user_id: int, k: int = 10) -> List[Tuple[int, float]]:
+    """
+    Return the top `k` books for a user, leaving out the books they rated or added to their read list, as read
+    from the user's shard.
+
+    Args:
+        model (dict): A model opened by `load_model`.
+        user_id (int): The ID of the user.
+        k (int): Number of books to return.
+
+    Returns:
+        List[Tuple[int, float]]: Book IDs with their predicted ratings, best first.
+    """
+    session = get_router().session(user_id)
+    rated = session.query(Rating.book_id).filter(Rating.user_id == user_id)
+    read_listed = session.query(ToRead.book_id).filter(ToRead.user_id == user_id)
+    excluded = {book_id for book_id, in rated.union(read_listed)}
+    return recommend(model, user_id, k, excluded)
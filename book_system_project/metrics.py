@@ -0,0 +1,329 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+from flask import Flask, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    A named metric with a value per combination of label values, rendered in the Prometheus text format.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        labelnames (Tuple[str]): The names of the labels.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[list]:
+        """Return the current values as [label values, value] pairs, the format of the multiprocess files."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    """A value that only goes up, such as a number of requests."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """Set the total, for counters mirroring a count kept elsewhere in the process, such as cache hits."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, such as a queue depth.
+
+    Attributes:
+        multiprocess_mode (str): How the values of the worker processes are combined, 'sum' or 'max'. Only live
+            processes are included.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 multiprocess_mode: str = 'sum'):
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    Counts of observed values, such as latencies, per bucket, with their sum and count.
+
+    A value is stored as [bucket counts, sum, count], the bucket counts being non-cumulative; rendering makes them
+    cumulative as the text format requires.
+
+    Attributes:
+        buckets (Tuple[float]): The upper bounds of the buckets, without +Inf.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = [counts, total + value, count + 1]
+
+    def samples(self) -> List[list]:
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, and the collectors refreshing the ones mirrored from elsewhere before each export.
+
+    With several worker processes, every process writes its samples to a JSON file named after its pid in a shared
+    directory, at most once per `flush_interval` seconds and at exit. The endpoint serving `/metrics` merges the files
+    of all processes: counters and histograms are added up, including those of processes that have exited, and
+    gauges are combined with their `multiprocess_mode` over the live processes.
+
+    Attributes:
+        metrics (Dict[str, Metric]): The registered metrics by name.
+        collectors (List[Callable]): Functions called before the metrics are exported.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collect(self) -> Dict[str, List[list]]:
+        """Run the collectors and return the samples of every metric by name."""
+        for collector in self.collectors:
+            collector()
+        return {name: metric.samples() for name, metric in self.metrics.items()}
+
+    def flush(self, directory: str, force: bool = False, flush_interval: float = 1.0) -> None:
+        """Write the samples of this process to its file in `directory`, unless it was written less than
+        `flush_interval` seconds ago."""
+        now = time.monotonic()
+        if not force and now - self._last_flush < flush_interval:
+            return
+        with self._flush_lock:
+            self._last_flush = now
+            path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+            with open(f'{path}.tmp', 'w') as file:
+                json.dump(self.collect(), file)
+            os.replace(f'{path}.tmp', path)
+
+    def merge(self, directory: str) -> Dict[str, Dict[tuple, object]]:
+        """Merge the samples of all processes from the files in `directory`."""
+        merged = {name: {} for name in self.metrics}
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+            try:
+                with open(path) as file:
+                    samples = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(pid)
+            for name, values in samples.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                for labels, value in values:
+                    key = tuple(labels)
+                    previous = merged[name].get(key)
+                    if previous is None:
+                        merged[name][key] = value
+                    elif metric.kind == 'histogram':
+                        merged[name][key] = [[a + b for a, b in zip(previous[0], value[0])],
+                                             previous[1] + value[1], previous[2] + value[2]]
+                    elif metric.kind == 'gauge' and metric.multiprocess_mode == 'max':
+                        merged[name][key] = max(previous, value)
+                    else:
+                        merged[name][key] = previous + value
+        return merged
+
+    def render(self, directory: str = None) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format.
+
+        Args:
+            directory (str): The multiprocess directory, whose files are merged, or None for this process only.
+        """
+        if directory:
+            self.flush(directory, force=True)
+            values = self.merge(directory)
+        else:
+            values = {name: {tuple(labels): value for labels, value in samples}
+                      for name, samples in self.collect().items()}
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(values.get(name, {}).items()):
+                labels = dict(zip(metric.labelnames, key))
+                if metric.kind == 'histogram':
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                        cumulative += bucket_count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = MetricsRegistry()
+REQUESTS = registry.register(Counter('http_requests_total', 'Requests handled, by endpoint, method and status.',
+                                     ('endpoint', 'method', 'status')))
+REQUEST_LATENCY = registry.register(Histogram('http_request_duration_seconds', 'Request latency, by endpoint.',
+                                              ('endpoint',)))
+DB_QUERIES = registry.register(Counter('db_queries_total', 'Database statements executed, by endpoint.',
+                                       ('endpoint',)))
+DB_QUERY_TIME = registry.register(Counter('db_query_duration_seconds_total',
+                                          'Time spent executing database statements, by endpoint.', ('endpoint',)))
+CACHE_HITS = registry.register(Counter('cache_hits_total', 'Cache lookups that found a value.'))
+CACHE_MISSES = registry.register(Counter('cache_misses_total', 'Cache lookups that found nothing.'))
+CACHE_EVICTIONS = registry.register(Counter('cache_evictions_total', 'Cache entries evicted to make room.'))
+HASHER_PENDING = registry.register(Gauge('password_hasher_pending', 'Password hashing jobs queued or running.'))
+HASHER_REJECTED = registry.register(Counter('password_hasher_rejected_total',
+                                            'Password hashing jobs rejected because the pool was busy.'))
+
+
+def _endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'none'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    endpoint = _endpoint()
+    DB_QUERIES.inc(endpoint=endpoint)
+    DB_QUERY_TIME.inc(time.perf_counter() - started, endpoint=endpoint)
+
+
+def _collect_app_stats() -> None:
+    """Mirror the cache and password hasher counts of the current app, without creating either of them."""
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('cache')
+    if cache is not None and cache[0] == os.getpid():
+        stats = cache[1].stats()
+        CACHE_HITS.set_total(stats['hits'])
+        CACHE_MISSES.set_total(stats['misses'])
+        CACHE_EVICTIONS.set_total(stats['evictions'])
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is not None and hasher.pid == os.getpid():
+        stats = hasher.stats()
+        HASHER_PENDING.set(stats['pending'])
+        HASHER_REJECTED.set_total(stats['rejected'])
+
+
+registry.collectors.append(_collect_app_stats)
+
+
+def metrics_directory(config) -> str:
+    """Return the multiprocess directory from `METRICS_MULTIPROC_DIR` or the `PROMETHEUS_MULTIPROC_DIR` environment
+    variable, or None when the app runs as a single process."""
+    return config.get('METRICS_MULTIPROC_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def init_metrics(app: Flask) -> None:
+    """
+    Record the count and latency of every request by endpoint, and write this process's samples for `/metrics`.
+
+    With several WSGI worker processes, set `METRICS_MULTIPROC_DIR` to a directory shared by the workers and emptied
+    when the server starts; samples are written to it at most every `METRICS_FLUSH_SECONDS` (default 1) per
+    process and at exit, so a scrape may miss the last second of another worker's requests.
+
+    Args:
+        app (Flask): The application.
+    """
+    @app.before_request
+    def start_metrics_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_started' in g:
+            endpoint = _endpoint()
+            REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+            REQUEST_LATENCY.observe(time.perf_counter() - g.pop('metrics_started'), endpoint=endpoint)
+        directory = metrics_directory(app.config)
+        if directory:
+            registry.flush(directory, flush_interval=app.config.get('METRICS_FLUSH_SECONDS', 1.0))
+        return response
+
+    directory = metrics_directory(app.config)
+    if directory and directory not in _flushed_at_exit:
+        _flushed_at_exit.add(directory)
+        atexit.register(registry.flush, directory, True)
+
+
+_flushed_at_exit = set()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import threading
+from datetime import datetime
+from flask import current_app
+
+CURRENT_FILE = 'CURRENT'
+VERSIONS_DIR = 'versions'
+
+
+class ModelStore:
+    """
+    Versioned on-disk store for the matrix factorization model.
+
+    Every trained model is written to its own directory under `versions/`, and the `CURRENT` file names the version
+    being served. Publishing a version replaces `CURRENT` with an atomic rename, so workers switch to the new model
+    on their next request without a restart and never see a half-written one. Models are opened memory-mapped, so all
+    worker processes share the factor matrices through the page cache instead of each holding a copy.
+
+    Attributes:
+        root (str): Directory holding the `CURRENT` file and the `versions/` directory.
+        keep (int): Number of most recent versions kept on disk when a new one is published.
+    """
+    def __init__(self, root: str, keep: int = 3):
+        self.root = root
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._pointer_stat = None
+        self._version = None
+        self._model = None
+
+    def version_dir(self, version: str) -> str:
+        """Return the directory of the given model version."""
+        return os.path.join(self.root, VERSIONS_DIR, version)
+
+    def new_version(self) -> str:
+        """
+        Create an empty directory for a new model version.
+
+        Returns:
+            str: The name of the new version, a timestamp that sorts in creation order.
+        """
+        version = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        os.makedirs(self.version_dir(version))
+        return version
+
+    def publish(self, version: str) -> None:
+        """
+        Make the given version the one served, then remove old versions beyond `keep`.
+
+        Args:
+            version (str): A version created by `new_version` with the model files written.
+        """
+        temp_path = os.path.join(self.root, f'{CURRENT_FILE}.{os.getpid()}.tmp')
+        with open(temp_path, 'w') as file:
+            file.write(version)
+        os.replace(temp_path, os.path.join(self.root, CURRENT_FILE))
+
+        versions = sorted(os.listdir(os.path.join(self.root, VERSIONS_DIR)))
+        for old_version in versions[:-self.keep]:
+            if old_version != version:
+                shutil.rmtree(self.version_dir(old_version), ignore_errors=True)
+
+    def current_version(self):
+        """
+        Return the name of the version being served.
+
+        Returns:
+            str or None: The version named by the `CURRENT` file, or None if no model was published yet.
+        """
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def open(self):
+        """
+        Return the model being served, reopening it only if a new version was published.
+
+        The `CURRENT` file is only read again when its modification time or inode changes, so the check costs one
+        `stat` per call.
+
+        Returns:
+            dict or None: The model as returned by `load_model`, or None if no model was published yet.
+        """
+        try:
+            stat = os.stat(os.path.join(self.root, CURRENT_FILE))
+            pointer_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if pointer_stat != self._pointer_stat:
+                version = self.current_version()
+                if version != self._version:
+                    from book_system_project.factorization import load_model
+                    self._model = load_model(self.version_dir(version)) if version else None
+                    self._version = version
+                self._pointer_stat = pointer_stat
+            return self._model
+
+
+def get_model_store() -> ModelStore:
+    """
+    Return the model store of the current app, creating it on first use.
+
+    The store lives under the `RECOMMENDER_MODEL_DIR` config value, by default `instance/recommender`.
+
+    Returns:
+        ModelStore: The app's model store.
+    """
+    store = current_app.extensions.get('model_store')
+    if store is None:
+        root = current_app.config.get('RECOMMENDER_MODEL_DIR', os.path.join(current_app.instance_path, 'recommender'))
+        store = current_app.extensions.setdefault('model_store', ModelStore(root))
+    return store
@@ -1,7 +1,6 @@
-from flask_login import UserMixin, current_user
-from flask_admin.contrib.sqla import ModelView
-from flask import flash
+from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 
 db = SQLAlchemy()
 
@@ -121,13 +120,21 @@ class Rating(db.Model):
 
         book (Book):
             Many-to-one relationship with the `Book` model, indicating the book that was rated.
+
+    A user can rate a book only once, enforced by a unique index on (`user_id`, `book_id`). `created_at` and
+    `updated_at` record when the rating was first given and last changed.
     """
+    __table_args__ = (db.Index('uq_rating_user_id_book_id', 'user_id', 'book_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     rating = db.Column(db.Integer)
 
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
 
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
 
 class Author(db.Model):
     """
@@ -175,13 +182,21 @@ class ToRead(db.Model):
 
         book (Book):
             Many-to-one relationship with the `Book` model, indicating the book that the user wants to read.
+
+    A book can be in a user's read list only once, enforced by a unique index on (`user_id`, `book_id`).
+    `created_at` and `updated_at` record when the book was added and last changed.
     """
+    __table_args__ = (db.Index('uq_to_read_user_id_book_id', 'user_id', 'book_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     toread = db.Column(db.Boolean, default=False)
 
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
 
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
 
 class Review(db.Model):
     """
@@ -195,30 +210,283 @@ class Review(db.Model):
 
         book (Book):
             Many-to-one relationship with the `Book` model, indicating the book that is being reviewed.
+
+    A user can review a book only once, enforced by a unique index on (`user_id`, `book_id`). The review text is a
+    deferred column, loaded only when accessed, so queries for review metadata do not pull every review body.
+    `created_at` and `updated_at` record when the review was first written and last changed.
     """
+    __table_args__ = (db.Index('uq_review_user_id_book_id', 'user_id', 'book_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
-    review = db.Column(db.String(1000), nullable=False)
+    review = db.deferred(db.Column(db.String(1000), nullable=False))
 
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
 
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
 
-class AdminModelView(ModelView):
+
+class AlsoLiked(db.Model):
     """
-    Custom ModelView for administrative access control in Flask-Admin.
+    AlsoLiked model storing how many users liked both of two books.
 
-    This view overrides the default `is_accessible` method to restrict access to only users with administrative
-    privileges.
-    Specifically, it checks if the current user is authenticated and has the username "Admin".
+    A user likes a book when they rate it 5. For every pair of books liked by the same user there is a row in each
+    direction, so the books related to a book are found with a single lookup on the (`book_id`, `count`) index.
+    The table is rebuilt by `rebuild_also_liked` and kept up to date incrementally as ratings change.
 
-    Methods:
-        is_accessible():
-            Checks if the current user has administrative access.
-            Returns True if the user is authenticated and their name is "Admin", otherwise False.
-            Displays a flash message if access is denied.
-    """
-    def is_accessible(self):
-        is_admin = current_user.is_authenticated and current_user.name == "Admin"
-        if not is_admin:
-            flash("You dont have permits to access this page!", "error")
-        return is_admin
+    Fields:
+        book_id (int): Foreign key referencing the book the list belongs to.
+        related_book_id (int): Foreign key referencing the book liked by the same users.
+        count (int): Number of users who liked both books.
+
+    Relationships:
+        related_book (Book): Many-to-one relationship with the `Book` model for `related_book_id`.
+    """
+    __table_args__ = (db.Index('ix_also_liked_book_id_count', 'book_id', 'count'),)
+
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), primary_key=True)
+    related_book_id = db.Column(db.Integer, db.ForeignKey("book.id"), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    related_book = db.relationship("Book", foreign_keys=[related_book_id])
+
+
+class AnalyticsSketch(db.Model):
+    """
+    AnalyticsSketch model storing a serialized probabilistic counter for the analytics dashboard.
+
+    Each book has a HyperLogLog sketch of its distinct readers, and the dashboard totals are kept in sketches without
+    a book. The current estimate is stored next to a distinct reader sketch, so ranking books by readers does not
+    need to decode any sketch.
+
+    Fields:
+        key (str): Primary key naming the sketch, e.g. 'readers:42'.
+        book_id (int): Foreign key referencing the book the sketch is about, or None for global sketches.
+        data (bytes): The serialized sketch.
+        estimate (int): The sketch's current estimate, for distinct reader sketches.
+    """
+    __table_args__ = (db.Index('ix_analytics_sketch_estimate', 'estimate'),)
+
+    key = db.Column(db.String(64), primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    estimate = db.Column(db.Integer)
+
+
+class AnalyticsEvent(db.Model):
+    """
+    AnalyticsEvent model queuing one rating, review or read list addition until it is folded into the sketches.
+
+    Writes only append to this table, so concurrent writes never update the same `AnalyticsSketch` row; see
+    `record_activity` and `fold_analytics`.
+
+    Fields:
+        id (int): Primary key, in the order the events were recorded.
+        user_id (int): Foreign key referencing the acting user.
+        book_id (int): Foreign key referencing the book.
+        kind (str): 'rating', 'review' or 'to_read'.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+
+
+class DailyActivity(db.Model):
+    """
+    DailyActivity rollup model summarizing one day of user activity, written by `run_rollups`.
+
+    Fields:
+        day (date): Primary key, the day summarized.
+        ratings (int): Number of ratings given or changed that day.
+        active_raters (int): Number of distinct users who rated a book that day.
+        reviews (int): Number of reviews written that day.
+        to_reads (int): Number of books added to read lists that day.
+    """
+    day = db.Column(db.Date, primary_key=True)
+    ratings = db.Column(db.Integer, nullable=False, default=0)
+    active_raters = db.Column(db.Integer, nullable=False, default=0)
+    reviews = db.Column(db.Integer, nullable=False, default=0)
+    to_reads = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RatingHistogram(db.Model):
+    """
+    RatingHistogram rollup model counting the ratings of each value, written by `run_rollups`.
+
+    Fields:
+        rating (int): Primary key, the rating value.
+        count (int): Number of ratings with this value.
+    """
+    rating = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class GenrePopularity(db.Model):
+    """
+    GenrePopularity rollup model summarizing the activity on the books of each genre, written by `run_rollups`.
+
+    Fields:
+        genre_id (int): Primary key, foreign key referencing the genre.
+        ratings (int): Number of ratings of books in the genre.
+        avg_rating (float): Average rating of books in the genre, or None if none are rated.
+        read_listed (int): Number of read list entries for books in the genre.
+
+    Relationships:
+        genre (Genre): Many-to-one relationship with the `Genre` model.
+    """
+    genre_id = db.Column(db.Integer, db.ForeignKey("genre.id"), primary_key=True)
+    ratings = db.Column(db.Integer, nullable=False, default=0)
+    avg_rating = db.Column(db.Float)
+    read_listed = db.Column(db.Integer, nullable=False, default=0)
+
+    genre = db.relationship("Genre")
+
+
+class CohortRetention(db.Model):
+    """
+    CohortRetention rollup model counting how many users of a weekly cohort were active in a later week, written by
+    `run_rollups`.
+
+    A user's cohort is the week of their first rating, review or read list addition.
+
+    Fields:
+        cohort (date): Primary key, the Monday of the cohort's first week.
+        week (int): Primary key, the number of weeks after the cohort's first week.
+        users (int): Number of users of the cohort active in that week.
+    """
+    cohort = db.Column(db.Date, primary_key=True)
+    week = db.Column(db.Integer, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+
+def upsert(model, values: dict, index_elements: list, update_fields: list, session=None) -> None:
+    """
+    Insert a row, or update the existing row that has the same values in the unique columns, in one statement.
+
+    Uses `INSERT ... ON CONFLICT DO UPDATE` on SQLite and PostgreSQL, and `INSERT ... ON DUPLICATE KEY UPDATE` on
+    MySQL, so concurrent submissions cannot create duplicate rows between a lookup and an insert. The columns in
+    `index_elements` must be covered by a unique index. An `updated_at` column, if the model has one, is set to the
+    current time on update.
+
+    Args:
+        model (db.Model): The model to insert into.
+        values (dict): Column values of the row.
+        index_elements (list): Names of the columns of the unique index that decides whether the row exists.
+        update_fields (list): Names of the columns overwritten with the new values if the row exists.
+        session: The session to execute the statement in, `db.session` if not given, e.g. a user's shard.
+    """
+    if session is None:
+        session = db.session
+    dialect = session.get_bind(mapper=model).dialect.name
+    if dialect == 'mysql':
+        statement = mysql.insert(model).values(**values)
+        set_ = {field: statement.inserted[field] for field in update_fields}
+        if 'updated_at' in model.__table__.c:
+            set_['updated_at'] = db.func.now()
+        statement = statement.on_duplicate_key_update(**set_)
+    else:
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(model).values(**values)
+        set_ = {field: statement.excluded[field] for field in update_fields}
+        if 'updated_at' in model.__table__.c:
+            set_['updated_at'] = db.func.now()
+        statement = statement.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    session.execute(statement)
+
+
+def insert_ignore(model, values: dict, index_elements: list, session=None) -> bool:
+    """
+    Insert a row unless a row with the same values in the unique columns exists, in one statement.
+
+    Uses `INSERT ... ON CONFLICT DO NOTHING` on SQLite and PostgreSQL, and `INSERT IGNORE` on MySQL, so a concurrent
+    duplicate is skipped instead of failing on the unique index.
+
+    Args:
+        model (db.Model): The model to insert into.
+        values (dict): Column values of the row.
+        index_elements (list): Names of the columns of the unique index that decides whether the row exists.
+        session: The session to execute the statement in, `db.session` if not given.
+
+    Returns:
+        bool: Whether the row was inserted.
+    """
+    if session is None:
+        session = db.session
+    dialect = session.get_bind(mapper=model).dialect.name
+    if dialect == 'mysql':
+        statement = mysql.insert(model).values(**values).prefix_with('IGNORE')
+    else:
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
+    return session.execute(statement).rowcount > 0
+
+
+def upsert_previous(model, values: dict, index_elements: list, update_fields: list, previous_field: str,
+                    session=None):
+    """
+    Insert or update a row with `upsert`, and return the value one of its columns had before.
+
+    The previous value is read first, locking the row until the end of the transaction: with `SELECT ... FOR UPDATE`
+    on PostgreSQL and MySQL, and on SQLite, which has no row locks, with a no-op `UPDATE ... RETURNING` that takes
+    the database write lock. The row is then written with `upsert`, or with `insert_ignore` if it did not exist, and
+    read again if a concurrent call inserted it first. So concurrent calls for the same row run one after the other,
+    and each one returns the value written by the one before, which the caller can use to apply exact deltas to
+    derived counts.
+
+    Args:
+        model (db.Model): The model to insert into.
+        values (dict): Column values of the row.
+        index_elements (list): Names of the columns of the unique index that decides whether the row exists.
+        update_fields (list): Names of the columns overwritten with the new values if the row exists.
+        previous_field (str): Name of the column whose previous value is returned.
+        session: The session to execute the statements in, `db.session` if not given.
+
+    Returns:
+        The previous value of `previous_field`, or None if the row was inserted.
+    """
+    if session is None:
+        session = db.session
+    table = model.__table__
+    match = [table.c[field] == values[field] for field in index_elements]
+    if session.get_bind(mapper=model).dialect.name == 'sqlite':
+        read = table.update().where(*match).values({previous_field: table.c[previous_field]}) \
+            .returning(table.c[previous_field])
+    else:
+        read = db.select(table.c[previous_field]).where(*match).with_for_update()
+    while True:
+        previous = session.execute(read).first()
+        if previous is not None:
+            upsert(model, values, index_elements, update_fields, session=session)
+            return previous[0]
+        if insert_ignore(model, values, index_elements, session=session):
+            return None
+
+
+def dedupe_activity() -> dict:
+    """
+    Remove duplicate ratings, reviews and read list entries, then create the unique indexes that prevent them.
+
+    Databases created before the unique indexes existed may hold several rows for the same user and book, which skew
+    average ratings. For every (`user_id`, `book_id`) pair only the newest row, the one with the highest ID, is kept.
+    The indexes are created only if missing, so running this again is harmless. With sharded activity tables, every
+    shard is deduplicated: all the rows of a user are in the same shard.
+
+    Returns:
+        dict: Table names mapped to the number of rows deleted from them.
+    """
+    from book_system_project.sharding import get_router
+    router = get_router()
+    deleted = {}
+    for model in (Rating, Review, ToRead):
+        def partial(session, model=model):
+            newest = session.query(db.func.max(model.id)).group_by(model.user_id, model.book_id)
+            return session.query(model).filter(model.id.not_in(newest)).delete(synchronize_session=False)
+        deleted[model.__tablename__] = sum(router.scatter(partial))
+    router.commit()
+    for session in router.sessions():
+        for model in (Rating, Review, ToRead):
+            for index in model.__table__.indexes:
+                index.create(session.get_bind(mapper=model), checkfirst=True)
+    return deleted
@@ -0,0 +1,122 @@
+import os
+import threading
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError
+from flask import current_app
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashing jobs are already waiting for the pool, or a job timed out."""
+
+
+def _check(hashed: bytes, password: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _generate(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def hash_rounds(hashed: str) -> int:
+    """Return the work factor a bcrypt hash was created with, e.g. 12 for '$2b$12$...'."""
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded worker pool.
+
+    Request threads only wait for the result, and at most `max_pending` jobs may be queued or running at once. Beyond
+    that, `check` and `generate` raise `HasherBusy` immediately instead of queueing, so a burst of login attempts
+    cannot tie up every request worker behind bcrypt. A job that does not finish within `timeout` seconds also
+    raises `HasherBusy`, but keeps counting towards `max_pending` until the pool has actually finished it. With
+    threads, bcrypt releases the GIL while hashing; with processes, hashing also cannot slow down the interpreter
+    serving requests.
+
+    Attributes:
+        rounds (int): The bcrypt work factor of new hashes.
+        max_pending (int): Maximum number of jobs queued or running.
+        timeout (float): Seconds to wait for a job before giving up.
+        rejected (int): Number of jobs rejected because the pool was busy.
+    """
+    def __init__(self, workers: int = 2, max_pending: int = 8, rounds: int = 12, use_processes: bool = False,
+                 timeout: float = 10.0):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.rejected = 0
+        self.pid = os.getpid()
+        self._pending = 0
+        self._lock = threading.Lock()
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=workers)
+
+    def _run(self, function, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._done()
+            raise
+        future.add_done_callback(self._done)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy() from None
+
+    def _done(self, future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def check(self, hashed: str, password: str) -> bool:
+        """
+        Check a password against a bcrypt hash.
+
+        Raises:
+            HasherBusy: If the pool already has `max_pending` jobs, or the check timed out.
+        """
+        return self._run(_check, hashed.encode('utf-8'), password.encode('utf-8'))
+
+    def generate(self, password: str) -> str:
+        """
+        Hash a password with the configured work factor.
+
+        Raises:
+            HasherBusy: If the pool already has `max_pending` jobs, or the hashing timed out.
+        """
+        return self._run(_generate, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Return whether a hash was created with a different work factor than the configured one."""
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self) -> dict:
+        """Return the number of pending and rejected jobs."""
+        return {'pending': self._pending, 'rejected': self.rejected}
+
+
+def get_password_hasher() -> PasswordHasher:
+    """
+    Return the password hasher of the current app, creating it on first use in each process.
+
+    `BCRYPT_LOG_ROUNDS` (default 12) sets the work factor, `BCRYPT_WORKERS` (default 2) the pool size,
+    `BCRYPT_MAX_PENDING` (default 4 per worker) the queue limit, `BCRYPT_TIMEOUT` (default 10) the seconds to wait
+    for a job, and `BCRYPT_POOL` 'thread' (default) or 'process' the kind of pool.
+
+    Returns:
+        PasswordHasher: The app's password hasher.
+    """
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None or hasher.pid != os.getpid():
+        config = current_app.config
+        workers = config.get('BCRYPT_WORKERS', 2)
+        hasher = PasswordHasher(workers=workers, max_pending=config.get('BCRYPT_MAX_PENDING', 4 * workers),
+                                rounds=config.get('BCRYPT_LOG_ROUNDS', 12),
+                                use_processes=config.get('BCRYPT_POOL', 'thread') == 'process',
+                                timeout=config.get('BCRYPT_TIMEOUT', 10.0))
+        current_app.extensions['password_hasher'] = hasher
+    return hasher
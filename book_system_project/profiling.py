@@ -0,0 +1,225 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import List, Tuple
+from flask import Flask
+from werkzeug.wsgi import ClosingIterator
+
+PROFILE_NAME = re.compile(r'^(?P<time>\d{8}-\d{6})-(?P<id>[0-9a-f]{6})-(?P<method>[A-Z]+)-(?P<path>[\w.+-]*)-'
+                          r'(?P<duration>\d+)ms(?P<suffix>\.pstats|\.collapsed)$')
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads registered with it, from a background thread.
+
+    Every `interval` seconds, while at least one thread is registered, the current stack of each registered thread is
+    recorded as a collapsed stack: the frames from the outermost to the innermost, joined by ';'. Sampling only reads
+    the frames, so the profiled requests run at full speed; the cost is the sampler thread holding the GIL briefly.
+
+    Attributes:
+        interval (float): Seconds between samples.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id: int) -> None:
+        """Start sampling a thread."""
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+            self._active.set()
+
+    def stop(self, thread_id: int) -> Counter:
+        """Stop sampling a thread and return the number of samples of each of its collapsed stacks."""
+        with self._lock:
+            stacks = self._stacks.pop(thread_id)
+            if not self._stacks:
+                self._active.clear()
+        return stacks
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+
+def collapse_stack(frame) -> str:
+    """Return a stack as 'outermost;...;innermost', each frame written as 'function (file:line)'."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sampler = StackSampler()
+
+
+class ProfilerMiddleware:
+    """
+    WSGI middleware that profiles requests and keeps the traces of slow or sampled ones.
+
+    Enabled with the `PROFILING_ENABLED` config value. When `PROFILE_SLOW_MS` is set, every request is profiled and
+    its trace is kept if it took at least that many milliseconds; `PROFILE_SAMPLE_RATE` keeps the traces of that
+    fraction of the requests regardless of their duration. `PROFILE_MODE` selects the profiler: 'sample' (default)
+    for a stack sampler every `PROFILE_INTERVAL_MS` (default 5) milliseconds, saved as a collapsed stack file that
+    flame graph tools read, or 'cprofile' for a deterministic `cProfile` trace saved as a `.pstats` file, which
+    measures every call but slows the request down a lot. Profiling stops when the server closes the response, so
+    the rendering of streamed pages is included. Traces are written to `PROFILE_DIR` (default
+    `instance/profiles`), and only the `PROFILE_KEEP` (default 200) most recent ones are kept.
+
+    Attributes:
+        app (Flask): The application whose config is used.
+    """
+    def __init__(self, app: Flask):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+
+    def __call__(self, environ, start_response):
+        config = self.app.config
+        if not config.get('PROFILING_ENABLED'):
+            return self.wsgi_app(environ, start_response)
+        slow_ms = config.get('PROFILE_SLOW_MS')
+        sampled = random.random() < config.get('PROFILE_SAMPLE_RATE', 0.0)
+        if slow_ms is None and not sampled:
+            return self.wsgi_app(environ, start_response)
+
+        mode = config.get('PROFILE_MODE', 'sample')
+        thread_id = threading.get_ident()
+        started = time.perf_counter()
+        if mode == 'cprofile':
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            _sampler.interval = config.get('PROFILE_INTERVAL_MS', 5) / 1000
+            _sampler.start(thread_id)
+
+        def finish():
+            if mode == 'cprofile':
+                profile.disable()
+            else:
+                stacks = _sampler.stop(thread_id)
+            duration_ms = (time.perf_counter() - started) * 1000
+            if sampled or duration_ms >= slow_ms:
+                directory = profiles_directory(self.app)
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, profile_name(environ, duration_ms, mode))
+                if mode == 'cprofile':
+                    profile.dump_stats(path)
+                else:
+                    with open(path, 'w') as file:
+                        file.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+                prune_profiles(directory, config.get('PROFILE_KEEP', 200))
+
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+        return ClosingIterator(response, finish)
+
+
+def profiles_directory(app: Flask) -> str:
+    """Return the directory of the traces of an app, `PROFILE_DIR` or `instance/profiles`."""
+    return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+def profile_name(environ, duration_ms: float, mode: str) -> str:
+    """
+    Return the file name of a trace, which records when the request was made, its method, path and duration.
+
+    Slashes of the path are written as '+' and other characters not allowed in file names as '_'.
+    """
+    path = re.sub(r'[^\w.-]+', '_', environ.get('PATH_INFO', '/').strip('/').replace('/', '+'))[:60]
+    suffix = '.pstats' if mode == 'cprofile' else '.collapsed'
+    return (f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}-{environ.get('REQUEST_METHOD', 'GET')}-"
+            f"{path}-{int(duration_ms)}ms{suffix}")
+
+
+def prune_profiles(directory: str, keep: int) -> None:
+    """Delete all but the `keep` most recent traces of a directory."""
+    names = sorted((name for name in os.listdir(directory) if PROFILE_NAME.match(name)), reverse=True)
+    for name in names[keep:]:
+        os.remove(os.path.join(directory, name))
+
+
+def list_profiles(directory: str) -> List[dict]:
+    """
+    Return the traces of a directory, the most recent first.
+
+    Returns:
+        List[dict]: The file name, time, method, path, duration in milliseconds and kind ('cprofile' or 'sample')
+        of each trace.
+    """
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = PROFILE_NAME.match(name)
+        if match:
+            profiles.append({'name': name, 'time': datetime.strptime(match['time'], '%Y%m%d-%H%M%S'),
+                             'method': match['method'], 'path': '/' + match['path'].replace('+', '/'),
+                             'duration_ms': int(match['duration']),
+                             'kind': 'cprofile' if match['suffix'] == '.pstats' else 'sample'})
+    return profiles
+
+
+def profile_breakdown(path: str, limit: int = 40) -> Tuple[List[dict], float]:
+    """
+    Summarize a trace per function.
+
+    For a `.pstats` file, the functions are sorted by cumulative time and come with their number of calls, own
+    time and cumulative time in seconds. For a collapsed stack file, they are sorted by the number of samples in
+    which they are on the stack, and come with the number of samples in which they are the innermost frame.
+
+    Args:
+        path (str): The trace file.
+        limit (int): Number of functions returned.
+
+    Returns:
+        Tuple[List[dict], float]: The functions, and the total time in seconds or the total number of samples.
+    """
+    rows = []
+    if path.endswith('.pstats'):
+        import pstats
+        stats = pstats.Stats(path)
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            rows.append({'function': f"{function} ({os.path.basename(filename)}:{line})", 'calls': calls,
+                         'own': own, 'total': cumulative})
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows[:limit], stats.total_tt
+
+    own, total, samples = Counter(), Counter(), 0
+    with open(path) as file:
+        for line in file:
+            stack, count = line.rstrip('\n').rsplit(' ', 1)
+            frames = stack.split(';')
+            count = int(count)
+            samples += count
+            own[frames[-1]] += count
+            for function in set(frames):
+                total[function] += count
+    rows = [{'function': function, 'calls': None, 'own': own[function], 'total': count}
+            for function, count in total.most_common(limit)]
+    return rows, samples
@@ -0,0 +1,161 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, render_template, make_response
+from flask_login import current_user
+from book_system_project import logger
+from book_system_project.cache import get_cache
+
+DEFAULT_LIMITS = {
+    'login': [('ip', 20, 60), ('email', 5, 60)],
+    'register': [('ip', 5, 60), ('email', 5, 60)],
+    'change_password': [('ip', 10, 60), ('email', 5, 60)],
+    'search': [('ip', 30, 60)],
+}
+"""
+Rate limits of each limited view, as (scope, limit, period) rules: at most `limit` submissions per `period` seconds
+for every distinct value of the scope. Scopes are 'ip' for the client address and 'email' for the submitted email,
+or the logged in user's email if none is submitted.
+"""
+
+
+class MemoryRateLimitStore:
+    """
+    In-process token bucket store.
+
+    Every key has a bucket holding up to `limit` tokens that refills at `limit / period` tokens per second, and each
+    request takes one token. A bucket is stored as its token count and the time it was last updated, so a hit is a
+    constant-time update. The least recently used buckets are dropped beyond `max_keys`.
+
+    Attributes:
+        max_keys (int): Number of buckets kept.
+    """
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, period: float) -> float:
+        """
+        Take a token from the bucket of a key.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the seconds until a token is available.
+        """
+        rate = limit / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class CacheRateLimitStore:
+    """
+    Sliding window counter store in the app's shared cache, so all worker processes enforce the same limits.
+
+    Requests are counted per fixed window of `period` seconds with the cache's atomic `incr`. The count over the last
+    `period` seconds is estimated as the current window's count plus the previous window's count weighted by how much
+    of it still overlaps the sliding window.
+    """
+    def hit(self, key: str, limit: int, period: float) -> float:
+        """
+        Count a request for a key.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the seconds until the current window ends.
+        """
+        cache = get_cache()
+        now = time.time()
+        window = int(now // period)
+        current = cache.incr(f'rate_limit:{key}:{window}', ttl=2 * period)
+        previous = cache.get(f'rate_limit:{key}:{window - 1}') or 0
+        elapsed = now - window * period
+        if previous * (1 - elapsed / period) + current > limit:
+            return period - elapsed
+        return 0
+
+
+def get_rate_limit_store():
+    """
+    Return the rate limit store of the current app, creating it on first use.
+
+    `RATE_LIMIT_STORAGE` selects the store: 'memory' (default) for a per-process `MemoryRateLimitStore`, or 'cache'
+    for a `CacheRateLimitStore` in the app's cache, which is shared between processes when the cache is Redis.
+
+    Returns:
+        MemoryRateLimitStore or CacheRateLimitStore: The app's store.
+    """
+    store = current_app.extensions.get('rate_limit')
+    if store is None:
+        if current_app.config.get('RATE_LIMIT_STORAGE', 'memory') == 'cache':
+            store = CacheRateLimitStore()
+        else:
+            store = MemoryRateLimitStore()
+        store = current_app.extensions.setdefault('rate_limit', store)
+    return store
+
+
+def _scope_value(scope: str):
+    if scope == 'ip':
+        return request.remote_addr
+    if scope == 'email':
+        email = request.form.get('email') or (current_user.email if current_user.is_authenticated else '')
+        return email.strip().lower() or None
+    raise ValueError(f"Unknown rate limit scope: {scope}")
+
+
+def check_rate_limit(name: str) -> float:
+    """
+    Count the current request against the rate limits of a view.
+
+    Args:
+        name (str): The name of the limited view, a key of `DEFAULT_LIMITS` or of the `RATE_LIMITS` config value.
+
+    Returns:
+        float: 0 if the request is allowed, otherwise the seconds to wait before retrying.
+    """
+    limits = current_app.config.get('RATE_LIMITS', {}).get(name, DEFAULT_LIMITS.get(name, []))
+    store = get_rate_limit_store()
+    retry_after = 0
+    for scope, limit, period in limits:
+        value = _scope_value(scope)
+        if value:
+            retry_after = max(retry_after, store.hit(f'{name}:{scope}:{value}', limit, period))
+    return retry_after
+
+
+def rate_limited(name: str):
+    """
+    Decorate a view so POST requests over its rate limits are answered with 429 Too Many Requests.
+
+    The check runs before the view, so rejected submissions never reach form validation or password hashing. GET
+    requests are not limited. Disabled with the `RATE_LIMIT_ENABLED` config value.
+
+    Args:
+        name (str): The name of the limited view, see `check_rate_limit`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == 'POST' and current_app.config.get('RATE_LIMIT_ENABLED', True):
+                retry_after = check_rate_limit(name)
+                if retry_after:
+                    retry_after = math.ceil(retry_after)
+                    logger.warning(f"Rate limit of {name} exceeded from {request.remote_addr}")
+                    response = make_response(render_template('rate_limited.html', retry_after=retry_after), 429)
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
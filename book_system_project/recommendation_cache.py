@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Iterable, List
+from flask import current_app
+from book_system_project import logger
+from book_system_project.models import db, Rating
+from book_system_project.sharding import get_router
+from book_system_project.cache import (get_cache, RECOMMENDATIONS_CACHE_KEY, RATINGS_VERSION_KEY,
+                                       SIMILARITY_VERSION_KEY, SIMILARITY_EPOCH_KEY)
+
+RECOMMENDATIONS_CACHE_TTL = 300
+VERSION_TTL = 7 * 24 * 3600
+
+
+def _stamps(keys: List[str]) -> List[str]:
+    """
+    Return the version stamps stored under the given keys, creating a fresh stamp for every missing one.
+
+    Stamps are random tokens rather than counters, so a stamp that expired or was evicted is never recreated with a
+    value an older cache entry still holds.
+    """
+    cache = get_cache()
+    stamps = cache.get_many(keys)
+    for index, stamp in enumerate(stamps):
+        if stamp is None:
+            stamps[index] = uuid.uuid4().hex
+            cache.set(keys[index], stamps[index], ttl=VERSION_TTL)
+    return stamps
+
+
+def bump_ratings_version(user_id: int) -> None:
+    """Give a user a new ratings version, so their cached recommendations are recomputed on the next visit."""
+    get_cache().set(RATINGS_VERSION_KEY.format(user_id=user_id), uuid.uuid4().hex, ttl=VERSION_TTL)
+
+
+def bump_similarity_versions(book_ids: Iterable[int]) -> None:
+    """
+    Give books new similarity versions after the users who liked them changed.
+
+    The cached recommendations of every user who likes one of these books become stale, other users keep theirs.
+    """
+    cache = get_cache()
+    for book_id in set(book_ids):
+        cache.set(SIMILARITY_VERSION_KEY.format(book_id=book_id), uuid.uuid4().hex, ttl=VERSION_TTL)
+
+
+def bump_similarity_epoch() -> None:
+    """Make every cached recommendation stale, after the liked books of many users changed at once."""
+    get_cache().set(SIMILARITY_EPOCH_KEY, uuid.uuid4().hex, ttl=VERSION_TTL)
+
+
+def _dependency_keys(book_ids: List[int]) -> List[str]:
+    return [SIMILARITY_EPOCH_KEY] + [SIMILARITY_VERSION_KEY.format(book_id=book_id) for book_id in book_ids]
+
+
+def cached_recommendations(user_id: int, compute, ttl: int = RECOMMENDATIONS_CACHE_TTL):
+    """
+    Return a user's recommendation data from the cache, computing it if it is missing or stale.
+
+    The entry is keyed by the user's ratings version, which changes when the user rates a book, and stores the
+    similarity versions of the books the user liked when it was computed. It is stale as soon as one of those
+    versions changed, that is when other users started or stopped liking one of these books. Average ratings and
+    model predictions are refreshed only when the entry expires after `ttl` seconds.
+
+    Without a cache shared by all workers, like `load_user`, nothing is cached: the versions would only change in
+    the worker that handled the rating, and the others would keep serving stale recommendations.
+
+    Args:
+        user_id (int): The ID of the user.
+        compute (callable): Called with the user ID to compute the data.
+        ttl (int): Seconds to keep an entry.
+
+    Returns:
+        The data returned by `compute`.
+    """
+    cache = get_cache()
+    if not cache.shared:
+        return compute(user_id)
+    key = RECOMMENDATIONS_CACHE_KEY.format(user_id=user_id,
+                                           version=_stamps([RATINGS_VERSION_KEY.format(user_id=user_id)])[0])
+    entry = cache.get(key)
+    if entry is not None:
+        if cache.get_many(_dependency_keys(entry['liked'])) == entry['stamps']:
+            return entry['data']
+        cache.delete(key)
+
+    def compute_entry():
+        # The stamps are read before computing, so a change made meanwhile leaves the entry stale instead of lost.
+        liked = [book_id for book_id, in get_router().session(user_id).query(Rating.book_id)
+                 .filter_by(user_id=user_id, rating=5).order_by(Rating.book_id)]
+        stamps = _stamps(_dependency_keys(liked))
+        return {'liked': liked, 'stamps': stamps, 'data': compute(user_id)}
+
+    return cache.get_or_set(key, compute_entry, ttl=ttl)['data']
+
+
+class RecommendationWarmer:
+    """
+    Keeps the cached recommendations of recently active users computed, from a background thread.
+
+    Every `interval` seconds, the entries of the users seen in the last `window` seconds are checked and recomputed
+    if missing or stale, so these users rarely wait for a computation. Only the `max_users` most recently seen users
+    are remembered.
+
+    Attributes:
+        app (Flask): The app whose database and cache are used.
+        compute (callable): Computes the data of a user, see `cached_recommendations`.
+        interval (float): Seconds between two warming rounds.
+        window (float): Seconds a user is considered active after their last request.
+        max_users (int): Maximum number of users remembered.
+    """
+    def __init__(self, app, compute, interval: float = 60, window: float = 900, max_users: int = 1000):
+        self.app = app
+        self.compute = compute
+        self.interval = interval
+        self.window = window
+        self.max_users = max_users
+        self.pid = os.getpid()
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def note_active(self, user_id: int) -> None:
+        """Record that a user made a request."""
+        with self._lock:
+            self._seen.pop(user_id, None)
+            self._seen[user_id] = time.monotonic()
+            while len(self._seen) > self.max_users:
+                self._seen.popitem(last=False)
+
+    def active_users(self) -> List[int]:
+        """Return the users seen in the last `window` seconds, the most recent first."""
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            return [user_id for user_id, seen in reversed(self._seen.items()) if seen >= cutoff]
+
+    def warm(self) -> int:
+        """
+        Compute the missing or stale entries of the recently active users.
+
+        Returns:
+            int: The number of users checked.
+        """
+        user_ids = self.active_users()
+        with self.app.app_context():
+            for user_id in user_ids:
+                try:
+                    cached_recommendations(user_id, self.compute)
+                except Exception:
+                    logger.exception(f"Failed to warm the recommendations of user_id: {user_id}")
+                finally:
+                    db.session.rollback()
+        return len(user_ids)
+
+    def start(self) -> None:
+        """Start the background warming thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='recommendation-warmer', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.warm()
+
+
+def get_recommendation_warmer(compute):
+    """
+    Return the recommendation warmer of the current app, or None if warming is disabled.
+
+    Enabled with the `RECOMMENDATIONS_WARM_ENABLED` config value, and only with a shared cache, since
+    `cached_recommendations` caches nothing otherwise. The warmer and its thread are created on first use
+    in each process; `RECOMMENDATIONS_WARM_INTERVAL`, `RECOMMENDATIONS_WARM_WINDOW` and
+    `RECOMMENDATIONS_WARM_MAX_USERS` configure it.
+
+    Args:
+        compute (callable): Computes the data of a user, see `cached_recommendations`.
+
+    Returns:
+        RecommendationWarmer or None: The app's warmer.
+    """
+    config = current_app.config
+    if not config.get('RECOMMENDATIONS_WARM_ENABLED') or not get_cache().shared:
+        return None
+    warmer = current_app.extensions.get('recommendation_warmer')
+    if warmer is None or warmer.pid != os.getpid():
+        warmer = RecommendationWarmer(current_app._get_current_object(), compute,
+                                      interval=config.get('RECOMMENDATIONS_WARM_INTERVAL', 60),
+                                      window=config.get('RECOMMENDATIONS_WARM_WINDOW', 900),
+                                      max_users=config.get('RECOMMENDATIONS_WARM_MAX_USERS', 1000))
+        current_app.extensions['recommendation_warmer'] = warmer
+        warmer.start()
+    return warmer
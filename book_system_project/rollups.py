@@ -0,0 +1,184 @@
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from book_system_project.models import (db, Rating, Review, ToRead, Genre, book_genres, DailyActivity, RatingHistogram,
+                                        GenrePopularity, CohortRetention)
+from book_system_project.sharding import get_router, merge_counts
+from typing import Dict, List, Tuple
+
+
+def _as_date(value) -> date:
+    """Convert the result of SQL `date()`, a string on SQLite, to a `date`."""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _daily_counts(column, since: date, distinct_column=None) -> Dict[date, int]:
+    """
+    Count rows, or distinct values of `distinct_column`, per day of `column` from `since` on, over every shard.
+
+    All the rows of a user are in the same shard, so distinct users are counted in each shard and summed.
+    """
+    day = db.func.date(column)
+    counted = db.func.count(db.distinct(distinct_column)) if distinct_column is not None else db.func.count()
+
+    def partial(session):
+        query = session.query(day, counted).filter(column.isnot(None))
+        if since:
+            query = query.filter(column >= datetime.combine(since, time.min))
+        return [(_as_date(row_day), count) for row_day, count in query.group_by(day)]
+    return dict(merge_counts(get_router().scatter(partial)))
+
+
+def rollup_daily_activity(full: bool = False) -> int:
+    """
+    Update the `DailyActivity` rollup.
+
+    Incremental runs only recompute the days from the last rolled up day on, which may have been incomplete when it
+    was rolled up. Ratings count on the day they were last changed, so re-rating a book adds to the day of the change
+    and leaves the days already rolled up as they were; a full run only sees the latest change of each rating.
+
+    Args:
+        full (bool): Whether to recompute every day instead of only the recent ones.
+
+    Returns:
+        int: The number of days written.
+    """
+    since = None if full else db.session.query(db.func.max(DailyActivity.day)).scalar()
+    deleted = DailyActivity.query
+    if since:
+        deleted = deleted.filter(DailyActivity.day >= since)
+    deleted.delete(synchronize_session=False)
+
+    ratings = _daily_counts(Rating.updated_at, since)
+    raters = _daily_counts(Rating.updated_at, since, Rating.user_id)
+    reviews = _daily_counts(Review.created_at, since)
+    to_reads = _daily_counts(ToRead.created_at, since)
+    days = sorted(set(ratings) | set(reviews) | set(to_reads))
+    db.session.add_all(DailyActivity(day=day, ratings=ratings.get(day, 0), active_raters=raters.get(day, 0),
+                                     reviews=reviews.get(day, 0), to_reads=to_reads.get(day, 0)) for day in days)
+    return len(days)
+
+
+def rollup_rating_histogram() -> int:
+    """
+    Recompute the `RatingHistogram` rollup.
+
+    Returns:
+        int: The number of distinct rating values.
+    """
+    RatingHistogram.query.delete()
+    counts = merge_counts(get_router().scatter(
+        lambda session: session.query(Rating.rating, db.func.count()).filter(Rating.rating.isnot(None))
+        .group_by(Rating.rating).all()))
+    db.session.add_all(RatingHistogram(rating=rating, count=count) for rating, count in sorted(counts.items()))
+    return len(counts)
+
+
+def rollup_genre_popularity() -> int:
+    """
+    Recompute the `GenrePopularity` rollup.
+
+    The ratings and read list entries are counted per book in every shard, and added up per genre with the genres
+    of the books, which are in the main database.
+
+    Returns:
+        int: The number of genres written.
+    """
+    GenrePopularity.query.delete()
+    genres_of = {}
+    for book_id, genre_id in db.session.query(book_genres.c.book_id, book_genres.c.genre_id):
+        genres_of.setdefault(book_id, []).append(genre_id)
+    router = get_router()
+    counts, sums, read_listed = Counter(), Counter(), Counter()
+    for rows in router.scatter(lambda session: session.query(Rating.book_id, db.func.count(Rating.rating),
+                                                             db.func.sum(Rating.rating))
+                               .group_by(Rating.book_id).all()):
+        for book_id, count, total in rows:
+            for genre_id in genres_of.get(book_id, ()):
+                counts[genre_id] += count
+                sums[genre_id] += total or 0
+    for book_id, count in merge_counts(router.scatter(
+            lambda session: session.query(ToRead.book_id, db.func.count()).group_by(ToRead.book_id).all())).items():
+        for genre_id in genres_of.get(book_id, ()):
+            read_listed[genre_id] += count
+    genre_ids = [genre_id for genre_id, in db.session.query(Genre.id)]
+    for genre_id in genre_ids:
+        db.session.add(GenrePopularity(genre_id=genre_id, ratings=counts[genre_id],
+                                       avg_rating=sums[genre_id] / counts[genre_id] if counts[genre_id] else None,
+                                       read_listed=read_listed[genre_id]))
+    return len(genre_ids)
+
+
+def rollup_cohort_retention() -> int:
+    """
+    Recompute the `CohortRetention` rollup.
+
+    Reads the distinct (user, day) pairs with any activity from every shard, assigns each user to the week of their
+    first activity and counts the users of each cohort active in each following week.
+
+    Returns:
+        int: The number of (cohort, week) rows written.
+    """
+    CohortRetention.query.delete()
+    active_days = db.union(*(db.select(model.user_id, db.func.date(column).label('day')).filter(column.isnot(None))
+                             for model, column in ((Rating, Rating.updated_at), (Review, Review.created_at),
+                                                   (ToRead, ToRead.created_at))))
+    weeks = {}
+    for rows in get_router().scatter(lambda session: session.execute(active_days).all()):
+        for user_id, day in rows:
+            day = _as_date(day)
+            weeks.setdefault(user_id, set()).add(day - timedelta(days=day.weekday()))
+    counts = {}
+    for user_weeks in weeks.values():
+        cohort = min(user_weeks)
+        for week in user_weeks:
+            key = (cohort, (week - cohort).days // 7)
+            counts[key] = counts.get(key, 0) + 1
+    db.session.add_all(CohortRetention(cohort=cohort, week=week, users=users)
+                       for (cohort, week), users in counts.items())
+    return len(counts)
+
+
+def run_rollups(full: bool = False) -> Dict[str, int]:
+    """
+    Refresh all analytics rollup tables in one transaction.
+
+    Meant to run nightly, or more often, from the `rollup-analytics` CLI command, so the analytics dashboard only
+    reads the small rollup tables.
+
+    Args:
+        full (bool): Whether to recompute the daily activity of every day instead of only the recent ones.
+
+    Returns:
+        Dict[str, int]: Rollup table names mapped to the number of rows written.
+    """
+    written = {
+        'daily_activity': rollup_daily_activity(full),
+        'rating_histogram': rollup_rating_histogram(),
+        'genre_popularity': rollup_genre_popularity(),
+        'cohort_retention': rollup_cohort_retention(),
+    }
+    db.session.commit()
+    return written
+
+
+def retention_table(max_weeks: int = 8) -> Tuple[List[int], List[Tuple[date, int, List[int]]]]:
+    """
+    Read the cohort retention rollup as a table for the dashboard.
+
+    Args:
+        max_weeks (int): The number of weeks after the first one to show.
+
+    Returns:
+        Tuple[List[int], List[Tuple[date, int, List[int]]]]: The week numbers shown, and for every cohort, newest
+        first, its first week, its size and the percentage of its users active in each shown week.
+    """
+    cohorts = {}
+    for row in CohortRetention.query.filter(CohortRetention.week <= max_weeks):
+        cohorts.setdefault(row.cohort, {})[row.week] = row.users
+    week_numbers = list(range(1, max_weeks + 1))
+    table = []
+    for cohort in sorted(cohorts, reverse=True):
+        size = cohorts[cohort].get(0, 0)
+        if size:
+            table.append((cohort, size, [round(100 * cohorts[cohort].get(week, 0) / size) for week in week_numbers]))
+    return week_numbers, table
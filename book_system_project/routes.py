@@ -1,21 +1,54 @@
-from flask import Response, render_template, redirect, request, url_for, flash
-from book_system_project import login_manager, bcrypt, logger
-from book_system_project.models import db, Book, User, Rating, Author, Genre, ToRead, Review, book_genres
+from flask import (Response, render_template, stream_template, redirect, request, url_for, flash, abort, current_app,
+                   get_flashed_messages)
+from book_system_project import login_manager, logger
+from book_system_project.models import (db, Book, User, Rating, Author, Genre, ToRead, Review, DailyActivity,
+                                        RatingHistogram, GenrePopularity, insert_ignore, upsert_previous)
 from book_system_project.forms import (RegisterForm, LoginForm, BookForm, AuthorForm, RateBook, EditUserForm,
                                        ChangePasswordForm, SortRating, ToReadForm, WriteReviewForm, SearchForm)
 from flask_login import login_user, login_required, logout_user, current_user
-import csv
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func
+from sqlalchemy.orm import make_transient_to_detached
 from datetime import datetime
-from random import randint, choice
-from book_system_project.media.books66 import books_list
 from flask_paginate import Pagination, get_page_parameter
 import json
 import os
 import uuid
 from book_system_project.blueprints import bp
-from typing import List, Tuple
+from book_system_project.also_liked import update_also_liked, also_liked_for
+from book_system_project.model_store import get_model_store
+from book_system_project.write_behind import get_write_behind
+from book_system_project.trending import record_event, trending_books
+from book_system_project.analytics import record_activity, books_by_readers, total_readers, top_reviewers
+from book_system_project.rollups import retention_table
+from book_system_project.cache import get_cache, activity_version, bump_activity_version, USER_CACHE_KEY
+from book_system_project.recommendation_cache import (cached_recommendations, bump_ratings_version,
+                                                      bump_similarity_versions, get_recommendation_warmer,
+                                                      RECOMMENDATIONS_CACHE_TTL)
+from book_system_project.rate_limit import rate_limited
+from book_system_project.password_hashing import get_password_hasher, HasherBusy
+from book_system_project.metrics import registry, metrics_directory
+from book_system_project.profiling import profiles_directory, list_profiles, profile_breakdown, PROFILE_NAME
+from book_system_project.sharding import get_router, average_ratings, activity_counts
+from book_system_project.async_db import gather_recommendations, gather_search
+from typing import Iterator, List, Tuple
+
+USER_CACHE_FIELDS = ('id', 'email', 'name', 'phone', 'date_of_birth', 'gender')
+USER_CACHE_TTL = 300
+SEARCH_RESULTS_SHOWN = 50
+
+
+@bp.errorhandler(HasherBusy)
+def hasher_busy(error: HasherBusy) -> Response:
+    """
+    Answer requests that could not get a password hashing slot with 503 Service Unavailable.
+
+    Returns:
+        Response: The rendered `busy.html` template with a Retry-After header.
+    """
+    logger.warning(f"Password hashing pool busy, rejected {request.path}")
+    response = Response(render_template('busy.html'), status=503)
+    response.headers['Retry-After'] = '1'
+    return response
 
 
 @login_manager.user_loader
@@ -24,7 +57,12 @@ def load_user(user_id: int) -> User:
     Load a user by their user ID.
 
     This function is used by Flask-Login to retrieve the current logged-in user
-    from the database.
+    on every request. With a cache shared by all workers, the user's profile fields are
+    cached, and on a cache hit the user is attached to the session without a query. The
+    password hash is not cached; it is loaded from the database only when accessed. A
+    per-process cache is not used: the name decides admin rights, and a change made by
+    one worker could not evict the entries of the others. When recommendation warming is
+    enabled, the user is recorded as recently active.
 
     Args:
         user_id (int): The ID of the user to load.
@@ -33,7 +71,21 @@ def load_user(user_id: int) -> User:
         User: The user object corresponding to the given user ID, or None if no user
         is found.
     """
-    user = User.query.get(int(user_id))
+    warmer = get_recommendation_warmer(compute_recommendations)
+    if warmer:
+        warmer.note_active(int(user_id))
+    cache = get_cache()
+    if not cache.shared:
+        return db.session.get(User, int(user_id))
+    key = USER_CACHE_KEY.format(user_id=int(user_id))
+    data = cache.get(key)
+    if data is not None:
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = db.session.get(User, int(user_id))
+    if user:
+        cache.set(key, {field: getattr(user, field) for field in USER_CACHE_FIELDS}, ttl=USER_CACHE_TTL)
     return user
 
 
@@ -44,7 +96,8 @@ def home():
 
     This function queries all books from the database and calculates the top 5 books
     based on average rating, the number of reviews, and the number of times added to
-    the read list. It then renders the 'base.html' template with these top books.
+    the read list, each gathered from every shard by one grouped query. It then renders
+    the 'base.html' template with these top books.
 
     Returns:
         A rendered HTML template 'base.html' with the following context variables:
@@ -54,19 +107,26 @@ def home():
                               and their respective review counts.
         - top_read_listed_books: A list of tuples containing the top 5 books by read list
                                  count and their respective read list counts.
+        - trending: A list of tuples containing the 5 books with the most recent activity
+                    and their decayed activity scores.
+        - trending_days: The number of days of activity the trending books are ranked on.
     """
     books = Book.query.all()
-    books_with_avg_rating = [(book, book.avg_rating) for book in books if book.avg_rating is not None]
+    averages = average_ratings()
+    books_with_avg_rating = [(book, round(averages[book.id], 2)) for book in books if book.id in averages]
     top5_books = sorted(books_with_avg_rating, key=lambda x: x[1], reverse=True)[:5]
 
-    books_with_review_count = [(book, len(Review.query.filter_by(book_id=book.id).all())) for book in books]
+    review_counts = activity_counts(Review)
+    books_with_review_count = [(book, review_counts[book.id]) for book in books]
     top_reviewed_books = sorted(books_with_review_count, key=lambda x: x[1], reverse=True)[:5]
 
-    books_with_read_list_count = [(book, len(ToRead.query.filter_by(book_id=book.id).all())) for book in books]
+    read_list_counts = activity_counts(ToRead)
+    books_with_read_list_count = [(book, read_list_counts[book.id]) for book in books]
     top_read_listed_books = sorted(books_with_read_list_count, key=lambda x: x[1], reverse=True)[:5]
 
     return render_template("base.html", top5_books=top5_books, top_reviewed_books=top_reviewed_books,
-                           top_read_listed_books=top_read_listed_books)
+                           top_read_listed_books=top_read_listed_books, trending=trending_books(5),
+                           trending_days=current_app.config.get('TRENDING_WINDOW_DAYS', 14))
 
 
 @bp.route("/profile")
@@ -124,43 +184,8 @@ def fill_book_db():
         logger.warning(f"Unauthorized access attempt to /fill_book_db by user: {current_user.id}")
         flash("You dont have permits to access this page!", "error")
         return redirect('/')
-    books_added = 0
-    for book in books_list:
-        author_name = book['Author']
-        book_title = book['Title']
-        genre_names = book['Genres'].split(',')
-
-        author = Author.query.filter_by(name=author_name).first()
-        if not author:
-            author = Author(name=author_name)
-            db.session.add(author)
-            db.session.commit()
-
-        genres = []
-        for genre_name in genre_names:
-            genre = Genre.query.filter_by(name=genre_name.strip()).first()
-            if not genre:
-                genre = Genre(name=genre_name.strip())
-                db.session.add(genre)
-                db.session.commit()
-            genres.append(genre)
-
-        existing_book = Book.query.filter_by(title=book_title, author_id=author.id).first()
-        if existing_book:
-            continue
-
-        book = Book(title=book_title, author_id=author.id)
-        for genre in genres:
-            book.genres.append(genre)
-
-        db.session.add(book)
-
-        try:
-            db.session.commit()
-            books_added += 1
-        except IntegrityError:
-            db.session.rollback()
-            continue
+    from book_system_project.seed import seed_books
+    books_added = seed_books()
 
     if books_added == 0:
         flash('Books you are trying to add already exists. No new books added.', 'info')
@@ -191,69 +216,16 @@ def fill_user_db():
     if len(User.query.all()) > 50:
         flash("We have enough users already. No new users added.", 'info')
         return render_template("admin_page.html")
-    users_added = 0
-    with open('book_system_project/media/users60.txt', newline='') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter='\t')
-        for row in reader:
-            full_name = f"{row['first_name'].strip()} {row['last_name'].strip()}"
-
-            user = User(
-                name=full_name,
-                email=row['email'],
-                password=bcrypt.generate_password_hash(row['password']).decode('utf-8'),
-                phone=row['phone'],
-                date_of_birth=datetime.strptime(row['date_of_birth'], '%Y-%m-%d').date(),
-                gender=row['gender']
-            )
-            db.session.add(user)
-            try:
-                db.session.commit()
-                users_added += 1
-            except IntegrityError:
-                db.session.rollback()
-                continue
-
-        if users_added == 0:
-            flash('Users you are trying to add already exists. No new users added.', 'info')
-        else:
-            flash(f'Successfully added {users_added} new user(s) to the database!', 'success')
+    from book_system_project.seed import seed_users
+    users_added = seed_users()
+    if users_added == 0:
+        flash('Users you are trying to add already exists. No new users added.', 'info')
+    else:
+        flash(f'Successfully added {users_added} new user(s) to the database!', 'success')
 
     return render_template("fill_db.html")
 
 
-def randomize_review() -> str:
-    """
-    Generate a random review composed of a series of sentences.
-
-    This function reads a file containing a list of words, splits them into a list,
-    and generates a random review by forming sentences of random lengths from these words.
-
-    Returns:
-        str: A randomly generated review consisting of 5 to 12 sentences.
-    """
-    with open('book_system_project/media/words3000.txt', 'r') as file:
-        words = file.read()
-    words = words.split()
-
-    def get_result(word_list, sentence_length) -> str:
-        """
-        Generate a random sentence from a list of words.
-
-        Args:
-            word_list (list): The list of words to form sentences from.
-            sentence_length (int): The number of words in the sentence.
-
-        Returns:
-            str: A randomly generated sentence with the specified length.
-        """
-        sentence = ' '.join(choice(word_list) for _ in range(sentence_length))
-        return sentence[0].upper() + sentence[1:]
-
-    number_of_sentences = randint(5, 12)
-    sentences = [get_result(words, randint(5, 15)) for _ in range(number_of_sentences)]
-    return '. '.join(sentences) + '.'
-
-
 @bp.route("/fill_ratings", methods=["GET", "POST"])
 @login_required
 def fill_ratings():
@@ -261,7 +233,7 @@ def fill_ratings():
     Populate the database with random ratings, read lists, and reviews.
 
     This function is accessible only to the Admin user. It checks if the number of ratings
-    in the database exceeds 50. If not, it generates random ratings and reviews for each
+    in all shards exceeds 50. If not, it generates random ratings and reviews for each
     user (excluding the current user), and updates the 'ToRead' list. The amount and type
     of data generated are influenced by the position of the counter in a defined range.
 
@@ -274,44 +246,17 @@ def fill_ratings():
         logger.warning(f"Unauthorized access attempt to /fill_ratings by user: {current_user.id}")
         flash("You dont have permits to access this page!", "error")
         return redirect('/')
-    user_rate = User.query.all()
-    if len(Rating.query.all()) > 50:
+    if sum(activity_counts(Rating).values()) > 50:
         flash("We have enough data already. No new data added.", 'info')
         return render_template("admin_page.html")
-    for user in user_rate:
-        if user.id != current_user.id:
-            book_list = Book.query.all()
-            to_rate = int(len(book_list) * 0.9)
-            counter = 0
-            for book in book_list:
-                check = Rating.query.filter_by(user_id=user.id, book_id=book.id).first()
-                if check:
-                    continue
-                if counter < to_rate:
-                    review = randomize_review()
-                    rating = randint(1, 5)
-                    if counter <= 30:
-                        add_rating = Rating(user_id=user.id, rating=rating, book_id=book.id)
-                        db.session.add(add_rating)
-                    if 30 < counter <= 40:
-                        add_rating = Rating(user_id=user.id, rating=randint(4, 5), book_id=book.id)
-                        db.session.add(add_rating)
-                    if 40 < counter <= 50:
-                        add_rating = Rating(user_id=user.id, rating=randint(1, 2), book_id=book.id)
-                        db.session.add(add_rating)
-                    if 10 < counter <= 50 and randint(1, 3) > 1:
-                        add_to_read = ToRead(user_id=user.id, toread=1, book_id=book.id)
-                        db.session.add(add_to_read)
-                    if 20 < counter <= 60 and randint(1, 3) > 1:
-                        add_review = Review(user_id=user.id, review=review, book_id=book.id)
-                        db.session.add(add_review)
-                    counter += 1
-            db.session.commit()
+    from book_system_project.seed import seed_ratings
+    seed_ratings(exclude_user_id=current_user.id)
     flash("Ratings, read list and reviews have been updated", 'success')
     return render_template("fill_db.html")
 
 
 @bp.route("/register", methods=["GET", "POST"])
+@rate_limited('register')
 def register():
     """
     Handle user registration for new accounts.
@@ -341,7 +286,7 @@ def register():
         if password != confirm_password:
             flash('Passwords, do not match!', 'error')
             return render_template('register.html', form=form)
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = get_password_hasher().generate(password)
         new_user = User(email=email, name=name, password=hashed_password, phone=phone, date_of_birth=date_of_birth,
                         gender=gender)
 
@@ -354,13 +299,17 @@ def register():
 
 
 @bp.route("/login", methods=["GET", "POST"])
+@rate_limited('login')
 def login():
     """
     Handle user login functionality.
 
     This function processes both GET and POST requests for user login. On a POST request,
     it validates the login form, checks if the provided email exists in the database, and
-    verifies the password. If the credentials are correct, it logs in the user and redirects
+    verifies the password. Attempts are rate limited per client address and per email before
+    any password is checked. If the password hash was created with a different work factor
+    than the configured `BCRYPT_LOG_ROUNDS`, it is replaced with a new hash on login. If the
+    credentials are correct, it logs in the user and redirects
     to the user's profile page. If the credentials are incorrect, it provides feedback and
     re-renders the login form.
 
@@ -374,7 +323,12 @@ def login():
         password = form.password.data
 
         user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
+        hasher = get_password_hasher()
+        if user and hasher.check(user.password, password):
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.generate(password)
+                db.session.commit()
+                logger.info(f"Rehashed password of user_id: {user.id} with the configured work factor")
             login_user(user)
             logger.info(f"Logged in user_id: {user.id}, email: {user.email}")
             flash(' You have logged in successfully!', 'success')
@@ -557,9 +511,13 @@ def book_details(book_id: int):
      Display details of a specific book, including author, genres, ratings, and reviews.
 
      This function handles both GET and POST requests. For GET requests, it retrieves the book details
-     including the author, genres, average rating, user-specific rating, and reviews. For authenticated
+     including the author, genres, average rating, user-specific rating, reviews and the books most often liked
+     together with this one, read from the precomputed `AlsoLiked` table. For authenticated
      users, it checks if the book is already in their "to-read" list and handles adding/removing the book
-     from this list via form submission.
+     from this list via form submission; the addition is a single insert that skips a row already present, so
+     concurrent submissions cannot fail on the unique index. With write coalescing enabled, the addition is queued
+     and the user's own pending writes are shown until they are flushed. The user's rows are read from their
+     shard, and the counts and the average rating are gathered from every shard.
 
      Parameters:
          book_id (int): The ID of the book whose details are to be displayed.
@@ -573,32 +531,52 @@ def book_details(book_id: int):
     book = Book.query.get_or_404(book_id)
     author = book.author
     genres = book.genres
-    review_count = len(Review.query.filter_by(book_id=book_id).all())
-    review = Review.query.filter_by(book_id=book_id, user_id=current_user.id).first() \
-        if current_user.is_authenticated else None
-    avg_rating = book.avg_rating
+    review_count = activity_counts(Review, [book_id])[book_id]
+    shard = get_router().session(current_user.id) if current_user.is_authenticated else None
+    review = shard.query(Review).options(db.undefer(Review.review)) \
+        .filter_by(book_id=book_id, user_id=current_user.id).first() if shard else None
+    avg_rating = book_avg_rating(book_id)
     rating = None
 
-    if current_user.is_authenticated:
-        rating = Rating.query.filter_by(book_id=book_id, user_id=current_user.id).first()
+    write_behind = get_write_behind()
+
+    if shard:
+        rating = shard.query(Rating).filter_by(book_id=book_id, user_id=current_user.id).first()
+        pending_rating = write_behind.pending_rating(current_user.id, book_id) if write_behind else None
+        if pending_rating is not None:
+            rating = Rating(rating=pending_rating, book_id=book_id, user_id=current_user.id)
 
     if form.validate_on_submit():
-        existing_toread = ToRead.query.filter_by(user_id=current_user.id, book_id=book_id).first()
-        if not existing_toread:
-            new_toread = ToRead(toread=True, user_id=current_user.id, book_id=book_id)
-            db.session.add(new_toread)
-            db.session.commit()
+        if write_behind:
+            existing_toread = shard.query(ToRead).filter_by(user_id=current_user.id, book_id=book_id).first()
+            added = not write_behind.pending_to_read(current_user.id).get(book_id, existing_toread)
+            if added:
+                write_behind.enqueue({'kind': 'to_read', 'user_id': current_user.id, 'book_id': book_id,
+                                      'value': True})
+        else:
+            added = insert_ignore(ToRead, {'toread': True, 'user_id': current_user.id, 'book_id': book_id},
+                                  index_elements=['user_id', 'book_id'], session=shard)
+            if added:
+                record_activity(current_user.id, book_id, 'to_read')
+                get_router().commit()
+                bump_activity_version()
+                record_event(book_id, 'to_read')
+        if added:
             flash('You have successfully added this book to your read list', 'success')
             return redirect(url_for('main.to_read'))
         flash('This book is already in your read list', 'error')
         return redirect(url_for('main.to_read'))
 
-    toread = ToRead.query.filter_by(user_id=current_user.id, book_id=book_id).first() \
-        if current_user.is_authenticated else None
-    read_listed = len(ToRead.query.filter_by(book_id=book_id).all())
+    toread = shard.query(ToRead).filter_by(user_id=current_user.id, book_id=book_id).first() if shard else None
+    if current_user.is_authenticated and write_behind:
+        pending_toread = write_behind.pending_to_read(current_user.id).get(book_id)
+        if pending_toread is not None:
+            toread = ToRead(toread=True, user_id=current_user.id, book_id=book_id) if pending_toread else None
+    read_listed = activity_counts(ToRead, [book_id])[book_id]
+    also_liked = also_liked_for(book_id)
     return render_template('book.html', form=form, book=book, author=author, genres=genres,
                            avg_rating=avg_rating, rating=rating, toread=toread, review=review,
-                           review_count=review_count, read_listed=read_listed)
+                           review_count=review_count, read_listed=read_listed, also_liked=also_liked)
 
 
 @bp.route("/rate_book/<int:book_id>", methods=["GET", "POST"])
@@ -610,7 +588,11 @@ def rate_book(book_id: int):
     This function handles both GET and POST requests. For GET requests, it retrieves the details of
     the book, including its author, genres, and average rating. For authenticated users, it also
     fetches their current rating (if any). For POST requests, it processes the submitted rating and
-    updates or creates a new rating entry in the database.
+    inserts or updates the rating entry in the user's shard with `upsert_previous`, which locks the row and returns
+    the rating it replaces, so the `AlsoLiked` counts are updated with exact deltas even when the same user submits
+    concurrently. With
+    write coalescing enabled, the rating is queued instead and shown to the user until it is flushed, and only
+    counts towards the trending books once the flush has committed it.
 
     Parameters:
         book_id (int): The ID of the book to be rated.
@@ -623,19 +605,31 @@ def rate_book(book_id: int):
     book = Book.query.get_or_404(book_id)
     author = book.author
     genres = book.genres
-    avg_rating = db.session.query(func.avg(Rating.rating)).filter_by(book_id=book_id).scalar()
-    avg_rating = round(avg_rating, 2) if avg_rating else "Not rated"
-    current_rating = Rating.query.filter_by(book_id=book_id, user_id=current_user.id).first()
+    avg_rating = book_avg_rating(book_id) or "Not rated"
+    shard = get_router().session(current_user.id)
+    current_rating = shard.query(Rating).filter_by(book_id=book_id, user_id=current_user.id).first()
+    write_behind = get_write_behind()
+    pending_rating = write_behind.pending_rating(current_user.id, book_id) if write_behind else None
+    if pending_rating is not None:
+        current_rating = Rating(rating=pending_rating, book_id=book_id, user_id=current_user.id)
     form = RateBook(rating=current_rating.rating if current_rating else None)
 
     if form.validate_on_submit():
         rating = form.rating.data
-        if current_rating:
-            current_rating.rating = rating
+        if write_behind:
+            write_behind.enqueue({'kind': 'rating', 'user_id': current_user.id, 'book_id': book_id,
+                                  'value': int(rating)})
         else:
-            new_rating = Rating(rating=rating, book_id=book_id, user_id=current_user.id)
-            db.session.add(new_rating)
-        db.session.commit()
+            values = {'rating': int(rating), 'book_id': book_id, 'user_id': current_user.id}
+            previous = upsert_previous(Rating, values, index_elements=['user_id', 'book_id'], update_fields=['rating'],
+                                       previous_field='rating', session=shard)
+            touched = update_also_liked(current_user.id, book_id, previous, rating)
+            record_activity(current_user.id, book_id, 'rating')
+            get_router().commit()
+            bump_activity_version()
+            bump_ratings_version(current_user.id)
+            bump_similarity_versions(touched)
+            record_event(book_id, 'rating')
         logger.info(f"User_id: {current_user.id}, rated book_id: {book_id}, book_name: {book.title}")
         flash('Thank you for your rating!', 'success')
         return redirect(url_for('main.book_details', book_id=book_id))
@@ -668,7 +662,7 @@ def edit_profile():
     current_gender = current_user.gender
 
     if form.validate_on_submit():
-        if bcrypt.check_password_hash(current_user.password, form.password.data):
+        if get_password_hasher().check(current_user.password, form.password.data):
             if form.name.data:
                 current_user.name = form.name.data
             if form.phone.data:
@@ -678,6 +672,7 @@ def edit_profile():
             if form.gender.data:
                 current_user.gender = form.gender.data
             db.session.commit()
+            get_cache().delete(USER_CACHE_KEY.format(user_id=current_user.id))
             logger.info(f"User_id: {current_user.id} updated profile")
             flash("Profile updated successfully", "success")
         else:
@@ -691,6 +686,7 @@ def edit_profile():
 
 @bp.route("/change_password", methods=["GET", "POST"])
 @login_required
+@rate_limited('change_password')
 def change_password():
     """
     Handle the password change request for the authenticated user.
@@ -711,7 +707,7 @@ def change_password():
         new_password = form.new_password.data
         confirm_password = form.confirm_password.data
 
-        if not bcrypt.check_password_hash(current_user.password, old_password):
+        if not get_password_hasher().check(current_user.password, old_password):
             logger.warning(f"User_id: {current_user.id} failed old password, while updating password")
             flash("Old password is incorrect", "error")
             return render_template('change_password.html', form=form)
@@ -719,9 +715,10 @@ def change_password():
             logger.warning(f"User_id: {current_user.id} failed to confirm new password, while updating password")
             flash('Passwords, do not match!', 'error')
             return render_template('change_password.html', form=form)
-        hashed_password = bcrypt.generate_password_hash(new_password).decode('utf-8')
+        hashed_password = get_password_hasher().generate(new_password)
         current_user.password = hashed_password
         db.session.commit()
+        get_cache().delete(USER_CACHE_KEY.format(user_id=current_user.id))
         logger.info(f"User_id: {current_user.id} changed password")
         flash(f'Password is updated', 'success')
         return redirect(url_for('main.home'))
@@ -739,13 +736,13 @@ def your_ratings():
     based on the user's selection and updates the display accordingly.
 
     The function performs the following tasks:
-    - Retrieves all ratings given by the current user and their associated books.
+    - Retrieves all ratings given by the current user from their shard, and their associated books.
     - Formats the ratings and books into a list of dictionaries.
     - Sorts the list based on the user's selection if a POST request is made. Sorting options include:
         - "best": Sort by rating value in descending order.
         - "worst": Sort by rating value in ascending order.
-        - "newest": Sort by the rating ID (newest first).
-        - "oldest": Sort by the rating ID (oldest first).
+        - "newest": Sort by the time the rating was last changed (newest first).
+        - "oldest": Sort by the time the rating was last changed (oldest first).
     - Applies pagination to the sorted list of ratings.
     - Renders the `your_ratings.html` template with the paginated list, sorting form, and relevant data.
 
@@ -754,9 +751,11 @@ def your_ratings():
                   list of rated books, the form used for sorting, and pagination controls.
     """
     form = SortRating()
-    ratings_with_books = db.session.query(Rating, Book).join(Book).filter(Rating.user_id == current_user.id).all()
-    rated_books = [{'book': book, 'rating': rating.rating, 'rating_id': rating.id} for rating, book in
-                   ratings_with_books]
+    ratings = get_router().session(current_user.id).query(Rating).filter(Rating.user_id == current_user.id).all()
+    books = {book.id: book for book in books_in_order([rating.book_id for rating in ratings])}
+    ratings_with_books = [(rating, books[rating.book_id]) for rating in ratings if rating.book_id in books]
+    rated_books = [{'book': book, 'rating': rating.rating, 'rating_id': rating.id,
+                    'rated_at': (rating.updated_at or datetime.min, rating.id)} for rating, book in ratings_with_books]
 
     sorted_books_query = sorted(rated_books, key=lambda x: x['rating'], reverse=True)
     if request.method == 'POST' and form.validate_on_submit():
@@ -766,9 +765,9 @@ def your_ratings():
         elif sorting == "worst":
             sorted_books_query = sorted(rated_books, key=lambda x: x['rating'], reverse=False)
         elif sorting == "newest":
-            sorted_books_query = sorted(rated_books, key=lambda x: x['rating_id'], reverse=True)
+            sorted_books_query = sorted(rated_books, key=lambda x: x['rated_at'], reverse=True)
         elif sorting == "oldest":
-            sorted_books_query = sorted(rated_books, key=lambda x: x['rating_id'], reverse=False)
+            sorted_books_query = sorted(rated_books, key=lambda x: x['rated_at'], reverse=False)
 
     page = request.args.get(get_page_parameter(), type=int, default=1)
     per_page = 20
@@ -790,7 +789,7 @@ def to_read():
     Display a paginated list of books that the current user has marked to read.
 
     Handles GET requests to retrieve and display books marked as 'to read' by the current user. The function
-    joins the `ToRead` and `Book` tables to gather the relevant book information for the user, formats it into a
+    reads the user's `ToRead` entries from their shard and loads their `Book` records, formats them into a
     list, and applies pagination to the results. It then renders the `to_read.html` template with the paginated list.
 
     The function performs the following tasks:
@@ -798,6 +797,7 @@ def to_read():
     - Formats the retrieved data into a list of dictionaries, each containing:
         - `book`: The book object.
         - `toread`: The `ToRead` entry associated with the book.
+    - Applies the user's pending read list changes, if write coalescing is enabled.
     - Applies pagination to the formatted list of books.
     - Renders the `to_read.html` template with the paginated list of books and pagination controls.
 
@@ -805,8 +805,18 @@ def to_read():
         Response: An HTTP response object that renders the 'to_read.html' template with the paginated list of books
                   marked to read by the current user, along with pagination information.
     """
-    toread_list = db.session.query(ToRead, Book).join(Book).filter(ToRead.user_id == current_user.id).all()
-    books_query = [{'book': book, 'toread': toread} for toread, book in toread_list]
+    toread_list = get_router().session(current_user.id).query(ToRead).filter(ToRead.user_id == current_user.id).all()
+    books = {book.id: book for book in books_in_order([toread.book_id for toread in toread_list])}
+    books_query = [{'book': books[toread.book_id], 'toread': toread} for toread in toread_list
+                   if toread.book_id in books]
+    write_behind = get_write_behind()
+    if write_behind:
+        pending = write_behind.pending_to_read(current_user.id)
+        listed_ids = {item['book'].id for item in books_query}
+        books_query = [item for item in books_query if pending.get(item['book'].id, True)]
+        added_ids = [book_id for book_id, listed in pending.items() if listed and book_id not in listed_ids]
+        books_query += [{'book': book, 'toread': ToRead(toread=True, user_id=current_user.id, book_id=book.id)}
+                        for book in Book.query.filter(Book.id.in_(added_ids))]
 
     page = request.args.get(get_page_parameter(), type=int, default=1)
     per_page = 20
@@ -831,8 +841,9 @@ def remove_to_read(book_id: int) -> Response:
     from the database and commits the change. If the entry is not found, it flashes an error message.
 
     The function performs the following tasks:
-    - Retrieves the `ToRead` entry for the specified `book_id` and the current user.
-    - Deletes the entry from the database if it exists and commits the changes.
+    - Retrieves the `ToRead` entry for the specified `book_id` and the current user, from the user's shard.
+    - Deletes the entry from the database if it exists and commits the changes, or queues the deletion if write
+      coalescing is enabled.
     - Logs the removal action and flashes a success message if the book was removed.
     - Flashes an error message if the book was not found in the user's read list.
     - Redirects the user to the "to read" page.
@@ -843,10 +854,19 @@ def remove_to_read(book_id: int) -> Response:
     Returns:
         Response: An HTTP response object that performs a redirection to the 'to_read' page.
     """
-    toread_to_remove = ToRead.query.filter_by(book_id=book_id, user_id=current_user.id).first()
+    shard = get_router().session(current_user.id)
+    toread_to_remove = shard.query(ToRead).filter_by(book_id=book_id, user_id=current_user.id).first()
+    write_behind = get_write_behind()
+    if write_behind:
+        toread_to_remove = write_behind.pending_to_read(current_user.id).get(book_id, toread_to_remove)
     if toread_to_remove:
-        db.session.delete(toread_to_remove)
-        db.session.commit()
+        if write_behind:
+            write_behind.enqueue({'kind': 'to_read', 'user_id': current_user.id, 'book_id': book_id,
+                                  'value': False})
+        else:
+            shard.delete(toread_to_remove)
+            get_router().commit()
+            bump_activity_version()
         logger.info(f"User_id: {current_user.id}, removed book_id {book_id} from read list")
         flash('Book has been removed from your read list', 'success')
     else:
@@ -866,9 +886,10 @@ def write_review(book_id: int):
     display in the review form.
 
     The function performs the following tasks:
-    - Retrieves the existing review for the specified book and user, if it exists.
+    - Retrieves the existing review for the specified book and user from the user's shard, if it exists.
     - Retrieves the book details and author name.
-    - If the form is validated on submission, it updates or creates a review.
+    - If the form is validated on submission, it inserts or updates the review with `upsert_previous`, which tells
+      whether the review is new even when the same user submits concurrently.
     - Commits the changes to the database and logs the review action.
     - Flashes a success message and redirects the user to the book details page upon successful review submission.
     - Renders the review form with existing review data and book details if the form is not submitted or invalid.
@@ -881,17 +902,20 @@ def write_review(book_id: int):
         details page.
     """
     form = WriteReviewForm()
-    old_review = Review.query.filter_by(book_id=book_id, user_id=current_user.id).first()
+    shard = get_router().session(current_user.id)
+    old_review = shard.query(Review).filter_by(book_id=book_id, user_id=current_user.id).first()
     book = Book.query.filter_by(id=book_id).first()
     author = db.session.query(Author.name).join(Book, Book.author_id == Author.id).filter(Book.id == book_id).scalar()
     if form.validate_on_submit():
         review = form.review.data
-        if old_review:
-            old_review.review = review
-        else:
-            new_review = Review(review=review, book_id=book_id, user_id=current_user.id)
-            db.session.add(new_review)
-        db.session.commit()
+        previous_id = upsert_previous(Review, {'review': review, 'book_id': book_id, 'user_id': current_user.id},
+                                      index_elements=['user_id', 'book_id'], update_fields=['review'],
+                                      previous_field='id', session=shard)
+        if previous_id is None:
+            record_activity(current_user.id, book_id, 'review')
+        get_router().commit()
+        bump_activity_version()
+        record_event(book_id, 'review')
         logger.info(f"User_id: {current_user.id}, wrote review for book_id: {book_id}")
         flash('Thank you for your review!', 'success')
         return redirect(url_for('main.book_details', book_id=book_id))
@@ -909,47 +933,42 @@ def your_reviews():
     formatted and passed to the `your_reviews.html` template for rendering.
 
     The function performs the following tasks:
-    - Queries the `Review`, `Book`, `Author`, and `User` tables to retrieve relevant review information for the
-      current user.
+    - Queries the user's `Review` rows in their shard, paginated in the database so only the review texts of the
+      visible page are loaded, then the `Book` and `Author` of the reviews of that page.
     - Formats the retrieved data into a list of dictionaries containing review details.
-    - Applies pagination to the formatted review data.
     - Renders the `your_reviews.html` template, passing the paginated review information.
 
     Returns:
         Response: An HTTP response object that renders the `your_reviews.html` template with the current user's
         paginated review information.
     """
-    reviews = db.session.query(
-        Review.review,
-        Book.title,
-        Book.id.label('book_id'),
-        Author.name.label('author_name'),
-        User.name.label('user_name')
-    ).join(Book, Review.book_id == Book.id) \
-        .join(Author, Book.author_id == Author.id) \
-        .join(User, Review.user_id == User.id) \
-        .filter(User.id == current_user.id).all()
-
-    rev_info_query = [
+    reviews_query = get_router().session(current_user.id).query(Review.review, Review.book_id) \
+        .filter(Review.user_id == current_user.id) \
+        .order_by(Review.id)
+
+    page = request.args.get(get_page_parameter(), type=int, default=1)
+    per_page = 5
+    if page < 1:
+        abort(404)
+    items = reviews_query.offset((page - 1) * per_page).limit(per_page).all()
+    if not items and page > 1:
+        abort(404)
+    books = {book.id: book for book in Book.query.options(db.joinedload(Book.author))
+             .filter(Book.id.in_([review.book_id for review in items]))}
+    rev_info = [
         {
             "review": review.review,
-            "book_title": review.title,
+            "book_title": books[review.book_id].title,
             "book_id": review.book_id,
-            "author_name": review.author_name,
-            "user_name": review.user_name,
+            "author_name": books[review.book_id].author.name,
+            "user_name": current_user.name,
 
         }
-        for review in reviews
+        for review in items if review.book_id in books
     ]
-
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    per_page = 5
-    total = len(rev_info_query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    rev_info = rev_info_query[start:end]
+    total = reviews_query.count()
     pagination = Pagination(page=page, total=total, per_page=per_page, css_framework='bootstrap5')
-    start_num = start + 1
+    start_num = (page - 1) * per_page + 1
 
     return render_template('your_reviews.html', rev_info=rev_info, pagination=pagination,
                            start_num=start_num)
@@ -962,7 +981,9 @@ def book_reviews(book_id: int):
 
     Handles GET and POST requests to display and sort reviews for a specified book. On GET requests, it retrieves
     and paginates all reviews for the book. On POST requests, it processes sorting criteria from a form to reorder
-    the reviews accordingly.
+    the reviews accordingly. The reviews of the book, with their authors' ratings of it, are gathered from every
+    shard without their texts; they are sorted and paginated in Python, and only the review texts of the visible
+    page are loaded, from the shards holding them.
 
     Parameters:
         book_id (int): The ID of the book for which reviews are displayed.
@@ -975,44 +996,61 @@ def book_reviews(book_id: int):
     book = Book.query.filter_by(id=book_id).first()
     author = Author.query.filter_by(id=book.author_id).first()
 
-    reviews = (db.session.query(Review.review, Review.id, User.name, Rating.rating)
-               .join(User, Review.user_id == User.id)
-               .outerjoin(Rating, (Rating.user_id == User.id) & (Rating.book_id == book_id))
-               .filter(Review.book_id == book_id).all())
+    def partial(session):
+        return session.query(Review.id, Review.user_id, Review.updated_at, Rating.rating) \
+            .outerjoin(Rating, (Rating.user_id == Review.user_id) & (Rating.book_id == book_id)) \
+            .filter(Review.book_id == book_id).all()
+    router = get_router()
+    reviews = [(row, shard) for shard, rows in enumerate(router.scatter(partial)) for row in rows]
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_({row.user_id for row, _ in reviews})))
+    reviews = [(row, shard) for row, shard in reviews if row.user_id in names]
+
+    def newest(review):
+        row, shard = review
+        return row.updated_at or datetime.min, row.id, shard
+
+    def best(review):
+        row, _ = review
+        return row.rating is None, -(row.rating or 0), row.id
+
+    def worst(review):
+        row, _ = review
+        return row.rating is not None, row.rating or 0, row.id
+
+    orders = {"best": (best, False), "worst": (worst, False), "newest": (newest, True), "oldest": (newest, False)}
+    sort_key, reverse = orders["newest"]
+    if request.method == 'POST' and form.validate_on_submit():
+        sort_key, reverse = orders.get(form.sorted.data, orders["newest"])
 
-    rev_info = [
+    page = request.args.get(get_page_parameter(), type=int, default=1)
+    per_page = 5
+    if page < 1:
+        abort(404)
+    page_reviews = sorted(reviews, key=sort_key, reverse=reverse)[(page - 1) * per_page:page * per_page]
+    if not page_reviews and page > 1:
+        abort(404)
+    texts = {}
+    sessions = router.sessions()
+    for shard in {shard for _, shard in page_reviews}:
+        ids = [row.id for row, row_shard in page_reviews if row_shard == shard]
+        texts.update(((shard, review_id), text) for review_id, text in
+                     sessions[shard].query(Review.id, Review.review).filter(Review.id.in_(ids)))
+    sorted_rev_info = [
         {
-            "review": review.review,
-            "name": review.name,
+            "review": texts.get((shard, review.id)),
+            "name": names[review.user_id],
             "rating": review.rating,
             "rating_id": review.id
         }
-        for review in reviews
+        for review, shard in page_reviews
     ]
-
-    sorted_rev_info_query = sorted(rev_info, key=lambda x: x['rating_id'], reverse=True)
-    if request.method == 'POST' and form.validate_on_submit():
-        sorting = form.sorted.data
-        if sorting == "best":
-            sorted_rev_info_query = sorted(rev_info, key=lambda x: x['rating'], reverse=True)
-        elif sorting == "worst":
-            sorted_rev_info_query = sorted(rev_info, key=lambda x: x['rating'], reverse=False)
-        elif sorting == "newest":
-            sorted_rev_info_query = sorted(rev_info, key=lambda x: x['rating_id'], reverse=True)
-        elif sorting == "oldest":
-            sorted_rev_info_query = sorted(rev_info, key=lambda x: x['rating_id'], reverse=False)
-
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    per_page = 5
-    total = len(sorted_rev_info_query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    sorted_rev_info = sorted_rev_info_query[start:end]
+    total = len(reviews)
     pagination = Pagination(page=page, total=total, per_page=per_page, css_framework='bootstrap5')
-    start_num = start + 1
+    start_num = (page - 1) * per_page + 1
 
     return render_template('book_reviews.html', form=form, rev_info=sorted_rev_info, book=book,
-                           author=author, pagination=pagination, start_num=start_num)
+                           author=author, avg_rating=book_avg_rating(book_id), pagination=pagination,
+                           start_num=start_num)
 
 
 @bp.route("/admin_page", methods=["GET"])
@@ -1038,7 +1076,196 @@ def admin_page():
     return render_template('admin_page.html')
 
 
+@bp.route("/admin_analytics", methods=["GET"])
+@login_required
+def admin_analytics():
+    """
+    Render the analytics dashboard if the current user is an admin.
+
+    Shows the estimated number of distinct active users, the books with the most distinct readers and the most
+    active reviewers, which come from the probabilistic sketches kept up to date on every rating, review and read
+    list addition. Below them are the rating histogram, daily activity of the last 30 days, genre popularity and
+    cohort retention, read from the rollup tables refreshed by the `rollup-analytics` CLI command, and the hit,
+    miss and eviction counts of the cache. The page never scans the activity tables.
+
+    Returns:
+        Response: An HTTP response object that renders the `admin_analytics.html` template if the user is an admin,
+                  otherwise redirects to the home page with an error message.
+    """
+    if current_user.name != "Admin":
+        logger.warning(f"Unauthorized access attempt to /admin_analytics by user: {current_user.id}")
+        flash("You dont have permits to access this page!", "error")
+        return redirect('/')
+    histogram = RatingHistogram.query.order_by(RatingHistogram.rating).all()
+    daily = DailyActivity.query.order_by(DailyActivity.day.desc()).limit(30).all()
+    genres = GenrePopularity.query.join(Genre).order_by(GenrePopularity.ratings.desc(), Genre.name).all()
+    retention_weeks, retention = retention_table()
+    return render_template('admin_analytics.html', total_readers=total_readers(), books=books_by_readers(),
+                           reviewers=top_reviewers(), histogram=histogram,
+                           histogram_max=max([row.count for row in histogram], default=0), daily=daily,
+                           genres=genres, retention_weeks=retention_weeks, retention=retention,
+                           cache_stats=get_cache().stats())
+
+
+@bp.route("/admin_profiles", methods=["GET"])
+@login_required
+def admin_profiles():
+    """
+    Render the list of request profiles if the current user is an admin.
+
+    The profiles are the traces of slow or sampled requests written by `ProfilerMiddleware` when `PROFILING_ENABLED`
+    is set, the most recent first.
+
+    Returns:
+        Response: An HTTP response object that renders the `admin_profiles.html` template if the user is an admin,
+                  otherwise redirects to the home page with an error message.
+    """
+    if current_user.name != "Admin":
+        logger.warning(f"Unauthorized access attempt to /admin_profiles by user: {current_user.id}")
+        flash("You dont have permits to access this page!", "error")
+        return redirect('/')
+    return render_template('admin_profiles.html', profiles=list_profiles(profiles_directory(current_app)),
+                           enabled=current_app.config.get('PROFILING_ENABLED', False))
+
+
+@bp.route("/admin_profiles/<name>", methods=["GET"])
+@login_required
+def admin_profile(name: str):
+    """
+    Render the per-function breakdown of a request profile if the current user is an admin.
+
+    Args:
+        name (str): The file name of the profile.
+
+    Returns:
+        Response: An HTTP response object that renders the `admin_profile.html` template if the user is an admin,
+                  otherwise redirects to the home page with an error message. Unknown profiles answer 404 Not Found.
+    """
+    if current_user.name != "Admin":
+        logger.warning(f"Unauthorized access attempt to /admin_profiles by user: {current_user.id}")
+        flash("You dont have permits to access this page!", "error")
+        return redirect('/')
+    path = os.path.join(profiles_directory(current_app), name)
+    if not PROFILE_NAME.match(name) or not os.path.exists(path):
+        abort(404)
+    functions, total = profile_breakdown(path)
+    profile = next(profile for profile in list_profiles(profiles_directory(current_app)) if profile['name'] == name)
+    return render_template('admin_profile.html', profile=profile, functions=functions, total=total)
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Export the runtime metrics in the Prometheus text exposition format.
+
+    Covers request counts and latency histograms, database statement counts and time per endpoint, cache hits,
+    misses and evictions, and the password hashing pool. When `METRICS_MULTIPROC_DIR` is set, the samples of all
+    worker processes are merged. Disabled with the `METRICS_ENABLED` config value.
+
+    Returns:
+        Response: The metrics as plain text, or 404 Not Found when disabled.
+    """
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    return Response(registry.render(metrics_directory(current_app.config)), mimetype='text/plain; version=0.0.4')
+
+
+def search_books(title: str = None, author: str = None, genre: str = None, rating_min=None, rating_max=None,
+                 has_review: bool = False, sort_by: str = None) -> List[Book]:
+    """
+    Build and run the book search query for the given criteria.
+
+    Average ratings are computed once per book in an aggregate subquery, which is outer-joined to the books a single
+    time and serves both the rating range filter and the rating sort. Joining `Rating` directly for each of those
+    would multiply the rows of popular books before grouping. With sharded activity tables, the ratings and reviews
+    are not in the catalog's database: the averages and the reviewed books are gathered from every shard instead,
+    and the rating filters and sort applied to the matching books in Python. With `ASYNC_QUERIES_ENABLED`, the
+    catalog query and the shard queries run concurrently, see `async_db.gather_search`.
+
+    Args:
+        title (str): Part of the book title to match, case-insensitive.
+        author (str): Part of the author name to match, case-insensitive.
+        genre (str): Part of a genre name to match, case-insensitive.
+        rating_min: Minimum average rating (inclusive), or empty to skip the filter.
+        rating_max: Maximum average rating (inclusive), or empty to skip the filter.
+        has_review (bool): If True, only books with at least one review are returned.
+        sort_by (str): 'rating_asc' or 'rating_desc' to order by average rating, anything else keeps default order.
+
+    Returns:
+        List[Book]: The books matching all given criteria.
+    """
+    book_alias = db.aliased(Book)
+    query = db.session.query(book_alias).join(Author)
+
+    if title:
+        query = query.filter(book_alias.title.ilike(f'%{title}%'))
+    if author:
+        query = query.filter(Author.name.ilike(f'%{author}%'))
+    if genre:
+        query = query.filter(book_alias.genres.any(Genre.name.ilike(f'%{genre}%')))
+    router = get_router()
+    rated = bool(rating_min or rating_max or sort_by in ('rating_asc', 'rating_desc'))
+    if router.sharded and (has_review or rated) and current_app.config.get('ASYNC_QUERIES_ENABLED'):
+        book_ids, reviewed, averages = current_app.ensure_sync(gather_search)(
+            query.with_entities(book_alias.id).statement, has_review, rated)
+        loaded = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids))}
+        books = [loaded[book_id] for book_id in book_ids if reviewed is None or book_id in reviewed]
+        return filter_by_average(books, averages, rating_min, rating_max, sort_by)
+
+    if has_review:
+        if router.sharded:
+            query = query.filter(book_alias.id.in_(list(activity_counts(Review))))
+        else:
+            query = query.filter(book_alias.reviews.any())
+
+    if router.sharded and rated:
+        return filter_by_average(query.all(), average_ratings(), rating_min, rating_max, sort_by)
+
+    if rated:
+        avg_ratings = db.session.query(Rating.book_id.label('book_id'),
+                                       func.avg(Rating.rating).label('avg_rating')) \
+            .group_by(Rating.book_id).subquery()
+        query = query.outerjoin(avg_ratings, book_alias.id == avg_ratings.c.book_id)
+        if rating_min:
+            query = query.filter(avg_ratings.c.avg_rating >= int(rating_min))
+        if rating_max:
+            query = query.filter(avg_ratings.c.avg_rating <= int(rating_max))
+        if sort_by == 'rating_asc':
+            query = query.order_by(avg_ratings.c.avg_rating.asc())
+        elif sort_by == 'rating_desc':
+            query = query.order_by(avg_ratings.c.avg_rating.desc())
+
+    return query.all()
+
+
+def filter_by_average(books: List[Book], averages: dict, rating_min=None, rating_max=None,
+                      sort_by: str = None) -> List[Book]:
+    """
+    Apply the rating criteria of `search_books` to books in Python, given their average ratings.
+
+    Args:
+        books (List[Book]): The books to filter.
+        averages (dict): The average rating of each rated book, by book ID.
+        rating_min: Minimum average rating (inclusive), or empty to skip the filter.
+        rating_max: Maximum average rating (inclusive), or empty to skip the filter.
+        sort_by (str): 'rating_asc' or 'rating_desc' to order by average rating, anything else keeps the order.
+
+    Returns:
+        List[Book]: The books within the rating range, sorted by average rating if asked, unrated books first when
+                    ascending and last when descending.
+    """
+    if rating_min:
+        books = [book for book in books if averages.get(book.id, -1) >= int(rating_min)]
+    if rating_max:
+        books = [book for book in books if book.id in averages and averages[book.id] <= int(rating_max)]
+    if sort_by in ('rating_asc', 'rating_desc'):
+        books = sorted(books, key=lambda book: (book.id in averages, averages.get(book.id, 0)),
+                       reverse=sort_by == 'rating_desc')
+    return books
+
+
 @bp.route("/search", methods=["GET", "POST"])
+@rate_limited('search')
 def search():
     """
     Handle search requests for books based on various criteria.
@@ -1049,12 +1276,17 @@ def search():
     On GET requests, it initializes the search form with available authors and genres.
 
     On POST requests, it performs the search based on the submitted form data, filtering and sorting the results
-    according to user inputs. It also saves the search results in a JSON file if the user is authenticated.
+    according to user inputs. The IDs of the matching books are cached for a short time per set of criteria, until
+    the next rating, review or read list change, see `cache.activity_version`. It also saves the search results in
+    a JSON file if the user is authenticated: only the `SEARCH_RESULTS_SHOWN` results that are displayed, with the
+    total count.
 
-    The search results are either displayed to the user or a message is flashed if no results are found.
+    The search results are either displayed to the user or a message is flashed if no results are found. The page
+    is streamed, see `stream_page`, and the displayed results are loaded in batches by `serialized_books` while it
+    is rendered.
 
     Returns:
-        Response: An HTTP response object that renders the `search.html` template with the search form, results,
+        Response: An HTTP response object that streams the `search.html` template with the search form, results,
                   count of results, and any saved searches.
     """
     form = SearchForm()
@@ -1062,7 +1294,7 @@ def search():
                                                                Author.query.order_by(Author.name).all()]
     form.select_genre.choices = [('', 'Select genre')] + [(genre.name, genre.name) for genre in
                                                           Genre.query.order_by(Genre.name).all()]
-    results = []
+    result_ids, results = [], []
 
     saved_searches = []
     if os.path.exists('instance/search_results.json'):
@@ -1077,50 +1309,14 @@ def search():
         rating_max = form.rating_max.data
         sort_by = form.sort_by.data
 
-        book_alias = db.aliased(Book)
-        rating_alias = db.aliased(Rating)
-        query = db.session.query(book_alias).join(Author)
-
-        if title:
-            query = query.filter(book_alias.title.ilike(f'%{title}%'))
-        if author:
-            query = query.filter(Author.name.ilike(f'%{author}%'))
-
-        if genre:
-            query = query.join(book_genres, book_alias.id == book_genres.c.book_id) \
-                .join(Genre, Genre.id == book_genres.c.genre_id) \
-                .filter(Genre.name.ilike(f'%{genre}%'))
-
-        if rating_min or rating_max:
-            query = query.join(rating_alias, book_alias.id == rating_alias.book_id).group_by(book_alias.id)
-            if rating_min:
-                query = query.having(func.avg(rating_alias.rating) >= int(rating_min))
-            if rating_max:
-                query = query.having(func.avg(rating_alias.rating) <= int(rating_max))
-        if form.review.data:
-            query = query.filter(book_alias.reviews.any())
-
-        if sort_by == 'rating_asc':
-            query = query.outerjoin(Rating, book_alias.id == Rating.book_id) \
-                .group_by(book_alias.id) \
-                .order_by(func.avg(Rating.rating).asc())
-        elif sort_by == 'rating_desc':
-            query = query.outerjoin(Rating, book_alias.id == Rating.book_id) \
-                .group_by(book_alias.id) \
-                .order_by(func.avg(Rating.rating).desc())
-
-        results = query.all()
+        criteria = {'title': title, 'author': author, 'genre': genre, 'rating_min': rating_min,
+                    'rating_max': rating_max, 'has_review': form.review.data, 'sort_by': sort_by}
+        key = f'search:{activity_version()}:{json.dumps(criteria, sort_keys=True, default=str)}'
+        result_ids = get_cache().get_or_set(key, lambda: [book.id for book in search_books(**criteria)])
 
+        results = serialized_books(result_ids[:SEARCH_RESULTS_SHOWN])
         if current_user.is_authenticated:
-            serialized_results = []
-            for result in results:
-                serialized_results.append({
-                    'id': result.id,
-                    'title': result.title,
-                    'author': {'name': result.author.name},
-                    'genres': [{'name': genre.name} for genre in result.genres],
-                    'avg_rating': result.avg_rating
-                })
+            results = list(results)
             current_time = datetime.now().isoformat()
             search_id = str(uuid.uuid4())
 
@@ -1128,7 +1324,8 @@ def search():
                 "search_id": search_id,
                 "user_id": current_user.id,
                 "timestamp": current_time,
-                "jsoned_results": serialized_results
+                "count": len(result_ids),
+                "jsoned_results": results
             }
 
             if os.path.exists('instance/search_results.json'):
@@ -1141,13 +1338,13 @@ def search():
             with open('instance/search_results.json', 'w') as file:
                 json.dump(data, file, indent=4)
             logger.info(f"Search performed by user_id: {current_user.id}")
-        if not results:
+        if not result_ids:
             flash("No books met your search criteria.", "error")
         saved_searches = [res for res in saved_searches if res['user_id'] == current_user.id]
     saved_searches = saved_searches[-10:][::-1]
 
-    return render_template('search.html', form=form, results=results[:50], count=len(results),
-                           saved_searches=saved_searches)
+    return stream_page('search.html', form=form, results=results, count=len(result_ids),
+                       saved_searches=saved_searches)
 
 
 @bp.route("/saved_search/<search_id>", methods=["GET"])
@@ -1177,41 +1374,176 @@ def load_saved_search(search_id: str):
         if saved_search:
             results = saved_search['jsoned_results']
             logger.info(f"Saved search results accessed by user_id: {current_user.id}")
-            return render_template('search.html', form=None, results=results[:50], count=len(results),
-                                   saved_searches=saved_searches)
+            return stream_page('search.html', form=None, results=results[:SEARCH_RESULTS_SHOWN],
+                               count=saved_search.get('count', len(results)), saved_searches=saved_searches)
     flash("Saved search results not found.", "error")
     return redirect(url_for('main.search'))
 
 
-@bp.route("/all_ratings", methods=["GET"])
-def all_ratings():
+def books_in_order(book_ids: List[int]) -> List[Book]:
     """
-    Retrieve and display paginated books with their average ratings.
+    Load the books with the given IDs in one query, keeping the order of the IDs.
 
-    Queries all books from the database, calculates their average ratings, and filters out books without an average
-    rating.
-    The remaining books are sorted by their average rating in descending order and paginated. The function renders the
-    `all_ratings.html` template with the paginated list of books.
+    Args:
+        book_ids (List[int]): The IDs of the books, e.g. as cached by a view.
 
     Returns:
-        Response: An HTTP response object that renders the `all_ratings.html` template with a paginated and sorted list
-                  of books based on their average ratings.
+        List[Book]: The books that still exist, in the order of `book_ids`.
     """
-    books = Book.query.all()
-    books_with_avg_rating = [(book, book.avg_rating) for book in books if book.avg_rating is not None]
-    sorted_books_query = sorted(books_with_avg_rating, key=lambda x: x[1], reverse=True)
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids))} if book_ids else {}
+    return [books[book_id] for book_id in book_ids if book_id in books]
+
+
+def iter_books_in_order(book_ids: List[int], batch_size: int = 20) -> Iterator[Book]:
+    """
+    Yield the books with the given IDs in their order, loading them `batch_size` at a time.
+
+    Meant for streamed pages: the first rows are rendered before the later ones are loaded, and the books of
+    rendered batches can be garbage collected, so memory stays bounded however long the list is.
+
+    Args:
+        book_ids (List[int]): The IDs of the books.
+        batch_size (int): Number of books loaded by each query.
+
+    Yields:
+        Book: The books that still exist, in the order of `book_ids`.
+    """
+    for start in range(0, len(book_ids), batch_size):
+        yield from books_in_order(book_ids[start:start + batch_size])
+
+
+def serialized_books(book_ids: List[int], batch_size: int = 50) -> Iterator[dict]:
+    """
+    Yield the books with the given IDs as plain dictionaries, in the order of the IDs, as saved with searches.
+
+    Each batch of `batch_size` books takes four queries: the books, their authors and their genres loaded with
+    `selectinload`, and their average ratings from one grouped query per shard, instead of lazy loading the
+    author, the genres and every `Rating` of each book.
+
+    Args:
+        book_ids (List[int]): The IDs of the books.
+        batch_size (int): Number of books loaded at a time.
+
+    Yields:
+        dict: The ID, title, author name, genre names and average rating (None if unrated) of each book that
+              still exists.
+    """
+    for start in range(0, len(book_ids), batch_size):
+        batch_ids = book_ids[start:start + batch_size]
+        books = {book.id: book for book in Book.query.filter(Book.id.in_(batch_ids))
+                 .options(db.selectinload(Book.author), db.selectinload(Book.genres))}
+        averages = average_ratings(batch_ids)
+        for book_id in batch_ids:
+            book = books.get(book_id)
+            if book is not None:
+                average = averages.get(book_id)
+                yield {
+                    'id': book.id,
+                    'title': book.title,
+                    'author': {'name': book.author.name},
+                    'genres': [{'name': genre.name} for genre in book.genres],
+                    'avg_rating': round(average, 2) if average is not None else None,
+                }
+
+
+def buffered(chunks: Iterator[str], size: int) -> Iterator[str]:
+    """
+    Group small chunks of a streamed page into chunks of at least `size` characters, except the last one.
+
+    Closing it closes `chunks` too, so a page the client stopped reading releases its request context right away.
+    """
+    buffer, length = [], 0
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield ''.join(buffer)
+                buffer, length = [], 0
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        chunks.close()
+
+
+def stream_page(template_name: str, **context) -> Response:
+    """
+    Render a template as a streamed response, so the header and sidebar of `base.html` reach the browser before
+    the rows of the page are loaded and rendered.
+
+    The template's output is sent in chunks of `STREAM_BUFFER_SIZE` characters (default 1024) instead of one write
+    per template statement. Flashed messages are taken from the session before streaming starts, because the
+    session cookie cannot change once the headers are sent. Streamed responses are compressed chunk by chunk, see
+    `compression.compress_stream`.
+
+    Args:
+        template_name (str): The template to render.
+        **context: The template's variables; iterables such as `iter_books_in_order` are consumed while streaming.
+
+    Returns:
+        Response: The streamed HTML response.
+    """
+    get_flashed_messages()
+    chunks = stream_template(template_name, **context)
+    return Response(buffered(chunks, current_app.config.get('STREAM_BUFFER_SIZE', 1024)), mimetype='text/html')
 
+
+def leaderboard(kind: str) -> List[Tuple[int, float]]:
+    """
+    Return the book IDs ranked for one of the `all_*` pages, computed by one grouped query per shard and cached.
+
+    The partial sums and counts of the shards are merged before ranking, see `sharding.merge_averages`. The cached
+    ranking is dropped by the next rating, review or read list change, see `cache.activity_version`.
+
+    Args:
+        kind (str): 'ratings' for average ratings of rated books, 'reviews' for review counts or 'read_listed'
+                    for read list counts of all books.
+
+    Returns:
+        List[Tuple[int, float]]: Book IDs with their average rating or count, highest first, ties in ID order.
+    """
+    def compute():
+        if kind == 'ratings':
+            rows = [(book_id, round(avg, 2)) for book_id, avg in sorted(average_ratings().items())]
+        else:
+            counts = activity_counts(Review if kind == 'reviews' else ToRead)
+            rows = [(book_id, counts[book_id]) for book_id, in db.session.query(Book.id).order_by(Book.id)]
+        return sorted(rows, key=lambda x: x[1], reverse=True)
+    return get_cache().get_or_set(f'leaderboard:{kind}:{activity_version()}', compute)
+
+
+def leaderboard_page(kind: str, per_page: int = 20):
+    """
+    Return one page of a leaderboard for the `all_*` views, with its `Book` objects loaded while it is rendered.
+
+    Returns:
+        Tuple[Iterator[Tuple[Book, float]], Pagination, int]: The books with their values, the pagination and the
+                                                              position of the first book.
+    """
+    ranked = leaderboard(kind)
     page = request.args.get(get_page_parameter(), type=int, default=1)
-    per_page = 20
-    total = len(sorted_books_query)
     start = (page - 1) * per_page
-    end = start + per_page
-    sorted_books = sorted_books_query[start:end]
-    pagination = Pagination(page=page, total=total, per_page=per_page, css_framework='bootstrap5')
-    start_num = start + 1
+    page_rows = ranked[start:start + per_page]
+    values = dict(page_rows)
+    sorted_books = ((book, values[book.id]) for book in iter_books_in_order([book_id for book_id, _ in page_rows]))
+    pagination = Pagination(page=page, total=len(ranked), per_page=per_page, css_framework='bootstrap5')
+    return sorted_books, pagination, start + 1
 
-    return render_template("all_ratings.html", sorted_books=sorted_books, pagination=pagination,
-                           start_num=start_num)
+
+@bp.route("/all_ratings", methods=["GET"])
+def all_ratings():
+    """
+    Retrieve and display paginated books with their average ratings.
+
+    Books without ratings are left out. The ranking comes from the cached `leaderboard`, so only the books on the
+    requested page are loaded, while the page is streamed.
+
+    Returns:
+        Response: An HTTP response object that streams the `all_ratings.html` template with a paginated and sorted
+                  list of books based on their average ratings.
+    """
+    sorted_books, pagination, start_num = leaderboard_page('ratings')
+    return stream_page("all_ratings.html", sorted_books=sorted_books, pagination=pagination, start_num=start_num)
 
 
 @bp.route("/all_reviews", methods=["GET"])
@@ -1219,29 +1551,15 @@ def all_reviews():
     """
     Retrieve and display paginated books with their review counts.
 
-    Queries all books from the database and counts the number of reviews associated with each book. The books are
-    then sorted by their review count in descending order and paginated. The function renders the `all_reviews.html`
-    template with the paginated list of books and their review counts.
+    The ranking comes from the cached `leaderboard`, so only the books on the requested page are loaded, while the
+    page is streamed.
 
     Returns:
-        Response: An HTTP response object that renders the `all_reviews.html` template with a paginated and sorted list
-                  of books based on their review counts.
+        Response: An HTTP response object that streams the `all_reviews.html` template with a paginated and sorted
+                  list of books based on their review counts.
     """
-    books = Book.query.all()
-    books_with_review_count = [(book, len(Review.query.filter_by(book_id=book.id).all())) for book in books]
-    sorted_books_query = sorted(books_with_review_count, key=lambda x: x[1], reverse=True)
-
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    per_page = 20
-    total = len(sorted_books_query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    sorted_books = sorted_books_query[start:end]
-    pagination = Pagination(page=page, total=total, per_page=per_page, css_framework='bootstrap5')
-    start_num = start + 1
-
-    return render_template("all_reviews.html", sorted_books=sorted_books, pagination=pagination,
-                           start_num=start_num)
+    sorted_books, pagination, start_num = leaderboard_page('reviews')
+    return stream_page("all_reviews.html", sorted_books=sorted_books, pagination=pagination, start_num=start_num)
 
 
 @bp.route("/all_read_listed", methods=["GET"])
@@ -1249,41 +1567,97 @@ def all_read_listed():
     """
     Retrieve and display paginated books with their read list counts.
 
-    Queries all books from the database and counts how many times each book has been added to users' read lists.
-    The books are sorted by their read list counts in descending order and paginated. The function renders the
-    `all_read_listed.html` template with the paginated and sorted list of books.
+    The ranking comes from the cached `leaderboard`, so only the books on the requested page are loaded, while the
+    page is streamed.
 
     Returns:
-        Response: An HTTP response object that renders the `all_read_listed.html` template with a paginated list of
+        Response: An HTTP response object that streams the `all_read_listed.html` template with a paginated list of
                   books sorted by their read list counts.
     """
-    books = Book.query.all()
-    books_with_read_list_count = [(book, len(ToRead.query.filter_by(book_id=book.id).all())) for book in books]
-    sorted_books_query = sorted(books_with_read_list_count, key=lambda x: x[1], reverse=True)
+    sorted_books, pagination, start_num = leaderboard_page('read_listed')
+    return stream_page("all_read_listed.html", sorted_books=sorted_books, pagination=pagination, start_num=start_num)
 
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    per_page = 20
-    total = len(sorted_books_query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    sorted_books = sorted_books_query[start:end]
-    pagination = Pagination(page=page, total=total, per_page=per_page, css_framework='bootstrap5')
-    start_num = start + 1
 
-    return render_template("all_read_listed.html", sorted_books=sorted_books, pagination=pagination,
-                           start_num=start_num)
+def books_with_avg_rating(book_ids) -> List[Tuple[Book, float]]:
+    """
+    Fetch the given books together with their average ratings, from one grouped query per shard.
+
+    Replaces scanning the whole catalog and lazy-loading every book's ratings to compute `Book.avg_rating`. Books
+    without ratings are left out, as they are by the pages that list books by rating.
+
+    Args:
+        book_ids: An iterable of book IDs.
+
+    Returns:
+        List[Tuple[Book, float]]: Tuples of a `Book` and its average rating rounded to 2 decimal places, sorted by
+                                  the average rating in descending order.
+    """
+    averages = average_ratings(book_ids)
+    books = Book.query.filter(Book.id.in_(list(averages))).order_by(Book.id).all() if averages else []
+    return sorted([(book, round(averages[book.id], 2)) for book in books], key=lambda x: x[1], reverse=True)
+
+
+def book_avg_rating(book_id: int):
+    """Return the average rating of a book over all shards, rounded to 2 decimal places, or None if it is unrated."""
+    average = average_ratings([book_id]).get(book_id)
+    return round(average, 2) if average is not None else None
+
+
+def recommended_for_books(seed_books: List[Book], user_id: int = None) \
+        -> List[Tuple[Book, List[Tuple[Book, float]]]]:
+    """
+    Generate recommendation lists for several of a user's 5-star books at once.
+
+    For every seed book, the recommended books are those rated 5 by other users who also rated the seed book 5,
+    leaving out every book the user has rated 5. Instead of repeating the same `Rating` scans for each seed,
+    all (seed book, recommended book) pairs are collected by one self-join of `Rating`, and the average ratings of
+    all recommended books are fetched by one grouped query. Both ratings of a pair are by the same user, so the
+    self-join runs in each shard and the pairs of the shards are combined.
+
+    Args:
+        seed_books (List[Book]): The books the user rated 5 to generate recommendations for.
+        user_id (int): The ID of the user, the current user if not given.
+
+    Returns:
+        List[Tuple[Book, List[Tuple[Book, float]]]]: A tuple for each seed book, in the given order, containing the
+                                                     seed book and its recommended books with their average ratings,
+                                                     sorted by the average rating in descending order.
+    """
+    seed_ids = [book.id for book in seed_books]
+    if not seed_ids:
+        return []
+    if user_id is None:
+        user_id = current_user.id
+    router = get_router()
+    seed_rating = db.aliased(Rating)
+    other_rating = db.aliased(Rating)
+    your_rated5 = [book_id for book_id, in router.session(user_id).query(Rating.book_id)
+                   .filter_by(user_id=user_id, rating=5)]
+
+    def partial(session):
+        return session.query(seed_rating.book_id, other_rating.book_id) \
+            .join(other_rating, other_rating.user_id == seed_rating.user_id) \
+            .filter(seed_rating.book_id.in_(seed_ids), seed_rating.rating == 5,
+                    seed_rating.user_id != user_id,
+                    other_rating.rating == 5, ~other_rating.book_id.in_(your_rated5)) \
+            .distinct().all()
+    pairs = {pair for rows in router.scatter(partial) for pair in rows}
+
+    recommended_ids = {}
+    for seed_id, book_id in pairs:
+        recommended_ids.setdefault(seed_id, set()).add(book_id)
+    all_recommended = books_with_avg_rating({book_id for ids in recommended_ids.values() for book_id in ids})
+    return [(seed_book, [(book, avg) for book, avg in all_recommended
+                         if book.id in recommended_ids.get(seed_book.id, ())])
+            for seed_book in seed_books]
 
 
 def recommended_for_each_book(best_book: int) -> List[Tuple[Book, float]]:
     """
     Generate a list of recommended books based on user ratings.
 
-    This function generates a list of books recommended for the current user based on their rating of a specific book.
-    It performs the following steps:
-    1. Finds all books rated 5 by the current user.
-    2. Identifies users who have rated the same book with a rating of 5.
-    3. Collects books rated 5 by these similar users that the current user hasn't rated.
-    4. Returns a sorted list of these books based on their average rating in descending order.
+    Single-book form of `recommended_for_books`: books rated 5 by users who also rated `best_book` 5, that the
+    current user hasn't rated 5, sorted by their average rating in descending order.
 
     Args:
         best_book (int): The ID of the book that the current user has rated highly (rating of 5).
@@ -1294,21 +1668,75 @@ def recommended_for_each_book(best_book: int) -> List[Tuple[Book, float]]:
                                   based on the current user's ratings and those of similar users are included.
     """
     if best_book:
-        your_rated5 = Rating.query.filter_by(user_id=current_user.id, rating=5).all()
-        book_ids_all = [rating.book_id for rating in your_rated5]
-        your_rated5 = Rating.query.filter_by(user_id=current_user.id, rating=5, book_id=best_book).all()
-        book_ids = [rating.book_id for rating in your_rated5]
-        users_alike = Rating.query.filter(Rating.book_id.in_(book_ids), Rating.rating == 5,
-                                          Rating.user_id != current_user.id).all()
-        users_alike_ids = [user.user_id for user in users_alike]
-        books_alike = Rating.query.filter(Rating.user_id.in_(users_alike_ids),
-                                          Rating.rating == 5, ~Rating.book_id.in_(book_ids_all)).all()
-        recommended_books_ids = set([book.book_id for book in books_alike])
-        books = Book.query.all()
-        books_with_avg_rating = [(book, book.avg_rating) for book in books if book.id in recommended_books_ids
-                                 and book.avg_rating is not None]
-        sorted_books = sorted(books_with_avg_rating, key=lambda x: x[1], reverse=True)
-        return sorted_books
+        book = db.session.get(Book, best_book)
+        return recommended_for_books([book])[0][1] if book else []
+
+
+def predicted_for_user(user_id: int, k: int = 10) -> List[Tuple[Book, float]]:
+    """
+    Return the books with the highest predicted ratings for a user from the published recommender model.
+
+    The model is read from the shared model store, so a newly published model is used without a restart. Books the
+    user has rated or added to their read list are left out.
+
+    Args:
+        user_id (int): The ID of the user.
+        k (int): The maximum number of books to return.
+
+    Returns:
+        List[Tuple[Book, float]]: Tuples of a `Book` and its predicted rating rounded to 2 decimal places, best first.
+                                  Empty if no model was published or the user had no ratings when it was trained.
+    """
+    model = get_model_store().open()
+    if model is None:
+        return []
+    from book_system_project.factorization import recommend_for_user
+    predictions = recommend_for_user(model, user_id, k)
+    books = {book.id: book for book in Book.query.filter(Book.id.in_([book_id for book_id, _ in predictions]))}
+    return [(books[book_id], round(score, 2)) for book_id, score in predictions if book_id in books]
+
+
+def compute_recommendations(user_id: int):
+    """
+    Compute the recommendation data of a user, as plain IDs and numbers that can be cached.
+
+    The user's 5-star books are read from their shard. The users who also rated one of them 5 and their other
+    5-star books are found in each shard, since all ratings of a user are in the same one, and combined. With
+    `ASYNC_QUERIES_ENABLED`, the independent queries run concurrently on asyncio engines, see
+    `async_db.gather_recommendations`.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        dict: The recommended book IDs with their average ratings ('sorted'), the recommended book IDs for each
+              5-star book of the user ('separate') and the predicted book IDs with their scores ('predicted'), see
+              `recommended_for_you`. None if the user has not rated any book 5.
+    """
+    if current_app.config.get('ASYNC_QUERIES_ENABLED'):
+        recommendations = current_app.ensure_sync(gather_recommendations)(user_id)
+        if recommendations is not None:
+            recommendations['predicted'] = [(book.id, score) for book, score in predicted_for_user(user_id)]
+        return recommendations
+    router = get_router()
+    your_rated5 = router.session(user_id).query(Rating).filter_by(user_id=user_id, rating=5).all()
+    if not your_rated5:
+        return None
+    book_ids = [rating.book_id for rating in your_rated5]
+    your_rated5_books = Book.query.filter(Book.id.in_(book_ids)).all()
+
+    def partial(session):
+        users_alike = session.query(Rating.user_id).filter(Rating.book_id.in_(book_ids), Rating.rating == 5,
+                                                           Rating.user_id != user_id)
+        return session.query(Rating.book_id).filter(Rating.user_id.in_(users_alike),
+                                                    Rating.rating == 5, ~Rating.book_id.in_(book_ids)).all()
+    books_alike = {book_id for rows in router.scatter(partial) for book_id, in rows}
+    return {
+        'sorted': [(book.id, avg) for book, avg in books_with_avg_rating(books_alike)],
+        'separate': [(seed.id, [(book.id, avg) for book, avg in recommended])
+                     for seed, recommended in recommended_for_books(your_rated5_books, user_id)],
+        'predicted': [(book.id, score) for book, score in predicted_for_user(user_id)],
+    }
 
 
 @bp.route("/recommended_for_you", methods=["GET"])
@@ -1322,7 +1750,10 @@ def recommended_for_you():
     2. Retrieves books that the user has rated 5 and finds other users who rated those books 5.
     3. Identifies books rated 5 by similar users that the current user hasn't rated.
     4. Compiles recommendations based on the high-rated books and sorts them by average rating.
-    5. For each book the user rated 5, additional recommendations are generated using `recommended_for_each_book`.
+    5. For each book the user rated 5, additional recommendations are generated in one batch using
+       `recommended_for_books`.
+
+    The recommended book IDs are cached per user, see `compute_recommendations` and `cached_recommendations`.
 
     If the user has not given any books a rating of 5, a flash message is shown and the user is redirected to the
     homepage.
@@ -1332,28 +1763,24 @@ def recommended_for_you():
             - `sorted_books`: A list of recommended books sorted by average rating in descending order.
             - `separate_results`: A list of tuples where each tuple contains a book rated 5 by the user and
               a list of recommended books for that particular book.
+            - `seed_ratings`: The average ratings of the books rated 5 by the user.
+            - `predicted_books`: Books with their predicted ratings from the matrix factorization model, see
+              `predicted_for_user`.
     """
-    your_rated5 = Rating.query.filter_by(user_id=current_user.id, rating=5).all()
-    if not your_rated5:
+    cached = cached_recommendations(current_user.id, compute_recommendations, ttl=RECOMMENDATIONS_CACHE_TTL)
+    if cached is None:
         flash("You have not given any book rating 5 yet. No personal recommendations available", "info")
         return redirect('/')
-    book_ids = [rating.book_id for rating in your_rated5]
-    your_rated5_books = Book.query.filter(Book.id.in_(book_ids)).all()
-    users_alike = Rating.query.filter(Rating.book_id.in_(book_ids), Rating.rating == 5,
-                                      Rating.user_id != current_user.id).all()
-    users_alike_ids = [user.user_id for user in users_alike]
-    books_alike = Rating.query.filter(Rating.user_id.in_(users_alike_ids),
-                                      Rating.rating == 5, ~Rating.book_id.in_(book_ids)).all()
-    recommended_books_ids = set([book.book_id for book in books_alike])
-    books = Book.query.all()
-    books_with_avg_rating = [(book, book.avg_rating) for book in books if book.id in recommended_books_ids
-                             and book.avg_rating is not None]
-    sorted_books = sorted(books_with_avg_rating, key=lambda x: x[1], reverse=True)
-    separate_results = []
-    for book in your_rated5_books:
-        original_book = book
-        recommended_books = recommended_for_each_book(book.id)
-        separate_results.append((original_book, recommended_books))
-
-    return render_template("recommended_for_you.html", sorted_books=sorted_books,
-                           separate_results=separate_results)
+    all_ids = {book_id for book_id, _ in cached['sorted'] + cached['predicted']}
+    for seed_id, recommended in cached['separate']:
+        all_ids |= {seed_id} | {book_id for book_id, _ in recommended}
+    books = {book.id: book for book in books_in_order(list(all_ids))}
+    sorted_books = [(books[book_id], avg) for book_id, avg in cached['sorted'] if book_id in books]
+    separate_results = [(books[seed_id], [(books[book_id], avg) for book_id, avg in recommended if book_id in books])
+                        for seed_id, recommended in cached['separate'] if seed_id in books]
+    seed_ratings = {book_id: round(average, 2)
+                    for book_id, average in average_ratings([seed.id for seed, _ in separate_results]).items()}
+    predicted_books = [(books[book_id], score) for book_id, score in cached['predicted'] if book_id in books]
+
+    return render_template("recommended_for_you.html", sorted_books=sorted_books, seed_ratings=seed_ratings,
+                           separate_results=separate_results, predicted_books=predicted_books)
@@ -0,0 +1,173 @@
+import csv
+from datetime import datetime
+from random import randint, choice
+from sqlalchemy.exc import IntegrityError
+from book_system_project.models import db, Book, User, Rating, Author, Genre, ToRead, Review
+from book_system_project.password_hashing import get_password_hasher
+from book_system_project.also_liked import rebuild_also_liked
+from book_system_project.analytics import rebuild_analytics
+from book_system_project.rollups import run_rollups
+from book_system_project.sharding import get_router
+
+
+def seed_books() -> int:
+    """
+    Add the demo books from `media/books66.py` with their authors and genres.
+
+    Books that already exist with the same title and author are skipped.
+
+    Returns:
+        int: The number of books added.
+    """
+    from book_system_project.media.books66 import books_list
+    books_added = 0
+    for book in books_list:
+        author_name = book['Author']
+        book_title = book['Title']
+        genre_names = book['Genres'].split(',')
+
+        author = Author.query.filter_by(name=author_name).first()
+        if not author:
+            author = Author(name=author_name)
+            db.session.add(author)
+            db.session.commit()
+
+        genres = []
+        for genre_name in genre_names:
+            genre = Genre.query.filter_by(name=genre_name.strip()).first()
+            if not genre:
+                genre = Genre(name=genre_name.strip())
+                db.session.add(genre)
+                db.session.commit()
+            genres.append(genre)
+
+        existing_book = Book.query.filter_by(title=book_title, author_id=author.id).first()
+        if existing_book:
+            continue
+
+        book = Book(title=book_title, author_id=author.id)
+        for genre in genres:
+            book.genres.append(genre)
+
+        db.session.add(book)
+
+        try:
+            db.session.commit()
+            books_added += 1
+        except IntegrityError:
+            db.session.rollback()
+            continue
+    return books_added
+
+
+def seed_users() -> int:
+    """
+    Add the demo users from `media/users60.txt`, skipping emails that are already registered.
+
+    Returns:
+        int: The number of users added.
+    """
+    users_added = 0
+    with open('book_system_project/media/users60.txt', newline='') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter='\t')
+        for row in reader:
+            full_name = f"{row['first_name'].strip()} {row['last_name'].strip()}"
+
+            user = User(
+                name=full_name,
+                email=row['email'],
+                password=get_password_hasher().generate(row['password']),
+                phone=row['phone'],
+                date_of_birth=datetime.strptime(row['date_of_birth'], '%Y-%m-%d').date(),
+                gender=row['gender']
+            )
+            db.session.add(user)
+            try:
+                db.session.commit()
+                users_added += 1
+            except IntegrityError:
+                db.session.rollback()
+                continue
+    return users_added
+
+
+def randomize_review() -> str:
+    """
+    Generate a random review composed of a series of sentences.
+
+    This function reads a file containing a list of words, splits them into a list,
+    and generates a random review by forming sentences of random lengths from these words.
+
+    Returns:
+        str: A randomly generated review consisting of 5 to 12 sentences.
+    """
+    with open('book_system_project/media/words3000.txt', 'r') as file:
+        words = file.read()
+    words = words.split()
+
+    def get_result(word_list, sentence_length) -> str:
+        """
+        Generate a random sentence from a list of words.
+
+        Args:
+            word_list (list): The list of words to form sentences from.
+            sentence_length (int): The number of words in the sentence.
+
+        Returns:
+            str: A randomly generated sentence with the specified length.
+        """
+        sentence = ' '.join(choice(word_list) for _ in range(sentence_length))
+        return sentence[0].upper() + sentence[1:]
+
+    number_of_sentences = randint(5, 12)
+    sentences = [get_result(words, randint(5, 15)) for _ in range(number_of_sentences)]
+    return '. '.join(sentences) + '.'
+
+
+def seed_ratings(exclude_user_id: int = None) -> None:
+    """
+    Add random ratings, read list entries and reviews for every user, then rebuild the derived tables.
+
+    The amount and type of data generated for a user depend on the position of the book in the catalog: the first
+    books get random ratings, later ones mostly high or mostly low ratings, and only some books get read list entries
+    and reviews. Books the user already rated are skipped. The rows are written to the user's shard. `AlsoLiked`, the
+    analytics sketches and the rollup tables are rebuilt afterwards, since the inserts bypass the views that keep them
+    up to date.
+
+    Args:
+        exclude_user_id (int): A user to leave out, such as the admin running the seeding.
+    """
+    router = get_router()
+    for user in User.query.all():
+        if user.id != exclude_user_id:
+            shard = router.session(user.id)
+            book_list = Book.query.all()
+            to_rate = int(len(book_list) * 0.9)
+            counter = 0
+            for book in book_list:
+                check = shard.query(Rating).filter_by(user_id=user.id, book_id=book.id).first()
+                if check:
+                    continue
+                if counter < to_rate:
+                    review = randomize_review()
+                    rating = randint(1, 5)
+                    if counter <= 30:
+                        add_rating = Rating(user_id=user.id, rating=rating, book_id=book.id)
+                        shard.add(add_rating)
+                    if 30 < counter <= 40:
+                        add_rating = Rating(user_id=user.id, rating=randint(4, 5), book_id=book.id)
+                        shard.add(add_rating)
+                    if 40 < counter <= 50:
+                        add_rating = Rating(user_id=user.id, rating=randint(1, 2), book_id=book.id)
+                        shard.add(add_rating)
+                    if 10 < counter <= 50 and randint(1, 3) > 1:
+                        add_to_read = ToRead(user_id=user.id, toread=1, book_id=book.id)
+                        shard.add(add_to_read)
+                    if 20 < counter <= 60 and randint(1, 3) > 1:
+                        add_review = Review(user_id=user.id, review=review, book_id=book.id)
+                        shard.add(add_review)
+                    counter += 1
+            router.commit()
+    rebuild_also_liked()
+    rebuild_analytics()
+    run_rollups(full=True)
@@ -0,0 +1,253 @@
+import os
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, List
+from flask import Flask, current_app, g
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+from book_system_project.models import db, Rating, ToRead, Review
+
+ACTIVITY_MODELS = (Rating, ToRead, Review)
+"""The per-user activity tables, which live in the user's shard. Every other table stays in the main database."""
+
+
+def shard_index(user_id: int, shard_count: int) -> int:
+    """
+    Return the shard of a user, from a CRC-32 hash of their ID.
+
+    The hash spreads consecutive IDs over the shards and is the same in every process, unlike Python's `hash`.
+    """
+    return zlib.crc32(str(int(user_id)).encode()) % shard_count
+
+
+class ShardRouter:
+    """
+    Routes the ratings, read lists and reviews of each user to one of several databases, by user ID.
+
+    All the rows of a user live in the same shard, so queries about one user, and joins between the activity tables
+    of the same user, run on a single database. Queries over all users are scattered to every shard and their
+    partial results merged, see `scatter`, `merge_counts` and `merge_averages`. Books, authors, users and the
+    derived tables stay in the main database, so activity rows are joined with them in Python.
+
+    Without shard URIs the router is a single shard, the main database's `db.session`, and behaves exactly like an
+    unsharded app.
+
+    Attributes:
+        uris (List[str]): The database URIs of the shards, in shard order.
+        engines (list): The engines of the shards.
+        pid (int): The process the engines were created in.
+    """
+    def __init__(self, uris: Iterable[str] = ()):
+        self.uris = list(uris)
+        self.engines = [create_engine(uri) for uri in self.uris]
+        self.pid = os.getpid()
+
+    @property
+    def sharded(self) -> bool:
+        """Whether the activity tables are in shards rather than in the main database."""
+        return bool(self.engines)
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.engines) or 1
+
+    def shard_for(self, user_id: int) -> int:
+        """Return the index of a user's shard."""
+        return shard_index(user_id, self.shard_count)
+
+    def sessions(self) -> List[Session]:
+        """
+        Return the sessions of all shards, in shard order.
+
+        Shard sessions are opened on first use in each app context and closed when it ends, like `db.session`.
+        """
+        if not self.sharded:
+            return [db.session]
+        sessions = g.get('shard_sessions')
+        if sessions is None or sessions[0] is not self:
+            sessions = g.shard_sessions = (self, [Session(engine) for engine in self.engines])
+        return sessions[1]
+
+    def session(self, user_id: int) -> Session:
+        """Return the session of a user's shard."""
+        return self.sessions()[self.shard_for(user_id)]
+
+    def scatter(self, query: Callable[[Session], list]) -> list:
+        """
+        Run a query on every shard, one after the other.
+
+        Args:
+            query (callable): Called with the session of each shard, returns that shard's partial result.
+
+        Returns:
+            list: The partial results, in shard order.
+        """
+        return [query(session) for session in self.sessions()]
+
+    def commit(self) -> None:
+        """
+        Commit the shards used in this app context, then the main database.
+
+        The databases are committed one after the other, not atomically: the activity rows come first, since the
+        main database only holds tables derived from them, which `rebuild-also-liked` and `rollup-analytics`
+        recompute should its commit fail. The write-behind queue retries such writes with the rating they replaced
+        on their first attempt, so it repairs them itself.
+        """
+        if self.sharded:
+            for session in self.sessions():
+                session.commit()
+        db.session.commit()
+
+    def create_all(self) -> None:
+        """
+        Create the activity tables in every shard.
+
+        The `user` and `book` tables are not in the shards, so their foreign keys are only declared there: SQLite
+        does not enforce them by default.
+        """
+        for engine in self.engines:
+            db.metadata.create_all(engine, tables=[model.__table__ for model in ACTIVITY_MODELS])
+
+    def dispose(self) -> None:
+        """Close the connections of the shard engines."""
+        for engine in self.engines:
+            engine.dispose()
+
+
+def get_router() -> ShardRouter:
+    """
+    Return the shard router of the current app, creating it on first use in each process.
+
+    `ACTIVITY_SHARDS` lists the database URIs of the shards, e.g. several SQLite files. Without it the activity
+    tables stay in the main database. Changing the list, or its order, moves users to other shards, so the rows
+    must be copied again, see `copy_activity_to_shards`.
+
+    Returns:
+        ShardRouter: The app's router.
+    """
+    router = current_app.extensions.get('shard_router')
+    uris = list(current_app.config.get('ACTIVITY_SHARDS') or ())
+    if router is None or router.pid != os.getpid() or router.uris != uris:
+        router = current_app.extensions['shard_router'] = ShardRouter(uris)
+    return router
+
+
+def init_sharding(app: Flask) -> None:
+    """Close the shard sessions of each app context when it ends."""
+    @app.teardown_appcontext
+    def close_shard_sessions(exception=None):
+        sessions = g.pop('shard_sessions', None)
+        if sessions is not None:
+            for session in sessions[1]:
+                session.close()
+
+
+def merge_counts(partials: Iterable[Iterable[tuple]]) -> Counter:
+    """
+    Merge per-shard counts.
+
+    Args:
+        partials: For each shard, rows of a key and a count.
+
+    Returns:
+        Counter: The total count of each key.
+    """
+    totals = Counter()
+    for rows in partials:
+        for key, count in rows:
+            totals[key] += count
+    return totals
+
+
+def merge_averages(partials: Iterable[Iterable[tuple]]) -> Dict[object, float]:
+    """
+    Merge per-shard averages, given as sums and counts since averages of averages would weigh shards equally.
+
+    Args:
+        partials: For each shard, rows of a key, a sum and a count.
+
+    Returns:
+        Dict[object, float]: The average of each key with a non-zero count.
+    """
+    sums, counts = Counter(), Counter()
+    for rows in partials:
+        for key, total, count in rows:
+            sums[key] += total or 0
+            counts[key] += count
+    return {key: sums[key] / count for key, count in counts.items() if count}
+
+
+def average_ratings(book_ids: Iterable[int] = None) -> Dict[int, float]:
+    """
+    Return the average rating of books over all shards.
+
+    Args:
+        book_ids: The IDs of the books, all books if not given.
+
+    Returns:
+        Dict[int, float]: The unrounded average rating of each rated book.
+    """
+    if book_ids is not None:
+        book_ids = list(book_ids)
+        if not book_ids:
+            return {}
+
+    def partial(session):
+        query = session.query(Rating.book_id, func.sum(Rating.rating), func.count(Rating.rating)) \
+            .filter(Rating.rating.isnot(None))
+        if book_ids is not None:
+            query = query.filter(Rating.book_id.in_(book_ids))
+        return query.group_by(Rating.book_id).all()
+    return merge_averages(get_router().scatter(partial))
+
+
+def activity_counts(model, book_ids: Iterable[int] = None) -> Counter:
+    """
+    Return the number of rows of an activity table for each book, over all shards.
+
+    Args:
+        model: `Rating`, `ToRead` or `Review`.
+        book_ids: The IDs of the books, all books if not given.
+
+    Returns:
+        Counter: The number of rows of each book, books without any are missing.
+    """
+    def partial(session):
+        query = session.query(model.book_id, func.count(model.id))
+        if book_ids is not None:
+            query = query.filter(model.book_id.in_(list(book_ids)))
+        return query.group_by(model.book_id).all()
+    return merge_counts(get_router().scatter(partial))
+
+
+def copy_activity_to_shards() -> Dict[str, int]:
+    """
+    Copy the ratings, read lists and reviews of the main database to the shards of their users.
+
+    The shard tables are created if needed and emptied first, so the copy can be repeated after the shard list
+    changed. The rows in the main database are left in place.
+
+    Raises:
+        ValueError: If no shards are configured.
+
+    Returns:
+        Dict[str, int]: The number of rows copied for each table.
+    """
+    router = get_router()
+    if not router.sharded:
+        raise ValueError("ACTIVITY_SHARDS is not set")
+    router.create_all()
+    sessions = router.sessions()
+    copied = {}
+    for model in ACTIVITY_MODELS:
+        columns = [column.name for column in model.__table__.columns if column.name != 'id']
+        batches = [[] for _ in sessions]
+        for row in db.session.execute(model.__table__.select()).mappings():
+            batches[router.shard_for(row['user_id'])].append({column: row[column] for column in columns})
+        for session, batch in zip(sessions, batches):
+            session.query(model).delete()
+            if batch:
+                session.execute(model.__table__.insert(), batch)
+        copied[model.__tablename__] = sum(len(batch) for batch in batches)
+    router.commit()
+    return copied
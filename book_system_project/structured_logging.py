@@ -0,0 +1,319 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import List, Tuple
+from flask import Flask, current_app, g, has_app_context, has_request_context, request
+
+LOGGER_NAME = 'sLogger'
+DEFAULT_LOG_SAMPLING = {'Search performed': 0.1}
+"""
+Fraction of the INFO records kept, by message prefix. High-volume events are sampled so they do not dominate the log
+file; kept records carry their `sample_rate`, so counts can be scaled back up.
+"""
+REQUEST_FIELDS = ('request_id', 'route', 'user_id', 'status', 'latency_ms', 'sample_rate')
+CONSOLE_FORMAT = '%(levelname)s - %(message)s'
+FILE_FORMAT = '%(asctime)s - %(name)s - %(module)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with the request fields added by `RequestContextFilter`."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                 'module': record.module, 'message': record.getMessage()}
+        for field in REQUEST_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds the request id, route and user id of the current request to records.
+
+    It runs on the thread that logs, before the record is queued, while the request context is still available.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            # Flask-Login keeps the loaded user in `g`; reading it never loads the user just for a log record.
+            user = g.get('_login_user')
+            if user is not None and user.is_authenticated:
+                record.user_id = user.get_id()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the INFO and DEBUG records whose message starts with a sampled prefix.
+
+    The rates are read from the `LOG_SAMPLING` config value of the current app, defaulting to `DEFAULT_LOG_SAMPLING`.
+    Sampling is deterministic: with a rate of 0.1, every tenth matching record is kept.
+    """
+    def __init__(self):
+        super().__init__()
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rates = current_app.config.get('LOG_SAMPLING', DEFAULT_LOG_SAMPLING) if has_app_context() \
+            else DEFAULT_LOG_SAMPLING
+        message = record.getMessage()
+        for prefix, rate in rates.items():
+            if message.startswith(prefix):
+                with self._lock:
+                    seen = self._seen.get(prefix, 0)
+                    self._seen[prefix] = seen + 1
+                record.sample_rate = rate
+                return int((seen + 1) * rate) > int(seen * rate)
+        return True
+
+
+_traceback_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A `QueueHandler` that drops records when the queue is full instead of blocking the logging thread.
+
+    Attributes:
+        dropped (int): Number of records dropped.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the arguments and the traceback into the message, so the record can be pickled or sent to another thread.
+
+        Unlike the base class, the record is not copied and not formatted twice, so this must be the only handler of
+        the logger.
+        """
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{_traceback_formatter.formatException(record.exc_info)}"
+        record.message = record.msg = message
+        record.args = record.exc_info = record.exc_text = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BlockingStopQueueListener(logging.handlers.QueueListener):
+    """A `QueueListener` whose `stop` waits for room in a full queue, instead of failing, to write every record."""
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def _file_handler(config) -> logging.Handler:
+    path = config.get('LOG_FILE') or os.path.join('instance', 'logfile.log')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if config.get('LOG_ROTATE_WHEN'):
+        return logging.handlers.TimedRotatingFileHandler(path, when=config['LOG_ROTATE_WHEN'],
+                                                         backupCount=config.get('LOG_BACKUP_COUNT', 5),
+                                                         delay=True)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                                                backupCount=config.get('LOG_BACKUP_COUNT', 5), delay=True)
+
+
+def build_pipeline(config) -> Tuple[DroppingQueueHandler, logging.handlers.QueueListener]:
+    """
+    Build a queue handler and the listener writing its records to a rotating JSON log file and to the console.
+
+    Args:
+        config: The app's config, see `configure_logging`.
+
+    Returns:
+        Tuple[DroppingQueueHandler, QueueListener]: The handler for the loggers, and the listener, not started yet.
+    """
+    file_handler = _file_handler(config)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(config.get('LOG_QUEUE_SIZE', 10000)))
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(RequestContextFilter())
+    listener = BlockingStopQueueListener(queue_handler.queue, file_handler, console_handler,
+                                         respect_handler_level=True)
+    return queue_handler, listener
+
+
+def _replace_handlers(logger: logging.Logger, handlers: List[logging.Handler]) -> List[logging.Handler]:
+    previous = logger.handlers[:]
+    for handler in previous:
+        logger.removeHandler(handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    return previous
+
+
+def configure_logging(config) -> None:
+    """
+    Route `sLogger` through a queue to a rotating JSON log file and the console.
+
+    Request threads only format the message, add the request fields and put the record on a bounded queue; a
+    `QueueListener` thread writes the records to the file and to stdout. When the queue is full, records are dropped
+    instead of blocking requests. Calling it again replaces the previous pipeline, and the queue is flushed when the
+    process exits.
+
+    Config values: `LOG_FILE` (default `logfile.log` in the app's instance folder), `LOG_LEVEL` (default DEBUG),
+    `LOG_MAX_BYTES` (default 10 MiB) and `LOG_BACKUP_COUNT` (default 5) for size based rotation, or `LOG_ROTATE_WHEN`
+    (e.g. 'midnight') for time based rotation, `LOG_QUEUE_SIZE` (default 10000) and `LOG_SAMPLING`, see
+    `SamplingFilter`.
+
+    Args:
+        config: The app's config.
+    """
+    global _listener
+    shutdown_logging()
+    queue_handler, _listener = build_pipeline(config)
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in _replace_handlers(logger, [queue_handler]):
+        handler.close()
+    logger.setLevel(config.get('LOG_LEVEL', logging.DEBUG))
+    logger.propagate = False
+
+    root = logging.getLogger()
+    if not root.handlers:
+        root_handler = logging.StreamHandler(sys.stdout)
+        root_handler.setLevel(logging.WARNING)
+        root_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        root.addHandler(root_handler)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Write the queued records and stop the listener thread. Records logged afterwards stay in the queue."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _restart_listener_after_fork() -> None:
+    """Give a forked worker process a fresh queue and listener thread, since threads do not survive a fork."""
+    if _listener is not None:
+        for handler in logging.getLogger(LOGGER_NAME).handlers:
+            if isinstance(handler, DroppingQueueHandler):
+                handler.queue = _listener.queue = queue.Queue(handler.queue.maxsize)
+        _listener.start()
+
+
+_listener = None
+atexit.register(shutdown_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def init_request_logging(app: Flask) -> None:
+    """
+    Give every request an id and log its completion with the status and latency.
+
+    The id is taken from the `X-Request-ID` header when the client or a proxy sets one, and is returned in the
+    response's `X-Request-ID` header. Static files are not logged.
+
+    Args:
+        app (Flask): The application.
+    """
+    @app.before_request
+    def start_request_timer():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        if 'request_started' in g and request.endpoint != 'static':
+            latency_ms = round((time.perf_counter() - g.request_started) * 1000, 3)
+            logging.getLogger(LOGGER_NAME).info(f"Request completed: {request.method} {request.path}",
+                                                extra={'status': response.status_code, 'latency_ms': latency_ms})
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+
+def _stalled(emit, stall_ms: float):
+    def stalled_emit(record):
+        time.sleep(stall_ms / 1000)
+        emit(record)
+    return stalled_emit
+
+
+def benchmark_logging(app: Flask, requests: int = 500, records: int = 10000, path: str = '/',
+                      stall_ms: float = 0) -> dict:
+    """
+    Measure the latency of requests and of single log calls with a synchronous file handler and with the pipeline.
+
+    The synchronous setup is the previous one: a `FileHandler` writing every record from the request thread. Both
+    write to temporary files, and the handlers of `sLogger` are restored afterwards. On a fast local disk the two are
+    close; `stall_ms` delays every file write to show the cost of a slow or busy disk.
+
+    Args:
+        app (Flask): The application to send the requests to.
+        requests (int): Number of requests per setup.
+        records (int): Number of log calls per setup.
+        path (str): The URL requested.
+        stall_ms (float): Milliseconds added to every file write.
+
+    Returns:
+        dict: For each setup, the mean milliseconds per request and microseconds per log call, and the number of
+        records dropped because the queue was full.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for setup in ('synchronous', 'queued'):
+            listener = None
+            if setup == 'synchronous':
+                handler = file_handler = logging.FileHandler(os.path.join(directory, 'sync.log'))
+                handler.setFormatter(logging.Formatter(FILE_FORMAT))
+            else:
+                handler, listener = build_pipeline({'LOG_FILE': os.path.join(directory, 'queued.log')})
+                file_handler = listener.handlers[0]
+            if stall_ms:
+                file_handler.emit = _stalled(file_handler.emit, stall_ms)
+            if listener:
+                listener.start()
+            saved = _replace_handlers(logger, [handler])
+            try:
+                client = app.test_client()
+                client.get(path)
+                started = time.perf_counter()
+                for _ in range(requests):
+                    client.get(path)
+                ms_per_request = (time.perf_counter() - started) * 1000 / requests
+                started = time.perf_counter()
+                for number in range(records):
+                    logger.info(f"Benchmark record {number}")
+                us_per_log_call = (time.perf_counter() - started) * 1e6 / records
+            finally:
+                _replace_handlers(logger, saved)
+                if listener:
+                    listener.stop()
+                    for listener_handler in listener.handlers:
+                        listener_handler.close()
+                handler.close()
+            results[setup] = {'ms_per_request': ms_per_request, 'us_per_log_call': us_per_log_call,
+                              'dropped': getattr(handler, 'dropped', 0)}
+    return results
@@ -0,0 +1,199 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import func
+from book_system_project.models import Book, Rating, Review, ToRead
+from book_system_project.sharding import get_router
+from typing import List, Tuple
+
+EVENT_WEIGHTS = {'rating': 1.0, 'review': 2.0, 'to_read': 1.0}
+
+
+class TrendingTracker:
+    """
+    Exponentially decayed per-book activity scores with a sorted index for top-K queries.
+
+    Each rating, review or read list addition adds a weight to the book's score that halves every `half_life`
+    seconds. Scores are kept in forward-decay form: an event at time `t` is stored as `weight * 2 ** ((t - landmark)
+    / half_life)`. Decaying every score by the same factor keeps their order, so the stored values never need to be
+    updated as time passes and the sorted index stays valid; an update only moves one book in the index and the top
+    `k` books are simply its first `k` entries.
+
+    Events are also kept per hourly bucket. Once a bucket is older than `window` seconds, its weights are subtracted
+    again, so books with no recent activity drop out of the ranking completely.
+
+    Attributes:
+        half_life (float): Seconds after which the weight of an event is halved.
+        window (float): Seconds after which an event is forgotten.
+        bucket_size (int): Length of a time bucket in seconds.
+    """
+    def __init__(self, half_life: float = 3 * 24 * 3600, window: float = 14 * 24 * 3600, bucket_size: int = 3600,
+                 now: float = None):
+        self.half_life = half_life
+        self.window = window
+        self.bucket_size = bucket_size
+        self.landmark = time.time() if now is None else now
+        self._scores = {}
+        self._index = []
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _forward_weight(self, weight: float, when: float) -> float:
+        return weight * 2 ** ((when - self.landmark) / self.half_life)
+
+    def _set_score(self, book_id: int, score: float) -> None:
+        """Change a book's stored score and move it in the sorted index. Must be called holding `_lock`."""
+        old_score = self._scores.get(book_id)
+        if old_score is not None:
+            del self._index[bisect_left(self._index, (-old_score, book_id))]
+        if score > 1e-9:
+            self._scores[book_id] = score
+            insort(self._index, (-score, book_id))
+        else:
+            self._scores.pop(book_id, None)
+
+    def add(self, book_id: int, weight: float = 1.0, when: float = None) -> None:
+        """
+        Record activity on a book.
+
+        Args:
+            book_id (int): The ID of the book.
+            weight (float): The weight of the event, see `EVENT_WEIGHTS`.
+            when (float): Time of the event as a Unix timestamp, now if not given.
+        """
+        when = time.time() if when is None else when
+        with self._lock:
+            self._expire(time.time())
+            if when - self.landmark > 64 * self.half_life:
+                self._rebase(when)
+            bucket = int(when // self.bucket_size)
+            if (bucket + 1) * self.bucket_size <= time.time() - self.window:
+                return
+            forward = self._forward_weight(weight, when)
+            book_weights = self._buckets.setdefault(bucket, {})
+            book_weights[book_id] = book_weights.get(book_id, 0.0) + forward
+            self._set_score(book_id, self._scores.get(book_id, 0.0) + forward)
+
+    def _expire(self, now: float) -> None:
+        """Subtract the weights of buckets that left the window. Must be called holding `_lock`."""
+        oldest_kept = int((now - self.window) // self.bucket_size)
+        for bucket in [bucket for bucket in self._buckets if bucket < oldest_kept]:
+            for book_id, forward in self._buckets.pop(bucket).items():
+                self._set_score(book_id, self._scores.get(book_id, 0.0) - forward)
+
+    def _rebase(self, landmark: float) -> None:
+        """Move the landmark forward so stored values do not overflow. Must be called holding `_lock`."""
+        factor = 2 ** ((landmark - self.landmark) / self.half_life)
+        self.landmark = landmark
+        self._buckets = {bucket: {book_id: forward / factor for book_id, forward in weights.items()}
+                         for bucket, weights in self._buckets.items()}
+        self._scores = {book_id: score / factor for book_id, score in self._scores.items()}
+        self._index = sorted((-score, book_id) for book_id, score in self._scores.items())
+
+    def top(self, k: int = 5, now: float = None) -> List[Tuple[int, float]]:
+        """
+        Return the `k` books with the highest decayed scores.
+
+        Args:
+            k (int): The number of books to return.
+            now (float): The time to decay the scores to, as a Unix timestamp. Now if not given.
+
+        Returns:
+            List[Tuple[int, float]]: Book IDs with their current scores, highest first.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            decay = 2 ** ((self.landmark - now) / self.half_life)
+            return [(book_id, -negative_score * decay) for negative_score, book_id in self._index[:k]]
+
+
+def load_events(since) -> List[Tuple[int, float, float]]:
+    """
+    Read the activity recorded since the given time from the `Rating`, `Review` and `ToRead` tables of every shard.
+
+    A row counts as one event at the time it was last changed, `updated_at`, or `created_at` if it never was, so
+    books whose ratings or reviews were recently changed keep their score after a resync. Only the latest change of
+    each row is known, so earlier changes within the window count once less than in the tracker that saw them.
+
+    Args:
+        since (datetime): The earliest change time to include, naive UTC as stored by the database.
+
+    Returns:
+        List[Tuple[int, float, float]]: Tuples of a book ID, the event's weight and its time as a Unix timestamp.
+    """
+    events = []
+    for kind, model in (('rating', Rating), ('review', Review), ('to_read', ToRead)):
+        changed_at = func.coalesce(model.updated_at, model.created_at)
+        partials = get_router().scatter(
+            lambda session: session.query(model.book_id, changed_at).filter(changed_at >= since).all())
+        events += [(book_id, EVENT_WEIGHTS[kind], when.replace(tzinfo=timezone.utc).timestamp())
+                   for rows in partials for book_id, when in rows]
+    return events
+
+
+def _current_tracker() -> Tuple[TrendingTracker, bool]:
+    """
+    Return the trending tracker of the current app, loading it from the database when needed.
+
+    Returns:
+        Tuple[TrendingTracker, bool]: The app's tracker, and whether it was just loaded from the database.
+    """
+    config = current_app.config
+    state = current_app.extensions.setdefault('trending', {'tracker': None, 'loaded_at': 0.0})
+    if state['tracker'] is not None and time.time() - state['loaded_at'] <= config.get('TRENDING_RESYNC_SECONDS', 300):
+        return state['tracker'], False
+    tracker = TrendingTracker(half_life=config.get('TRENDING_HALF_LIFE_HOURS', 72) * 3600,
+                              window=config.get('TRENDING_WINDOW_DAYS', 14) * 24 * 3600)
+    since = time.time() - tracker.window
+    for book_id, weight, when in load_events(datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None)):
+        tracker.add(book_id, weight, when)
+    state['tracker'], state['loaded_at'] = tracker, time.time()
+    return tracker, True
+
+
+def get_trending() -> TrendingTracker:
+    """
+    Return the trending tracker of the current app.
+
+    Each worker process keeps its own tracker and records the writes it handles itself. To also pick up the writes
+    of other workers, the tracker is rebuilt from the activity tables every `TRENDING_RESYNC_SECONDS` (default 300).
+    `TRENDING_HALF_LIFE_HOURS` (default 72) and `TRENDING_WINDOW_DAYS` (default 14) configure the decay.
+
+    Returns:
+        TrendingTracker: The app's tracker.
+    """
+    return _current_tracker()[0]
+
+
+def record_event(book_id: int, kind: str) -> None:
+    """
+    Add a committed write to the trending scores of the current app.
+
+    If the tracker has to be loaded from the database first, the write is already part of what was loaded and is
+    not added again.
+
+    Args:
+        book_id (int): The ID of the book the write was about.
+        kind (str): 'rating', 'review' or 'to_read'.
+    """
+    tracker, loaded = _current_tracker()
+    if not loaded:
+        tracker.add(book_id, EVENT_WEIGHTS[kind])
+
+
+def trending_books(k: int = 5) -> List[Tuple[Book, float]]:
+    """
+    Return the currently trending books.
+
+    Args:
+        k (int): The number of books to return.
+
+    Returns:
+        List[Tuple[Book, float]]: Tuples of a `Book` and its trending score rounded to 2 decimal places, highest first.
+    """
+    top = get_trending().top(k)
+    books = {book.id: book for book in Book.query.filter(Book.id.in_([book_id for book_id, _ in top]))}
+    return [(books[book_id], round(score, 2)) for book_id, score in top if book_id in books]
@@ -0,0 +1,299 @@
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+from flask import current_app
+from book_system_project import logger
+from book_system_project.models import Rating, ToRead, insert_ignore, upsert_previous
+from book_system_project.also_liked import update_also_liked
+from book_system_project.analytics import fold_analytics, record_activity
+from book_system_project.cache import bump_activity_version
+from book_system_project.recommendation_cache import bump_ratings_version, bump_similarity_versions
+from book_system_project.sharding import get_router
+from book_system_project.trending import record_event
+
+
+class WriteBehindQueue:
+    """
+    In-process queue that coalesces rating and read list writes and flushes them in batched transactions.
+
+    Writes are keyed by (kind, user_id, book_id), so repeated writes to the same row before a flush collapse into the
+    last one. A background thread flushes the queue every `flush_interval_ms` milliseconds, or as soon as `max_batch`
+    rows are pending. Until they are committed, `pending_rating` and `pending_to_read` let request handlers show the
+    acting user their own writes.
+
+    A write that fails is retried on the next flushes, and moved to `dead_letters` with an error log entry once it
+    failed `max_attempts` times, so it cannot hold back the writes queued after it. A write keeps the rating it
+    replaced, or whether it added the book to the read list, from its first attempt: with sharded activity tables the
+    shard may have been committed before the main database failed, and a retry then applies the same `AlsoLiked` and
+    analytics changes instead of finding its own row.
+
+    If a journal path is given, every write is appended to it before it is acknowledged, and the journal is replayed
+    into the queue on start, so writes survive a crash of the process. With `fsync` enabled, each append is also
+    synced to disk.
+
+    Attributes:
+        app (Flask): The app whose database the writes are flushed to.
+        flush_interval_ms (int): Maximum time a write waits before being flushed.
+        max_batch (int): Number of pending writes that triggers an early flush.
+        journal_path (str): Path of the append-only journal, or None to keep writes in memory only.
+        fsync (bool): Whether every journal append is synced to disk.
+        max_attempts (int): Number of failed flushes after which a write is given up.
+        dead_letters (List[dict]): The writes given up, oldest first.
+    """
+    def __init__(self, app, flush_interval_ms: int = 200, max_batch: int = 100, journal_path: str = None,
+                 fsync: bool = False, max_attempts: int = 3):
+        self.app = app
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch = max_batch
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self.dead_letters = []
+        self.pid = os.getpid()
+        self._pending = OrderedDict()
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._journal = None
+        if journal_path:
+            self._replay_journal()
+            self._journal = open(journal_path, 'a')
+
+    def _replay_journal(self) -> None:
+        """Load writes left in the journal by a previous process into the queue."""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as file:
+            for line in file:
+                if line.strip():
+                    write = json.loads(line)
+                    self._pending[self._key(write)] = write
+        if self._pending:
+            logger.warning(f"Replayed {len(self._pending)} unflushed writes from {self.journal_path}")
+
+    @staticmethod
+    def _key(write: dict) -> tuple:
+        return write['kind'], write['user_id'], write['book_id']
+
+    def enqueue(self, write: dict) -> None:
+        """
+        Add a write to the queue, replacing any pending write to the same row.
+
+        Args:
+            write (dict): The write, with keys 'kind' ('rating' or 'to_read'), 'user_id', 'book_id' and 'value'
+                          (the rating, or whether the book is in the read list).
+        """
+        with self._lock:
+            if self._journal:
+                self._journal.write(json.dumps(write) + '\n')
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            self._pending.pop(self._key(write), None)
+            self._pending[self._key(write)] = write
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def pending_rating(self, user_id: int, book_id: int):
+        """Return the pending rating of a book by a user, or None if there is none."""
+        key = ('rating', user_id, book_id)
+        write = self._pending.get(key) or self._flushing.get(key)
+        return write['value'] if write else None
+
+    def pending_to_read(self, user_id: int) -> dict:
+        """
+        Return a user's pending read list changes.
+
+        Returns:
+            dict: Book IDs mapped to True if the book is being added to the read list, or False if it is being removed.
+        """
+        with self._lock:
+            return {write['book_id']: write['value'] for writes in (self._flushing, self._pending)
+                    for write in writes.values() if write['kind'] == 'to_read' and write['user_id'] == user_id}
+
+    def flush(self) -> int:
+        """
+        Write all pending writes to the database in one transaction, one per database with sharded activity tables.
+
+        The analytics events recorded so far are folded into the sketches in the same transaction, see
+        `analytics.fold_analytics`. If the batch fails, its transactions are rolled back and the writes are applied
+        again one by one, each in a transaction of its own and without folding, so a failing write cannot hold back
+        the others. A write that still fails is put back
+        into the queue, behind any newer write to the same row, until it failed `max_attempts` times. The committed
+        writes are only then added to the trending scores, see `trending.record_event`, and invalidate the caches.
+
+        Returns:
+            int: The number of writes flushed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending.values())
+                self._flushing = dict(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+            applied, failed, touched = [], [], []
+            try:
+                touched = self._commit(batch, fold=True)
+                applied = batch
+            except Exception:
+                logger.exception(f"Failed to flush {len(batch)} queued writes, applying them one by one")
+                for write in batch:
+                    try:
+                        touched += self._commit([write])
+                        applied.append(write)
+                    except Exception:
+                        logger.exception(f"Failed to apply queued write {json.dumps(write)}")
+                        failed.append(write)
+            if applied:
+                self._after_commit(applied, touched)
+            with self._lock:
+                self._flushing = {}
+                for write in failed:
+                    self._retry_or_give_up(write)
+                if self._journal:
+                    self._rewrite_journal()
+            return len(applied)
+
+    def _commit(self, writes: List[dict], fold: bool = False) -> List[int]:
+        """
+        Apply writes and commit them, or roll them all back when the app context ends if any of them fails.
+
+        Args:
+            writes (List[dict]): The writes to apply.
+            fold (bool): Whether to also fold the analytics events into the sketches.
+
+        Returns:
+            List[int]: The books whose pairs changed.
+        """
+        with self.app.app_context():
+            touched = []
+            for write in writes:
+                touched.extend(self._apply(write))
+            if fold:
+                fold_analytics()
+            get_router().commit()
+            return touched
+
+    def _after_commit(self, writes: List[dict], touched: List[int]) -> None:
+        """
+        Add committed writes to the trending scores, and invalidate the leaderboards, searches and recommendations
+        they affect, which are not retried if this fails.
+        """
+        try:
+            with self.app.app_context():
+                for write in writes:
+                    if write['kind'] == 'rating' or write.get('added'):
+                        record_event(write['book_id'], write['kind'])
+                bump_activity_version()
+                for user_id in {write['user_id'] for write in writes if write['kind'] == 'rating'}:
+                    bump_ratings_version(user_id)
+                bump_similarity_versions(touched)
+        except Exception:
+            logger.exception(f"Failed to record or invalidate the caches of {len(writes)} flushed writes")
+
+    def _requeue(self, write: dict) -> None:
+        """
+        Put a write back into the queue, unless a newer write to the same row is pending, which then takes over what
+        the first attempt found in the database. Must be called holding `_lock`.
+        """
+        newer = self._pending.setdefault(self._key(write), write)
+        for field in ('previous', 'added'):
+            if field in write:
+                newer.setdefault(field, write[field])
+
+    def _retry_or_give_up(self, write: dict) -> None:
+        """Put a failed write back into the queue, or into `dead_letters`. Must be called holding `_lock`."""
+        write = dict(write, attempts=write.get('attempts', 0) + 1)
+        if write['attempts'] >= self.max_attempts:
+            self.dead_letters.append(write)
+            logger.error(f"Gave up queued write after {write['attempts']} attempts: {json.dumps(write)}")
+        else:
+            self._requeue(write)
+
+    def _rewrite_journal(self) -> None:
+        """Replace the journal with the writes still pending. Must be called holding `_lock`."""
+        temp_path = f'{self.journal_path}.tmp'
+        with open(temp_path, 'w') as file:
+            for write in self._pending.values():
+                file.write(json.dumps(write) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self._journal.close()
+        os.replace(temp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a')
+
+    @staticmethod
+    def _apply(write: dict) -> List[int]:
+        """
+        Add a single write to the session of its user's shard, and return the books whose pairs changed.
+
+        The rating replaced by the write, or whether it added the book to the read list, is stored in the write as
+        'previous' or 'added' on its first attempt, and reused by the retries.
+        """
+        user_id, book_id, value = write['user_id'], write['book_id'], write['value']
+        session = get_router().session(user_id)
+        if write['kind'] == 'rating':
+            previous = upsert_previous(Rating, {'rating': value, 'book_id': book_id, 'user_id': user_id},
+                                       index_elements=['user_id', 'book_id'], update_fields=['rating'],
+                                       previous_field='rating', session=session)
+            touched = update_also_liked(user_id, book_id, write.setdefault('previous', previous), value)
+            record_activity(user_id, book_id, 'rating')
+            return touched
+        elif write['kind'] == 'to_read':
+            if value:
+                added = insert_ignore(ToRead, {'toread': True, 'user_id': user_id, 'book_id': book_id},
+                                      index_elements=['user_id', 'book_id'], session=session)
+                if write.setdefault('added', added):
+                    record_activity(user_id, book_id, 'to_read')
+            else:
+                session.query(ToRead).filter_by(user_id=user_id, book_id=book_id).delete()
+        return []
+
+    def start(self) -> None:
+        """Start the background flush thread, and flush once more when the process exits."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='write-behind-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval_ms / 1000)
+            self._wake.clear()
+            self.flush()
+
+
+def get_write_behind():
+    """
+    Return the write-behind queue of the current app, or None if write coalescing is disabled.
+
+    Enabled with the `WRITE_BEHIND_ENABLED` config value. The queue and its flush thread are created on first use in
+    each process, so forked WSGI workers each get their own. `WRITE_BEHIND_FLUSH_MS`, `WRITE_BEHIND_MAX_BATCH`,
+    `WRITE_BEHIND_JOURNAL`, `WRITE_BEHIND_FSYNC` and `WRITE_BEHIND_MAX_ATTEMPTS` configure the queue. When several
+    worker processes run, each of them needs its own journal path.
+
+    Returns:
+        WriteBehindQueue or None: The app's queue.
+    """
+    config = current_app.config
+    if not config.get('WRITE_BEHIND_ENABLED'):
+        return None
+    queue = current_app.extensions.get('write_behind')
+    if queue is None or queue.pid != os.getpid():
+        queue = WriteBehindQueue(current_app._get_current_object(),
+                                 flush_interval_ms=config.get('WRITE_BEHIND_FLUSH_MS', 200),
+                                 max_batch=config.get('WRITE_BEHIND_MAX_BATCH', 100),
+                                 journal_path=config.get('WRITE_BEHIND_JOURNAL'),
+                                 fsync=config.get('WRITE_BEHIND_FSYNC', False),
+                                 max_attempts=config.get('WRITE_BEHIND_MAX_ATTEMPTS', 3))
+        current_app.extensions['write_behind'] = queue
+        queue.start()
+    return queue
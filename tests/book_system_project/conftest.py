@@ -1,19 +1,187 @@
+import os
+import shutil
+from contextlib import contextmanager
 import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+import book_system_project
 from book_system_project import create_app
 from book_system_project.models import db
-from book_system_project.models import User
+from book_system_project.structured_logging import configure_logging
+from book_system_project.models import User, Book, Author, Genre, Rating, Review
+
+WORKER = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+"""The pytest-xdist worker running the tests, so that each worker gets its own database files."""
+
+
+def enable_savepoints(engine):
+    """
+    Make an SQLite engine emit its own BEGIN, so that SAVEPOINTs work inside the transaction of a test.
+
+    By default the sqlite3 driver starts transactions itself and commits around some statements, which breaks
+    SAVEPOINT and ROLLBACK of the outer transaction.
+    """
+    @event.listens_for(engine, 'connect')
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+
+def add_sample_data(session) -> dict:
+    """
+    Fill a database with a small catalog and a few users rating it.
+
+    Books 1-4 are rated, book 5 has no ratings. Every book has one genre, books 1 and 3 share "Fiction".
+
+    Returns:
+        dict: The ids of the books and of the users, in the order above.
+    """
+    fiction = Genre(name='Fiction')
+    poetry = Genre(name='Poetry')
+    science_fiction = Genre(name='Science Fiction')
+    tolstoy = Author(name='Leo Tolstoy')
+    dickinson = Author(name='Emily Dickinson')
+    books = [
+        Book(title='War and Peace', author=tolstoy, genres=[fiction]),
+        Book(title='Complete Poems', author=dickinson, genres=[poetry]),
+        Book(title='Anna Karenina', author=tolstoy, genres=[fiction]),
+        Book(title='Dune', author=dickinson, genres=[science_fiction]),
+        Book(title='Resurrection', author=tolstoy, genres=[poetry]),
+    ]
+    users = [User(email=f'user{i}@example.com', password='password', name=f'User {i}') for i in range(1, 5)]
+    session.add_all(books + users)
+    session.flush()
+    ratings = {
+        users[0]: {books[0]: 5, books[1]: 5, books[2]: 3, books[3]: 1},
+        users[1]: {books[0]: 5, books[1]: 4, books[3]: 5},
+        users[2]: {books[0]: 4, books[2]: 5, books[3]: 5},
+        users[3]: {books[1]: 2, books[2]: 5},
+    }
+    for user, rated in ratings.items():
+        for book, value in rated.items():
+            session.add(Rating(user_id=user.id, book_id=book.id, rating=value))
+    session.add(Review(user_id=users[0].id, book_id=books[0].id, review='A long read.'))
+    session.commit()
+    return {'books': [book.id for book in books], 'users': [user.id for user in users]}
+
+
+@pytest.fixture(scope='session', autouse=True)
+def logging_config(tmp_path_factory) -> dict:
+    """
+    Send the JSON log of this worker to a temporary file, before any app is created, so test runs do not write to the
+    instance folder. Tests that reconfigure logging restore this config afterwards.
+    """
+    config = {'LOG_FILE': str(tmp_path_factory.mktemp(f'logs-{WORKER}') / 'logfile.log')}
+    configure_logging(config)
+    book_system_project._logging_configured = True
+    return config
+
+
+@pytest.fixture(scope='session')
+def database_templates(tmp_path_factory):
+    """
+    Build the template databases of this worker once per session: an empty schema, and the schema with the sample data.
+
+    Tests never write to the templates, they only get copies of them.
+    """
+    directory = tmp_path_factory.mktemp(f'databases-{WORKER}')
+    templates = {'empty': directory / 'empty.db', 'seeded': directory / 'seeded.db'}
+    engine = create_engine(f"sqlite:///{templates['empty']}")
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    shutil.copyfile(templates['empty'], templates['seeded'])
+    engine = create_engine(f"sqlite:///{templates['seeded']}")
+    with Session(engine) as session:
+        templates['sample_data'] = add_sample_data(session)
+    engine.dispose()
+    return templates
 
 
 @pytest.fixture
-def client():
+def database_file(tmp_path, database_templates):
+    """
+    Return the path of a private copy of the empty database, for tests that need real commits or several
+    connections.
+    """
+    path = tmp_path / 'test.db'
+    shutil.copyfile(database_templates['empty'], path)
+    return path
+
 
-    app = create_app('app_testing_config.py')
-    app.config['WTF_CSRF_ENABLED'] = False
-    with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
-            yield client
-            db.drop_all()
+@pytest.fixture(scope='session')
+def app(tmp_path_factory, database_templates):
+    """
+    Create the app once per session, on this worker's copy of the empty template database.
+
+    Sessions are configured to run in a SAVEPOINT of the connection they are bound to, see `client`.
+    """
+    directory = tmp_path_factory.mktemp(f'app-{WORKER}')
+    shutil.copyfile(database_templates['empty'], directory / 'test.db')
+    config = directory / 'config.py'
+    config.write_text(f"SECRET_KEY = 'book_system_key'\n"
+                      f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{directory / 'test.db'}'\n"
+                      f"BCRYPT_LOG_ROUNDS = 4\n"
+                      f"WTF_CSRF_ENABLED = False\n")
+    app = create_app(str(config))
+    with app.app_context():
+        enable_savepoints(db.engine)
+        db.session.configure(join_transaction_mode='create_savepoint')
+    return app
+
+
+@pytest.fixture(scope='session')
+def database_engines(app, tmp_path_factory, database_templates):
+    """Return the engines of this worker's empty database, the app's own, and of its copy of the seeded database."""
+    seeded = tmp_path_factory.mktemp(f'seeded-{WORKER}') / 'test.db'
+    shutil.copyfile(database_templates['seeded'], seeded)
+    seeded_engine = create_engine(f"sqlite:///{seeded}")
+    enable_savepoints(seeded_engine)
+    with app.app_context():
+        yield {'empty': db.engine, 'seeded': seeded_engine}
+    seeded_engine.dispose()
+
+
+@contextmanager
+def restored_app_state(app):
+    """Restore the config and extensions of an app when the block ends, so caches and counters do not leak."""
+    config, extensions = dict(app.config), dict(app.extensions)
+    try:
+        yield
+    finally:
+        app.config.clear()
+        app.config.update(config)
+        app.extensions.clear()
+        app.extensions.update(extensions)
+
+
+@pytest.fixture
+def client(app, database_engines, request):
+    """
+    Yield a test client of the session app, with every database write of the test rolled back afterwards.
+
+    The test runs in an app context whose session is bound to a connection with an open transaction, and session
+    commits only release SAVEPOINTs, so the transaction is rolled back when the test ends. Tests using `sample_data`
+    get the seeded database, the others the empty one. The app's config and extensions are restored as well, see
+    `restored_app_state`.
+    """
+    engine = database_engines['seeded' if 'sample_data' in request.fixturenames else 'empty']
+    with restored_app_state(app), app.app_context():
+        connection = engine.connect()
+        transaction = connection.begin()
+        engines = db.engines
+        app_engine, engines[None] = engines[None], connection
+        try:
+            with app.test_client() as client:
+                yield client
+        finally:
+            db.session.remove()
+            engines[None] = app_engine
+            transaction.rollback()
+            connection.close()
 
 
 @pytest.fixture
@@ -22,3 +190,22 @@ def new_user():
 
 # pytest --cov=book_system_project tests/book_system_project/
 # pytest --cov=book_system_project tests/
+# pytest -n auto tests/  (with pytest-xdist, every worker has its own databases)
+
+
+@pytest.fixture
+def sample_data(client, database_templates):
+    """Return the books and users of the seeded database, see `add_sample_data`."""
+    ids = database_templates['sample_data']
+    return {'books': [db.session.get(Book, book_id) for book_id in ids['books']],
+            'users': [db.session.get(User, user_id) for user_id in ids['users']]}
+
+
+@pytest.fixture
+def login(client):
+    """Return a function that logs the test client in as the given user, skipping the password check."""
+    def login_as(user):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+    return login_as
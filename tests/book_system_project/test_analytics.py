@@ -0,0 +1,112 @@
+from book_system_project.analytics import (HyperLogLog, CountMinSketch, SpaceSaving, rebuild_analytics,
+                                           fold_analytics, books_by_readers, total_readers, top_reviewers)
+from book_system_project.models import db, User, Genre, AnalyticsSketch, AnalyticsEvent
+
+
+def test_hyperloglog_estimate_is_close():
+    sketch = HyperLogLog()
+    for item in range(20000):
+        sketch.add(item)
+        sketch.add(item)
+    assert abs(sketch.count() - 20000) < 20000 * 0.1
+    restored = HyperLogLog(registers=sketch.to_bytes())
+    assert restored.count() == sketch.count()
+    assert len(sketch.to_bytes()) == 1024
+
+
+def test_hyperloglog_is_exact_for_small_counts():
+    sketch = HyperLogLog()
+    for item in range(5):
+        sketch.add(item)
+    assert sketch.count() == 5
+
+
+def test_count_min_never_underestimates():
+    sketch = CountMinSketch(width=64, depth=4)
+    for item in range(500):
+        sketch.add(item, item % 7 + 1)
+    restored = CountMinSketch(width=64, depth=4, counters=sketch.to_bytes())
+    assert all(restored.estimate(item) >= item % 7 + 1 for item in range(500))
+
+
+def test_space_saving_keeps_heavy_hitters():
+    summary = SpaceSaving(capacity=5)
+    for item in range(100):
+        summary.add(item)
+        if item % 2:
+            summary.add('heavy')
+    restored = SpaceSaving.from_bytes(summary.to_bytes())
+    assert restored.top(1)[0][0] == 'heavy'
+    assert len(restored.counts) == 5
+
+
+def test_sketches_follow_writes(client, sample_data, login):
+    books, users = sample_data['books'], sample_data['users']
+    rebuild_analytics()
+    assert total_readers() == 4
+    assert sorted(readers for _, readers in books_by_readers()) == [3, 3, 3, 3]
+    login(users[3])
+    client.post(f"/rate_book/{books[0].id}", data={'rating': '4'})
+    client.post(f"/write_review/{books[0].id}", data={'review': 'Great.'})
+    client.post(f"/write_review/{books[1].id}", data={'review': 'Fine.'})
+    client.post(f"/write_review/{books[1].id}", data={'review': 'Fine, edited.'})
+    assert books_by_readers(1)[0][0].title == 'War and Peace'
+    assert books_by_readers(1)[0][1] == 4
+    assert [(user.name, count) for user, count in top_reviewers()] == [('User 4', 2), ('User 1', 1)]
+
+
+def test_writes_only_append_events_until_folded(client, sample_data, login):
+    books, users = sample_data['books'], sample_data['users']
+    rebuild_analytics()
+    sketches = {row.key: row.data for row in AnalyticsSketch.query}
+    login(users[3])
+    client.post(f"/rate_book/{books[0].id}", data={'rating': '4'})
+    client.post(f"/write_review/{books[0].id}", data={'review': 'Great.'})
+    client.post(f"/book/{books[4].id}", data={})
+    db.session.expire_all()
+    assert {row.key: row.data for row in AnalyticsSketch.query} == sketches
+    assert AnalyticsEvent.query.count() == 3
+
+    merged = (books_by_readers(), total_readers(), top_reviewers())
+    assert fold_analytics() == 3
+    db.session.commit()
+    assert AnalyticsEvent.query.count() == 0
+    assert (books_by_readers(), total_readers(), top_reviewers()) == merged
+    assert fold_analytics() == 0
+
+
+def test_fold_keeps_the_callers_session_and_dashboard_folds_a_long_backlog(client, sample_data, login):
+    books, users = sample_data['books'], sample_data['users']
+    rebuild_analytics()
+    login(users[3])
+    client.post(f"/rate_book/{books[0].id}", data={'rating': '4'})
+    client.post(f"/write_review/{books[0].id}", data={'review': 'Great.'})
+    client.post(f"/book/{books[4].id}", data={})
+
+    db.session.add(Genre(name='Essays'))
+    assert fold_analytics(limit=1) == 1
+    assert AnalyticsEvent.query.count() == 2
+    assert Genre.query.filter_by(name='Essays').one()
+
+    client.application.config['ANALYTICS_MAX_PENDING'] = 1
+    merged = total_readers()
+    assert AnalyticsEvent.query.count() == 0
+    assert total_readers() == merged
+
+
+def test_admin_analytics_page(client, sample_data, login):
+    rebuild_analytics()
+    admin = User(email='admin@example.com', password='password', name='Admin')
+    db.session.add(admin)
+    db.session.commit()
+    login(admin)
+    response = client.get("/admin_analytics")
+    assert response.status_code == 200
+    assert b"Distinct active users: 4" in response.data
+    assert b"War and Peace (3)" in response.data
+    assert b"User 1 (1)" in response.data
+
+
+def test_admin_analytics_requires_admin(client, sample_data, login):
+    login(sample_data['users'][0])
+    assert client.get("/admin_analytics").status_code == 302
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+import pytest
+from book_system_project.cache import (LocalCache, RedisCache, get_cache, bump_activity_version, USER_CACHE_KEY,
+                                       RECOMMENDATIONS_CACHE_KEY, RATINGS_VERSION_KEY)
+from book_system_project.models import db, Rating
+
+
+def test_local_cache_lru_and_expiry():
+    cache = LocalCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    cache.set('d', 4, ttl=-1)
+    assert cache.get('d') is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'evictions': 2}
+
+
+def check_single_flight(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'value'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_set('key', compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+
+
+def test_local_cache_single_flight():
+    check_single_flight(LocalCache())
+
+
+def test_redis_cache():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    cache = RedisCache(fakeredis.FakeRedis(server=server), prefix='test:')
+    cache.set('key', {'ids': [1, 2]})
+    other_process = RedisCache(fakeredis.FakeRedis(server=server), prefix='test:')
+    assert other_process.get('key') == {'ids': [1, 2]}
+    assert other_process.get_many(['key', 'missing']) == [{'ids': [1, 2]}, None]
+    other_process.delete('key')
+    assert cache.get('key') is None
+    check_single_flight(cache)
+    assert cache.stats()['misses'] >= 2
+
+
+def test_redis_cache_waits_for_other_process():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis()
+    cache = RedisCache(client)
+    client.set('lock:key', 1)
+    threading.Timer(0.1, lambda: cache.set('key', 'computed elsewhere')).start()
+    assert cache.get_or_set('key', lambda: 'computed here') == 'computed elsewhere'
+
+
+def test_load_user_is_cached_in_a_shared_cache(client, sample_data, login):
+    fakeredis = pytest.importorskip('fakeredis')
+    client.application.extensions['cache'] = (os.getpid(), RedisCache(fakeredis.FakeRedis()))
+    user = sample_data['users'][0]
+    login(user)
+    assert client.get("/profile").status_code == 200
+    cached = get_cache().get(USER_CACHE_KEY.format(user_id=user.id))
+    assert cached['email'] == user.email
+    assert 'password' not in cached
+    db.session.expunge_all()
+    assert client.get("/profile").status_code == 200
+
+
+def test_load_user_is_not_cached_per_process(client, sample_data, login):
+    user = sample_data['users'][0]
+    login(user)
+    assert client.get("/profile").status_code == 200
+    assert get_cache().get(USER_CACHE_KEY.format(user_id=user.id)) is None
+
+
+def test_leaderboard_is_cached(client, sample_data):
+    response = client.get("/all_ratings")
+    assert b"Anna Karenina (4.33)" in response.data
+    db.session.add(Rating(user_id=sample_data['users'][1].id, book_id=sample_data['books'][2].id, rating=1))
+    db.session.commit()
+    assert b"Anna Karenina (4.33)" in client.get("/all_ratings").data
+    bump_activity_version()
+    assert b"Anna Karenina (3.5)" in client.get("/all_ratings").data
+    response = client.get("/all_reviews")
+    assert b"War and Peace (1)" in response.data
+
+
+def test_writes_invalidate_leaderboards_and_searches(client, sample_data, login, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'instance').mkdir()
+    books = sample_data['books']
+    search = {'select_author': '', 'select_genre': '', 'rating_min': '', 'rating_max': '', 'review': 'y',
+              'sort_by': 'rating_desc'}
+    login(sample_data['users'][0])
+    with client.get("/all_ratings") as response:
+        assert b"Anna Karenina (4.33)" in response.data
+    assert b"Dune" not in client.post("/search", data=search).data
+    client.post(f"/rate_book/{books[2].id}", data={'rating': '1'})
+    client.post(f"/write_review/{books[3].id}", data={'review': 'Sand.'})
+    with client.get("/all_ratings") as response:
+        assert b"Anna Karenina (3.67)" in response.data
+    assert b"Dune" in client.post("/search", data=search).data
+
+
+def test_rating_invalidates_recommendations(client, sample_data, login):
+    fakeredis = pytest.importorskip('fakeredis')
+    client.application.extensions['cache'] = (os.getpid(), RedisCache(fakeredis.FakeRedis()))
+    users, books = sample_data['users'], sample_data['books']
+
+    def cached_entry():
+        version = get_cache().get(RATINGS_VERSION_KEY.format(user_id=users[3].id))
+        return get_cache().get(RECOMMENDATIONS_CACHE_KEY.format(user_id=users[3].id, version=version))
+    login(users[3])
+    assert client.get("/recommended_for_you").status_code == 200
+    assert cached_entry() is not None
+    client.post(f"/rate_book/{books[1].id}", data={'rating': '5'})
+    assert cached_entry() is None
+    response = client.get("/recommended_for_you")
+    assert sorted(seed for seed, _ in cached_entry()['data']['separate']) == sorted([books[1].id, books[2].id])
@@ -0,0 +1,77 @@
+import gzip
+import zlib
+from book_system_project.compression import benchmark_compression, compress_static, static_hash
+
+
+def test_html_is_compressed_when_accepted(client, sample_data):
+    plain = client.get("/")
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get("/", headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+    assert int(response.headers['Content-Length']) == len(response.data)
+
+
+def test_streamed_pages_are_compressed_chunk_by_chunk(client, sample_data):
+    plain = client.get("/all_ratings")
+    plain_data = plain.data
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get("/all_ratings", headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.data) == plain_data
+
+    client.application.config['STREAM_BUFFER_SIZE'] = 100
+    response = client.get("/all_ratings", headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    first_chunk = decompressor.decompress(next(iter(response.response)))
+    assert 0 < len(first_chunk) < len(plain_data) and plain_data.startswith(first_chunk)
+    response.close()
+
+
+def test_small_responses_are_not_compressed(client, sample_data):
+    client.application.config['COMPRESS_MIN_SIZE'] = 10 ** 6
+    response = client.get("/", headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_static_urls_are_fingerprinted(client):
+    version = static_hash(client.application, 'style.css')
+    assert f'style.css?v={version}'.encode() in client.get("/login").data
+
+    response = client.get(f"/static/style.css?v={version}")
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    assert response.cache_control.immutable
+    response.close()
+    response = client.get("/static/style.css?v=outdated")
+    assert response.cache_control.max_age is None
+    response.close()
+
+
+def test_precompressed_static_files(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(client.application, 'static_folder', str(tmp_path))
+    css = b'body { margin: 0; }\n' * 100
+    (tmp_path / 'site.css').write_bytes(css)
+    (tmp_path / 'tiny.css').write_bytes(b'p {}')
+    written = compress_static(str(tmp_path))
+    assert str(tmp_path / 'site.css.gz') in written
+    assert not (tmp_path / 'tiny.css.gz').exists()
+    assert compress_static(str(tmp_path)) == []
+
+    response = client.get("/static/site.css", headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.data) == css
+    response.close()
+    response = client.get("/static/site.css")
+    assert response.data == css
+    response.close()
+
+
+def test_benchmark_compression(client, sample_data):
+    results = benchmark_compression(client.application, ["/all_ratings"], requests=2)["/all_ratings"]
+    assert results['gzip']['bytes'] < results['identity']['bytes']
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+from book_system_project.model_store import ModelStore
+from book_system_project.factorization import train_als, rmse, train_model, load_model, recommend_for_user
+from book_system_project.commands import train_recommender_command
+
+
+def test_train_als_fits_low_rank_ratings():
+    rng = np.random.default_rng(1)
+    users, books = rng.normal(size=(30, 2)), rng.normal(size=(20, 2))
+    user_index, book_index = np.nonzero(rng.random((30, 20)) < 0.6)
+    values = np.clip(3 + np.einsum('ij,ij->i', users[user_index], books[book_index]), 1, 5)
+    user_factors, item_factors, mean = train_als(user_index, book_index, values, 30, 20, factors=4, reg=0.01,
+                                                 iterations=20)
+    assert rmse(user_factors, item_factors, mean, user_index, book_index, values) < 0.5 * values.std()
+
+
+def test_train_model_and_recommend(client, sample_data, tmp_path):
+    books, users = sample_data['books'], sample_data['users']
+    meta = train_model(str(tmp_path), factors=2, iterations=5, holdout=0.2)
+    assert meta['ratings'] == 12
+    model = load_model(str(tmp_path))
+    assert isinstance(model['item_factors'], np.memmap)
+
+    recommended = recommend_for_user(model, users[3].id, k=10)
+    assert {book_id for book_id, _ in recommended} == {books[0].id, books[3].id}
+    assert recommended[0][1] >= recommended[1][1]
+    assert recommend_for_user(model, 12345) == []
+
+
+def test_train_recommender_command(client, sample_data, tmp_path):
+    client.application.config['RECOMMENDER_MODEL_DIR'] = str(tmp_path)
+    result = client.application.test_cli_runner().invoke(train_recommender_command, ['--iterations', '3'])
+    assert result.exit_code == 0
+    assert "Held-out RMSE" in result.output
+    version = (tmp_path / 'CURRENT').read_text()
+    assert (tmp_path / 'versions' / version / 'item_factors.npy').exists()
+
+
+def test_model_store_swaps_published_versions(client, sample_data, tmp_path):
+    store = ModelStore(str(tmp_path), keep=2)
+    assert store.open() is None
+
+    versions = []
+    for factors in (2, 3, 4):
+        version = store.new_version()
+        train_model(store.version_dir(version), factors=factors, iterations=2, holdout=0)
+        store.publish(version)
+        versions.append(version)
+        model = store.open()
+        assert model['meta']['factors'] == factors
+        assert store.open() is model
+
+    assert sorted(os.listdir(tmp_path / 'versions')) == versions[1:]
+
+
+def test_recommended_for_you_shows_predictions(client, sample_data, login, tmp_path):
+    client.application.config['RECOMMENDER_MODEL_DIR'] = str(tmp_path)
+    client.application.test_cli_runner().invoke(train_recommender_command, ['--iterations', '3'])
+    login(sample_data['users'][3])
+    response = client.get("/recommended_for_you")
+    assert b"Books we think you will like" in response.data
+    predicted = response.data.split(b"Books we think you will like")[1].split(b"<hr>")[0]
+    assert b"War and Peace" in predicted
+    assert b"Anna Karenina" not in predicted
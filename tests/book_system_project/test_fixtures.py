@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from book_system_project.models import db, User, Book, Rating
+from tests.book_system_project.conftest import restored_app_state
+
+
+@pytest.mark.parametrize('run', range(2))
+def test_writes_are_rolled_back_after_each_test(client, run):
+    assert User.query.count() == 0
+    db.session.add(User(email='user@example.com', password='password', name='User'))
+    db.session.commit()
+    assert User.query.count() == 1
+
+
+@pytest.mark.parametrize('run', range(2))
+def test_sample_data_is_restored_after_each_test(client, sample_data, run):
+    assert Book.query.count() == 5
+    assert Rating.query.count() == 12
+    Rating.query.delete()
+    db.session.delete(sample_data['books'][4])
+    db.session.commit()
+    assert Book.query.count() == 4
+
+
+def test_rollback_keeps_earlier_commits(client):
+    db.session.add(User(email='user@example.com', password='password', name='User'))
+    db.session.commit()
+    db.session.add(User(email='user@example.com', password='password', name='Duplicate'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    assert [user.name for user in User.query.all()] == ['User']
+
+
+def test_app_state_is_restored(app):
+    config, extensions = dict(app.config), dict(app.extensions)
+    with restored_app_state(app):
+        app.config['RATE_LIMIT_ENABLED'] = False
+        app.extensions['rate_limit'] = object()
+    assert dict(app.config) == config
+    assert app.extensions == extensions
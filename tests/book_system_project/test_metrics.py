@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+from book_system_project.metrics import MetricsRegistry, Counter, Gauge, Histogram
+
+
+def metric_value(text, sample):
+    for line in text.splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+
+def test_text_exposition_format():
+    registry = MetricsRegistry()
+    requests = registry.register(Counter('requests_total', 'Requests.', ('endpoint',)))
+    latency = registry.register(Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1.0)))
+    requests.inc(endpoint='home')
+    requests.inc(2, endpoint='say "hi"\n')
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, endpoint='home')
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{endpoint="home"} 1',
+        'requests_total{endpoint="say \\"hi\\"\\n"} 2',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{endpoint="home",le="0.1"} 2',
+        'latency_seconds_bucket{endpoint="home",le="1.0"} 3',
+        'latency_seconds_bucket{endpoint="home",le="+Inf"} 4',
+        'latency_seconds_sum{endpoint="home"} 3.65',
+        'latency_seconds_count{endpoint="home"} 4',
+    ]
+
+
+def test_multiprocess_files_are_merged(tmp_path):
+    registry = MetricsRegistry()
+    requests = registry.register(Counter('requests_total', 'Requests.'))
+    pending = registry.register(Gauge('pending', 'Pending jobs.'))
+    latency = registry.register(Histogram('latency_seconds', 'Latency.', buckets=(1.0,)))
+    requests.inc(1)
+    pending.set(3)
+    latency.observe(0.5)
+
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    (tmp_path / f'metrics_{exited.pid}.json').write_text(json.dumps({
+        'requests_total': [[[], 2]], 'pending': [[[], 5]], 'latency_seconds': [[[], [[0, 1], 2.0, 1]]]}))
+
+    text = registry.render(str(tmp_path))
+    assert os.path.exists(tmp_path / f'metrics_{os.getpid()}.json')
+    assert metric_value(text, 'requests_total') == 3
+    assert metric_value(text, 'pending') == 3
+    assert metric_value(text, 'latency_seconds_bucket{le="1.0"}') == 1
+    assert metric_value(text, 'latency_seconds_bucket{le="+Inf"}') == 2
+    assert metric_value(text, 'latency_seconds_sum') == 2.5
+
+
+def test_metrics_endpoint(client, sample_data):
+    book = sample_data['books'][0]
+    before = client.get("/metrics").get_data(as_text=True)
+    client.get(f"/book/{book.id}")
+    client.get(f"/book/{book.id}")
+    client.get("/missing")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    after = response.get_data(as_text=True)
+
+    def delta(sample):
+        return metric_value(after, sample) - metric_value(before, sample)
+
+    assert delta('http_requests_total{endpoint="main.book_details",method="GET",status="200"}') == 2
+    assert delta('http_requests_total{endpoint="unmatched",method="GET",status="404"}') == 1
+    assert delta('http_request_duration_seconds_count{endpoint="main.book_details"}') == 2
+    assert delta('http_request_duration_seconds_bucket{endpoint="main.book_details",le="+Inf"}') == 2
+    assert delta('db_queries_total{endpoint="main.book_details"}') >= 2
+    assert delta('db_query_duration_seconds_total{endpoint="main.book_details"}') > 0
+    assert '# TYPE cache_hits_total counter' in after
+    assert '# TYPE password_hasher_pending gauge' in after
+
+
+def test_metrics_endpoint_merges_worker_files(client, tmp_path):
+    client.application.config['METRICS_MULTIPROC_DIR'] = str(tmp_path)
+    client.get("/")
+    assert (tmp_path / f'metrics_{os.getpid()}.json').exists()
+    text = client.get("/metrics").get_data(as_text=True)
+    assert metric_value(text, 'http_requests_total{endpoint="main.home",method="GET",status="200"}') >= 1
+
+
+def test_metrics_can_be_disabled(client):
+    client.application.config['METRICS_ENABLED'] = False
+    assert client.get("/metrics").status_code == 404
@@ -0,0 +1,69 @@
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from book_system_project.password_hashing import PasswordHasher, HasherBusy, hash_rounds, get_password_hasher
+from book_system_project.models import db, User
+
+
+def test_generate_and_check():
+    hasher = PasswordHasher(rounds=4)
+    hashed = hasher.generate('secret')
+    assert hash_rounds(hashed) == 4
+    assert hasher.check(hashed, 'secret')
+    assert not hasher.check(hashed, 'wrong')
+    assert not hasher.needs_rehash(hashed)
+    assert PasswordHasher(rounds=5).needs_rehash(hashed)
+
+
+def test_process_pool():
+    hasher = PasswordHasher(rounds=4, use_processes=True)
+    assert hasher.check(hasher.generate('secret'), 'secret')
+
+
+def test_busy_pool_rejects_immediately():
+    hasher = PasswordHasher(workers=1, max_pending=1, rounds=4)
+    release = threading.Event()
+    worker = threading.Thread(target=hasher._run, args=(release.wait,))
+    worker.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    with pytest.raises(HasherBusy):
+        hasher.check('$2b$04$' + 'a' * 53, 'secret')
+    assert time.monotonic() - started < 0.05
+    release.set()
+    worker.join()
+    assert hasher.stats() == {'pending': 0, 'rejected': 1}
+
+
+def test_login_rehashes_with_new_work_factor(client):
+    hashed = PasswordHasher(rounds=5).generate('secret')
+    db.session.add(User(email='old@example.com', password=hashed, name='Old hash'))
+    db.session.commit()
+    response = client.post("/login", data={'email': 'old@example.com', 'password': 'secret'})
+    assert response.status_code == 302
+    user = User.query.filter_by(email='old@example.com').first()
+    assert hash_rounds(user.password) == 4
+    assert get_password_hasher().check(user.password, 'secret')
+
+
+def test_busy_pool_answers_503(client):
+    db.session.add(User(email='user@example.com', password=PasswordHasher(rounds=4).generate('x'), name='User'))
+    db.session.commit()
+    with patch.object(PasswordHasher, 'check', side_effect=HasherBusy()):
+        response = client.post("/login", data={'email': 'user@example.com', 'password': 'x'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_timeout_is_busy_and_counts_until_the_job_ends():
+    hasher = PasswordHasher(workers=1, max_pending=1, rounds=4, timeout=0.01)
+    release = threading.Event()
+    with pytest.raises(HasherBusy):
+        hasher._run(release.wait)
+    assert hasher.stats()['pending'] == 1
+    with pytest.raises(HasherBusy):
+        hasher.check('$2b$04$' + 'a' * 53, 'secret')
+    release.set()
+    hasher._executor.shutdown(wait=True)
+    assert hasher.stats() == {'pending': 0, 'rejected': 1}
@@ -0,0 +1,90 @@
+import threading
+import time
+import pytest
+from book_system_project.models import db, User
+from book_system_project.profiling import StackSampler, list_profiles, profile_breakdown
+
+
+def wait_for_samples():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def profiling(client, tmp_path):
+    client.application.config.update(PROFILING_ENABLED=True, PROFILE_DIR=str(tmp_path), PROFILE_SLOW_MS=0)
+    return tmp_path
+
+
+@pytest.fixture
+def admin(client, login):
+    admin = User(email='admin@example.com', password='password', name='Admin')
+    db.session.add(admin)
+    db.session.commit()
+    login(admin)
+    return admin
+
+
+def test_stack_sampler_records_collapsed_stacks():
+    sampler = StackSampler(interval=0.001)
+    sampler.start(threading.get_ident())
+    wait_for_samples()
+    stacks = sampler.stop(threading.get_ident())
+    assert sum(stacks.values()) > 0
+    assert any(stack.split(';')[-1].startswith('wait_for_samples ') for stack in stacks)
+
+
+def test_slow_requests_are_sampled(client, sample_data, profiling):
+    client.application.config['PROFILE_INTERVAL_MS'] = 1
+    client.get("/all_ratings").close()
+    profiles = list_profiles(str(profiling))
+    assert [(profile['method'], profile['path'], profile['kind']) for profile in profiles] == \
+        [('GET', '/all_ratings', 'sample')]
+    functions, samples = profile_breakdown(str(profiling / profiles[0]['name']))
+    assert sum(function['own'] for function in functions) <= samples
+
+
+def test_cprofile_traces(client, sample_data, profiling, admin):
+    client.application.config['PROFILE_MODE'] = 'cprofile'
+    client.get("/view_books").close()
+    profile = list_profiles(str(profiling))[0]
+    assert profile['name'].endswith('.pstats')
+    functions, total = profile_breakdown(str(profiling / profile['name']))
+    assert any(function['function'].startswith('view_books ') for function in functions)
+    assert all(function['calls'] >= 1 for function in functions)
+
+    response = client.get(f"/admin_profiles/{profile['name']}")
+    assert response.status_code == 200
+    assert b"view_books (routes.py" in response.data
+
+
+def test_only_slow_or_sampled_requests_are_kept(client, profiling):
+    client.application.config['PROFILE_SLOW_MS'] = 60000
+    client.get("/").close()
+    assert list_profiles(str(profiling)) == []
+    client.application.config.update(PROFILE_SLOW_MS=None, PROFILE_SAMPLE_RATE=1.0)
+    client.get("/").close()
+    assert len(list_profiles(str(profiling))) == 1
+
+
+def test_old_profiles_are_pruned(client, profiling):
+    client.application.config['PROFILE_KEEP'] = 2
+    for _ in range(3):
+        client.get("/").close()
+    assert len(list_profiles(str(profiling))) == 2
+
+
+def test_admin_profiles_page(client, profiling, admin):
+    client.get("/view_books").close()
+    response = client.get("/admin_profiles")
+    assert response.status_code == 200
+    assert b"GET /view_books" in response.data
+    (profiling / 'notes.txt').write_text('not a profile')
+    assert client.get("/admin_profiles/notes.txt").status_code == 404
+    assert client.get("/admin_profiles/unknown.pstats").status_code == 404
+
+
+def test_admin_profiles_page_needs_admin(client, sample_data, login):
+    login(sample_data['users'][0])
+    assert client.get("/admin_profiles").status_code == 302
@@ -0,0 +1,75 @@
+import os
+import pytest
+from unittest.mock import patch
+from book_system_project.password_hashing import PasswordHasher
+from book_system_project.rate_limit import MemoryRateLimitStore, CacheRateLimitStore
+from book_system_project.cache import LocalCache
+
+
+def test_token_bucket_refills():
+    store = MemoryRateLimitStore()
+    with patch('book_system_project.rate_limit.time.monotonic', return_value=100.0):
+        assert [store.hit('key', 3, 60) for _ in range(3)] == [0, 0, 0]
+        assert store.hit('key', 3, 60) == pytest.approx(20.0)
+        assert store.hit('other', 3, 60) == 0
+    with patch('book_system_project.rate_limit.time.monotonic', return_value=120.0):
+        assert store.hit('key', 3, 60) == 0
+        assert store.hit('key', 3, 60) > 0
+
+
+def test_token_bucket_drops_least_recently_used_keys():
+    store = MemoryRateLimitStore(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        store.hit(key, 1, 60)
+    assert list(store._buckets) == ['b', 'c']
+
+
+def test_sliding_window_store(client):
+    client.application.extensions['cache'] = (os.getpid(), LocalCache())
+    store = CacheRateLimitStore()
+    with patch('book_system_project.rate_limit.time.time', return_value=6000.0):
+        assert [store.hit('key', 2, 60) for _ in range(3)] == [0, 0, 60.0]
+    with patch('book_system_project.rate_limit.time.time', return_value=6090.0):
+        assert store.hit('key', 2, 60) == 30.0
+    with patch('book_system_project.rate_limit.time.time', return_value=6150.0):
+        assert store.hit('key', 2, 60) == 0
+
+
+def test_login_throttled_per_email_before_bcrypt(client, sample_data):
+    data = {'email': 'user1@example.com', 'password': 'wrong'}
+    with patch.object(PasswordHasher, 'check', return_value=False) as check:
+        responses = [client.post("/login", data=data) for _ in range(6)]
+        assert [response.status_code for response in responses] == [200] * 5 + [429]
+        assert check.call_count == 5
+        assert int(responses[-1].headers['Retry-After']) > 0
+        assert client.post("/login", data={'email': 'user2@example.com', 'password': 'wrong'}).status_code == 200
+        assert check.call_count == 6
+
+
+def test_register_throttled_per_email_across_addresses_before_hashing(client):
+    data = {'email': 'new@example.com', 'password': 'secret', 'confirm_password': 'secret', 'name': 'New',
+            'gender': 'Other'}
+    with patch.object(PasswordHasher, 'generate', return_value='hashed') as generate:
+        responses = [client.post("/register", data=data, environ_base={'REMOTE_ADDR': f'10.0.0.{i}'})
+                     for i in range(6)]
+        assert [response.status_code for response in responses] == [302] + [200] * 4 + [429]
+        assert generate.call_count == 1
+        assert client.post("/register", data=dict(data, email='other@example.com'),
+                           environ_base={'REMOTE_ADDR': '10.0.0.6'}).status_code == 302
+        assert generate.call_count == 2
+
+
+def status(response) -> int:
+    """Return the status of a response, closing it since streamed pages are not read."""
+    response.close()
+    return response.status_code
+
+
+def test_rate_limit_can_be_configured(client):
+    client.application.config['RATE_LIMITS'] = {'search': [('ip', 1, 60)]}
+    data = {'select_author': '', 'select_genre': '', 'rating_max': ''}
+    assert status(client.post("/search", data=data)) == 200
+    assert status(client.post("/search", data=data)) == 429
+    assert status(client.get("/search")) == 200
+    client.application.config['RATE_LIMIT_ENABLED'] = False
+    assert status(client.post("/search", data=data)) == 200
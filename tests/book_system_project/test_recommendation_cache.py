@@ -0,0 +1,87 @@
+import os
+import pytest
+from book_system_project.also_liked import rebuild_also_liked
+from book_system_project.cache import RedisCache
+from book_system_project.recommendation_cache import (cached_recommendations, RecommendationWarmer,
+                                                      get_recommendation_warmer)
+from book_system_project.routes import compute_recommendations
+
+
+@pytest.fixture(autouse=True)
+def shared_cache(client):
+    """Give the app a cache shared by all workers, without which recommendations are not cached."""
+    fakeredis = pytest.importorskip('fakeredis')
+    client.application.extensions['cache'] = (os.getpid(), RedisCache(fakeredis.FakeRedis()))
+
+
+def counting_compute(calls):
+    def compute(user_id):
+        calls.append(user_id)
+        return compute_recommendations(user_id)
+    return compute
+
+
+def test_only_ratings_of_liked_books_invalidate(client, sample_data, login):
+    users, books = sample_data['users'], sample_data['books']
+    calls = []
+    compute = counting_compute(calls)
+    cached_recommendations(users[3].id, compute)
+    cached_recommendations(users[3].id, compute)
+    assert calls == [users[3].id]
+
+    login(users[0])
+    client.post(f"/rate_book/{books[4].id}", data={'rating': '5'})
+    cached_recommendations(users[3].id, compute)
+    assert len(calls) == 1
+
+    client.post(f"/rate_book/{books[2].id}", data={'rating': '5'})
+    data = cached_recommendations(users[3].id, compute)
+    assert len(calls) == 2
+    assert books[4].id in [book_id for book_id, _ in data['sorted']]
+
+
+def test_rebuild_invalidates_every_user(client, sample_data):
+    users = sample_data['users']
+    calls = []
+    compute = counting_compute(calls)
+    cached_recommendations(users[0].id, compute)
+    cached_recommendations(users[3].id, compute)
+    rebuild_also_liked()
+    cached_recommendations(users[0].id, compute)
+    cached_recommendations(users[3].id, compute)
+    assert calls == [users[0].id, users[3].id] * 2
+
+
+def test_users_without_5_star_ratings_are_cached(client, sample_data):
+    calls = []
+    assert cached_recommendations(sample_data['users'][3].id + 100, counting_compute(calls)) is None
+    assert cached_recommendations(sample_data['users'][3].id + 100, counting_compute(calls)) is None
+    assert len(calls) == 1
+
+
+def test_nothing_is_cached_in_a_per_process_cache(client, sample_data):
+    client.application.extensions.pop('cache')
+    client.application.config['RECOMMENDATIONS_WARM_ENABLED'] = True
+    calls = []
+    cached_recommendations(sample_data['users'][3].id, counting_compute(calls))
+    cached_recommendations(sample_data['users'][3].id, counting_compute(calls))
+    assert len(calls) == 2
+    assert get_recommendation_warmer(compute_recommendations) is None
+
+
+def test_warmer_computes_recently_active_users(client, sample_data, login):
+    users = sample_data['users']
+    client.application.config.update(RECOMMENDATIONS_WARM_ENABLED=True, RECOMMENDATIONS_WARM_INTERVAL=3600)
+    login(users[1])
+    client.get("/")
+    warmer = get_recommendation_warmer(compute_recommendations)
+    assert warmer.active_users() == [users[1].id]
+
+    calls = []
+    warmer = RecommendationWarmer(client.application, counting_compute(calls), window=60)
+    warmer.note_active(users[0].id)
+    warmer.note_active(users[3].id)
+    assert warmer.warm() == 2
+    assert calls == [users[3].id, users[0].id]
+    cached_recommendations(users[3].id, counting_compute(calls))
+    assert len(calls) == 2
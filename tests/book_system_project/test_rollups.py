@@ -0,0 +1,63 @@
+from datetime import date, datetime
+from book_system_project.models import (db, User, Rating, Review, ToRead, DailyActivity, RatingHistogram,
+                                        GenrePopularity, CohortRetention)
+from book_system_project.rollups import run_rollups, retention_table
+
+
+def set_activity_times(sample_data):
+    """Spread the sample activity over three weeks: users 1-3 start on Monday 2024-01-01, user 4 a week later."""
+    users = sample_data['users']
+    first_day = {users[0].id: datetime(2024, 1, 1, 10), users[1].id: datetime(2024, 1, 2, 10),
+                 users[2].id: datetime(2024, 1, 2, 12), users[3].id: datetime(2024, 1, 9, 10)}
+    for rating in Rating.query:
+        rating.created_at = rating.updated_at = first_day[rating.user_id]
+    for review in Review.query:
+        review.created_at = review.updated_at = first_day[review.user_id]
+    db.session.add(ToRead(toread=True, user_id=users[0].id, book_id=sample_data['books'][4].id,
+                          created_at=datetime(2024, 1, 16, 9)))
+    db.session.commit()
+
+
+def test_rollups(client, sample_data):
+    set_activity_times(sample_data)
+    written = run_rollups()
+    assert written['daily_activity'] == 4
+    days = {row.day: (row.ratings, row.active_raters, row.reviews, row.to_reads) for row in DailyActivity.query}
+    assert days == {date(2024, 1, 1): (4, 1, 1, 0), date(2024, 1, 2): (6, 2, 0, 0),
+                    date(2024, 1, 9): (2, 1, 0, 0), date(2024, 1, 16): (0, 0, 0, 1)}
+    assert {row.rating: row.count for row in RatingHistogram.query} == {1: 1, 2: 1, 3: 1, 4: 2, 5: 7}
+    fiction = {row.genre.name: row for row in GenrePopularity.query}['Fiction']
+    assert fiction.ratings == 6
+    assert round(fiction.avg_rating, 2) == 4.5
+    assert {(row.cohort, row.week): row.users for row in CohortRetention.query} == \
+        {(date(2024, 1, 1), 0): 3, (date(2024, 1, 1), 2): 1, (date(2024, 1, 8), 0): 1}
+    weeks, table = retention_table(max_weeks=2)
+    assert weeks == [1, 2]
+    assert table == [(date(2024, 1, 8), 1, [0, 0]), (date(2024, 1, 1), 3, [0, 33])]
+
+
+def test_incremental_rollup_keeps_past_days(client, sample_data):
+    set_activity_times(sample_data)
+    run_rollups()
+    rating = Rating.query.first()
+    rating.rating, rating.updated_at = 1, datetime(2024, 1, 20, 10)
+    db.session.commit()
+    run_rollups()
+    assert db.session.get(DailyActivity, date(2024, 1, 20)).ratings == 1
+    assert sum(row.ratings for row in DailyActivity.query) == 13
+    run_rollups(full=True)
+    assert sum(row.ratings for row in DailyActivity.query) == 12
+
+
+def test_admin_analytics_shows_rollups(client, sample_data, login):
+    set_activity_times(sample_data)
+    run_rollups()
+    admin = User(email='admin@example.com', password='password', name='Admin')
+    db.session.add(admin)
+    db.session.commit()
+    login(admin)
+    response = client.get("/admin_analytics")
+    assert response.status_code == 200
+    assert b"<td>2024-01-02</td><td>6</td><td>2</td>" in response.data
+    assert b"<td>Fiction</td><td>6</td>" in response.data
+    assert b"<td>2024-01-01</td><td>3</td><td>0%</td><td>33%</td>" in response.data
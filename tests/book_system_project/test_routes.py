@@ -1,3 +1,13 @@
+import json
+import pytest
+from sqlalchemy import event
+from book_system_project.models import db, Book, User, Rating, Review, AlsoLiked
+from book_system_project.also_liked import rebuild_also_liked
+from book_system_project.routes import (search_books, recommended_for_books, recommended_for_each_book,
+                                        iter_books_in_order, serialized_books)
+from flask_login import login_user
+
+
 def test_home(client):
     response = client.get("/")
     assert response.status_code == 200
@@ -26,3 +36,190 @@ def test_all_read_listed(client):
     response = client.get("/all_read_listed")
     assert response.status_code == 200
     assert b"All read listed books:" in response.data
+
+
+def reference_search(rating_min=None, rating_max=None, genre=None, sort_by=None):
+    books = Book.query.all()
+    if genre:
+        books = [book for book in books if any(genre.lower() in g.name.lower() for g in book.genres)]
+    if rating_min:
+        books = [book for book in books if book.avg_rating is not None and book.avg_rating >= rating_min]
+    if rating_max:
+        books = [book for book in books if book.avg_rating is not None and book.avg_rating <= rating_max]
+    if sort_by:
+        rated = sorted([book for book in books if book.avg_rating is not None], key=lambda book: book.avg_rating,
+                       reverse=sort_by == 'rating_desc')
+        unrated = [book for book in books if book.avg_rating is None]
+        books = rated + unrated if sort_by == 'rating_desc' else unrated + rated
+    return books
+
+
+@pytest.mark.parametrize("criteria", [
+    {},
+    {'sort_by': 'rating_desc'},
+    {'sort_by': 'rating_asc'},
+    {'rating_min': 4},
+    {'rating_max': 3},
+    {'rating_min': 3, 'rating_max': 4, 'sort_by': 'rating_desc'},
+    {'rating_min': 4, 'sort_by': 'rating_asc'},
+    {'genre': 'fiction', 'sort_by': 'rating_desc'},
+    {'genre': 'fiction', 'rating_min': 4, 'sort_by': 'rating_desc'},
+])
+def test_search_books_matches_reference(client, sample_data, criteria):
+    results = search_books(**criteria)
+    expected = reference_search(**criteria)
+    assert [book.id for book in results] == [book.id for book in expected]
+
+
+def test_search_books_has_review(client, sample_data):
+    results = search_books(has_review=True, sort_by='rating_desc')
+    assert [book.title for book in results] == ['War and Peace']
+
+
+def test_search_post(client, sample_data):
+    response = client.post("/search", data={'select_author': '', 'select_genre': '', 'rating_min': '4',
+                                            'rating_max': '', 'sort_by': 'rating_desc'})
+    assert response.status_code == 200
+    assert b"We have found 2 books" in response.data
+    assert response.data.index(b"War and Peace") < response.data.index(b"Anna Karenina")
+
+
+def test_list_pages_are_streamed(client, sample_data):
+    client.application.config['STREAM_BUFFER_SIZE'] = 1
+    response = client.get("/all_ratings")
+    assert response.is_streamed
+    chunks = list(response.response)
+    header = next(index for index, chunk in enumerate(chunks) if b'class="sidebar"' in chunk)
+    assert header < next(index for index, chunk in enumerate(chunks) if b'Dune' in chunk)
+    assert b"Dune (3.67)" in b''.join(chunks)
+
+
+def test_streamed_search_flashes_once(client, sample_data):
+    response = client.post("/search", data={'select_author': '', 'select_genre': '', 'rating_min': '5',
+                                            'rating_max': '', 'sort_by': 'rating_desc'})
+    assert response.data.count(b"No books met your search criteria.") == 1
+    assert b"No books met your search criteria." not in client.get("/").data
+
+
+def test_iter_books_in_order(client, sample_data):
+    ids = [book.id for book in sample_data['books']][::-1]
+    assert [book.id for book in iter_books_in_order(ids + [10 ** 6], batch_size=2)] == ids
+
+
+def test_serialized_books_use_four_queries_per_batch(client, sample_data):
+    books = sample_data['books']
+    expected = [{'id': book.id, 'title': book.title, 'author': {'name': book.author.name},
+                 'genres': [{'name': genre.name} for genre in book.genres], 'avg_rating': book.avg_rating}
+                for book in books[::-1]]
+    db.session.expunge_all()
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        serialized = list(serialized_books([book.id for book in books[::-1]], batch_size=3))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert serialized == expected
+    assert len(statements) == 8
+
+
+def test_saved_search_is_capped(client, sample_data, login, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'instance').mkdir()
+    monkeypatch.setattr('book_system_project.routes.SEARCH_RESULTS_SHOWN', 1)
+    login(sample_data['users'][0])
+    client.post("/search", data={'select_author': '', 'select_genre': '', 'rating_min': '1', 'rating_max': '',
+                                 'sort_by': 'rating_desc'}).close()
+    saved = json.loads((tmp_path / 'instance' / 'search_results.json').read_text())[0]
+    assert saved['count'] == 4
+    assert [result['title'] for result in saved['jsoned_results']] == ['War and Peace']
+    response = client.get(f"/saved_search/{saved['search_id']}")
+    assert b"We have found 4 books" in response.data
+
+
+def test_recommended_for_you(client, sample_data, login):
+    login(sample_data['users'][0])
+    response = client.get("/recommended_for_you")
+    assert response.status_code == 200
+    favorites = response.data.split(b"Favorite books of all users")[1]
+    assert b"Dune (3.67)" in favorites
+    assert b"Anna Karenina" not in favorites
+
+
+def test_recommended_for_you_without_5_star_ratings(client, sample_data, login):
+    user = User(email='new@example.com', password='password', name='New user')
+    db.session.add(user)
+    db.session.commit()
+    login(user)
+    response = client.get("/recommended_for_you")
+    assert response.status_code == 302
+
+
+def test_recommended_for_books(client, sample_data):
+    books = sample_data['books']
+    with client.application.test_request_context():
+        login_user(sample_data['users'][2])
+        results = recommended_for_books([books[2], books[3]])
+        assert results == [(books[2], []), (books[3], [(books[0], 4.67)])]
+        assert recommended_for_each_book(books[3].id) == [(books[0], 4.67)]
+
+
+def also_liked_rows():
+    return sorted((row.book_id, row.related_book_id, row.count) for row in AlsoLiked.query.all())
+
+
+def test_rate_book_updates_also_liked(client, sample_data, login):
+    books, users = sample_data['books'], sample_data['users']
+    rebuild_also_liked()
+    login(users[3])
+    response = client.post(f"/rate_book/{books[1].id}", data={'rating': '5'})
+    assert response.status_code == 302
+    login(users[0])
+    response = client.post(f"/rate_book/{books[0].id}", data={'rating': '2'})
+    assert response.status_code == 302
+    incremental = also_liked_rows()
+    assert incremental == [row for row in incremental if row[2] > 0]
+    rebuild_also_liked()
+    assert incremental == also_liked_rows()
+    assert (books[1].id, books[2].id, 1) in incremental
+
+
+def test_book_details_also_liked(client, sample_data):
+    books = sample_data['books']
+    rebuild_also_liked()
+    response = client.get(f"/book/{books[0].id}")
+    assert response.status_code == 200
+    assert b"Users who liked this book also liked:" in response.data
+    assert b"Complete Poems</a> (1)" in response.data
+
+
+def add_reviews(book, count):
+    for number in range(count):
+        user = User(email=f'reviewer{number}@example.com', password='password', name=f'Reviewer {number}')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Rating(user_id=user.id, book_id=book.id, rating=number % 5 + 1))
+        db.session.add(Review(user_id=user.id, book_id=book.id, review=f'Review text {number}.'))
+    db.session.commit()
+
+
+def test_book_reviews_sorted_and_paginated(client, sample_data):
+    book = sample_data['books'][4]
+    add_reviews(book, 7)
+    response = client.get(f"/book_reviews/{book.id}")
+    assert b"Review text 6." in response.data
+    assert b"Review text 1." not in response.data
+    response = client.get(f"/book_reviews/{book.id}?page=2")
+    assert b"Review text 1." in response.data and b"Review text 0." in response.data
+    assert b"Review text 6." not in response.data
+
+    response = client.post(f"/book_reviews/{book.id}", data={'sorted': 'best'})
+    page = response.data.decode()
+    assert page.index("Review text 4.") < page.index("Review text 3.") < page.index("Review text 2.")
+    assert "Review text 0." not in page
+
+
+def test_review_text_is_deferred(client, sample_data):
+    review = Review.query.first()
+    assert 'review' not in review.__dict__
+    assert review.review == 'A long read.'
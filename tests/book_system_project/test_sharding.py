@@ -0,0 +1,193 @@
+import shutil
+from datetime import datetime
+import pytest
+from book_system_project import create_app
+from book_system_project.admin import create_admin_app
+from book_system_project.models import (db, User, Rating, Review, ToRead, AlsoLiked, DailyActivity, RatingHistogram,
+                                        GenrePopularity, CohortRetention, dedupe_activity)
+from book_system_project.also_liked import rebuild_also_liked
+from book_system_project.analytics import rebuild_analytics, books_by_readers, total_readers, top_reviewers
+from book_system_project.factorization import load_ratings, train_model, load_model, recommend_for_user
+from book_system_project.rollups import run_rollups
+from book_system_project.trending import load_events
+from book_system_project.write_behind import WriteBehindQueue
+from book_system_project.routes import leaderboard, compute_recommendations, search_books
+from book_system_project.sharding import (ACTIVITY_MODELS, copy_activity_to_shards, get_router, merge_averages,
+                                          merge_counts, shard_index)
+
+
+def use_shards(app, tmp_path):
+    """Shard the activity tables of the current database over three SQLite files, and return the router."""
+    app.config['ACTIVITY_SHARDS'] = [f"sqlite:///{tmp_path / f'shard{index}.db'}" for index in range(3)]
+    copy_activity_to_shards()
+    app.extensions.pop('cache', None)
+    return get_router()
+
+
+@pytest.fixture
+def shards(client, sample_data, tmp_path):
+    router = use_shards(client.application, tmp_path)
+    yield router
+    router.dispose()
+
+
+def aggregates(users):
+    return {
+        'ratings': leaderboard('ratings'),
+        'reviews': leaderboard('reviews'),
+        'read_listed': leaderboard('read_listed'),
+        'recommendations': [compute_recommendations(user.id) for user in users],
+        'search': [book.id for book in search_books(rating_min=3, sort_by='rating_desc')],
+    }
+
+
+def derived(users, model_dir):
+    """Everything computed from the activity tables, outside of the routes."""
+    rebuild_analytics()
+    run_rollups(full=True)
+    train_model(str(model_dir), factors=2, iterations=5, holdout=0)
+    model = load_model(str(model_dir))
+    return {
+        'analytics': ([(book.id, count) for book, count in books_by_readers()], total_readers(),
+                      [(user.id, count) for user, count in top_reviewers()]),
+        'rollups': [sorted((row.day, row.ratings, row.active_raters, row.reviews, row.to_reads)
+                           for row in DailyActivity.query),
+                    sorted((row.rating, row.count) for row in RatingHistogram.query),
+                    sorted((row.genre_id, row.ratings, row.avg_rating, row.read_listed)
+                           for row in GenrePopularity.query),
+                    sorted((row.cohort, row.week, row.users) for row in CohortRetention.query)],
+        'trending': sorted(load_events(datetime(2000, 1, 1))),
+        'ratings': sorted(zip(*(values.tolist() for values in load_ratings()))),
+        'recommended': [{book_id for book_id, _ in recommend_for_user(model, user.id)} for user in users],
+    }
+
+
+def test_shard_index_is_stable_and_spread():
+    assert shard_index(7, 3) == shard_index(7, 3)
+    assert {shard_index(user_id, 3) for user_id in range(1, 100)} == {0, 1, 2}
+
+
+def test_merge_partial_results():
+    assert merge_counts([[(1, 2), (2, 1)], [(1, 3)]]) == {1: 5, 2: 1}
+    assert merge_averages([[(1, 10, 2)], [(1, 2, 2), (2, 4, 1)]]) == {1: 3.0, 2: 4.0}
+
+
+def test_rows_are_copied_to_the_shards_of_their_users(shards, sample_data):
+    total = 0
+    for index, session in enumerate(shards.sessions()):
+        user_ids = {user_id for user_id, in session.query(Rating.user_id)}
+        assert all(shards.shard_for(user_id) == index for user_id in user_ids)
+        total += session.query(Rating).count()
+    assert total == db.session.query(Rating).count()
+
+
+def test_aggregates_match_the_unsharded_database(client, sample_data, tmp_path):
+    unsharded = aggregates(sample_data['users'])
+    router = use_shards(client.application, tmp_path)
+    try:
+        assert aggregates(sample_data['users']) == unsharded
+    finally:
+        router.dispose()
+
+
+def test_writes_go_to_the_users_shard(client, shards, sample_data, login):
+    user, book = sample_data['users'][1], sample_data['books'][4]
+    login(user)
+    client.post(f"/rate_book/{book.id}", data={'rating': '5'})
+    client.post(f"/write_review/{book.id}", data={'review': 'Sharded review.'})
+
+    assert not Rating.query.filter_by(user_id=user.id, book_id=book.id).first()
+    shard = shards.sessions()[shards.shard_for(user.id)]
+    assert shard.query(Rating).filter_by(user_id=user.id, book_id=book.id).one().rating == 5
+    assert b"Sharded review." in client.get("/your_reviews").data
+    assert b"Sharded review." in client.get(f"/book_reviews/{book.id}").data
+    assert b"Rating: 5.0" in client.get(f"/book/{book.id}").data
+    assert b"Resurrection" in client.get("/").data
+    assert dict(leaderboard('ratings'))[book.id] == 5
+    assert AlsoLiked.query.filter_by(book_id=book.id).count() == 2
+
+
+def test_rebuild_also_liked_from_the_shards(client, sample_data, tmp_path):
+    rebuild_also_liked()
+    unsharded = sorted((row.book_id, row.related_book_id, row.count) for row in AlsoLiked.query)
+    router = use_shards(client.application, tmp_path)
+    db.session.query(Rating).delete()
+    try:
+        rebuild_also_liked()
+        assert sorted((row.book_id, row.related_book_id, row.count) for row in AlsoLiked.query) == unsharded
+        assert sum(session.query(Review).count() for session in router.sessions()) == 1
+    finally:
+        router.dispose()
+
+
+def test_nothing_reads_the_main_database_activity_once_sharded(client, sample_data, tmp_path):
+    users = sample_data['users']
+    unsharded = aggregates(users), derived(users, tmp_path / 'unsharded')
+    router = use_shards(client.application, tmp_path)
+    for model in (Rating, Review, ToRead):
+        db.session.query(model).delete()
+    db.session.commit()
+    try:
+        assert (aggregates(users), derived(users, tmp_path / 'sharded')) == unsharded
+        assert dedupe_activity() == {'rating': 0, 'review': 0, 'to_read': 0}
+        assert sum(session.query(Rating).count() for session in router.sessions()) == len(unsharded[1]['ratings'])
+    finally:
+        router.dispose()
+
+
+def test_admin_edits_the_activity_in_each_shard(tmp_path, database_templates):
+    shutil.copyfile(database_templates['seeded'], tmp_path / 'test.db')
+    shards = [f"sqlite:///{tmp_path / f'shard{index}.db'}" for index in range(3)]
+    config = tmp_path / 'config.py'
+    config.write_text(f"SECRET_KEY = 'test'\n"
+                      f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{tmp_path / 'test.db'}'\n"
+                      f"ACTIVITY_SHARDS = {shards!r}\n"
+                      f"WTF_CSRF_ENABLED = False\n")
+    app = create_app(str(config))
+    with app.app_context():
+        copy_activity_to_shards()
+        for model in ACTIVITY_MODELS:
+            db.session.query(model).delete()
+        admin = User(email='admin@example.com', password='password', name='Admin')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id, shard = admin.id, get_router().shard_for(admin.id)
+        user_id, book_id = database_templates['sample_data']['users'][0], database_templates['sample_data']['books'][4]
+        other_shard = get_router().shard_for(user_id)
+        ratings = get_router().sessions()[other_shard].query(Rating).count()
+
+    client = create_admin_app(app).test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+    assert client.get(f"/rating_shard{other_shard}/").data.count(b'name="rowid"') == ratings
+    assert client.get("/user/edit/?id=1").status_code == 200
+    response = client.post(f"/rating_shard{shard}/new/", data={'user_id': admin_id, 'book_id': book_id, 'rating': 4})
+    assert response.status_code == 302
+
+    with app.app_context():
+        router = get_router()
+        assert router.sessions()[shard].query(Rating).filter_by(user_id=admin_id).one().rating == 4
+        assert db.session.query(Rating).count() == 0
+        router.dispose()
+
+
+def test_write_behind_retry_after_the_main_commit_failed(client, shards, sample_data, monkeypatch):
+    user, book, unread = sample_data['users'][1], sample_data['books'][2], sample_data['books'][4]
+    rebuild_also_liked()
+    rebuild_analytics()
+    queue = WriteBehindQueue(client.application)
+    queue.enqueue({'kind': 'rating', 'user_id': user.id, 'book_id': book.id, 'value': 5})
+    queue.enqueue({'kind': 'to_read', 'user_id': user.id, 'book_id': unread.id, 'value': True})
+
+    def main_commit_fails():
+        raise RuntimeError("main database unavailable")
+    monkeypatch.setattr(db.session, 'commit', main_commit_fails)
+    assert queue.flush() == 0
+    assert shards.session(user.id).query(Rating).filter_by(user_id=user.id, book_id=book.id).one().rating == 5
+    monkeypatch.undo()
+    assert queue.flush() == 2
+
+    also_liked = sorted((row.book_id, row.related_book_id, row.count) for row in AlsoLiked.query)
+    rebuild_also_liked()
+    assert also_liked == sorted((row.book_id, row.related_book_id, row.count) for row in AlsoLiked.query)
+    assert dict((book.id, readers) for book, readers in books_by_readers())[unread.id] == 1
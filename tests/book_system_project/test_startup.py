@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import pytest
+from book_system_project import create_app
+from book_system_project.models import db, User
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFERRED_MODULES = ('flask_admin', 'numpy', 'book_system_project.seed', 'book_system_project.media.books66',
+                    'book_system_project.factorization')
+VIEWS_IMPORT_BUDGET_US = 500000
+
+
+def test_create_app_import_time():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             "from book_system_project import create_app; create_app('app_testing_config.py')"],
+                            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, total, name = line.split('|')
+            if total.strip().isdigit():
+                cumulative[name.strip()] = int(total)
+    assert not [module for module in DEFERRED_MODULES if module in cumulative]
+    assert cumulative['book_system_project.blueprints'] < VIEWS_IMPORT_BUDGET_US
+
+
+@pytest.fixture
+def admin_app(tmp_path, database_file):
+    config = tmp_path / 'config.py'
+    config.write_text(f"SECRET_KEY = 'test'\n"
+                      f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{database_file}'\n")
+    app = create_app(str(config))
+    with app.app_context():
+        admin = User(email='admin@example.com', password='password', name='Admin')
+        user = User(email='user@example.com', password='password', name='User')
+        db.session.add_all([admin, user])
+        db.session.commit()
+        yield app, admin.id, user.id
+        db.session.remove()
+
+
+def test_admin_is_built_on_first_admin_request(admin_app):
+    app, admin_id, user_id = admin_app
+    client = app.test_client()
+    assert client.get("/").status_code == 200
+    assert app.wsgi_app._dispatcher is None
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    assert client.get("/admin/user/").status_code == 403
+    assert app.wsgi_app._dispatcher is not None
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+    response = client.get("/admin/user/")
+    assert response.status_code == 200
+    assert b"user@example.com" in response.data
+    assert client.get("/").status_code == 200
+
+
+def test_seed_books_command(client):
+    from book_system_project.media.books66 import books_list
+    result = client.application.test_cli_runner().invoke(args=['seed-books'])
+    assert result.output == f"Added {len(books_list)} book(s).\n"
+    result = client.application.test_cli_runner().invoke(args=['seed-books'])
+    assert result.output == "Added 0 book(s).\n"
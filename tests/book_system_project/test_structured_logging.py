@@ -0,0 +1,92 @@
+import json
+import logging
+import queue
+import pytest
+from book_system_project.structured_logging import (configure_logging, shutdown_logging, DroppingQueueHandler,
+                                                    LOGGER_NAME)
+
+
+@pytest.fixture
+def log_file(tmp_path, logging_config):
+    path = tmp_path / 'test.log'
+    configure_logging({'LOG_FILE': str(path)})
+    yield path
+    configure_logging(logging_config)
+
+
+def read_records(path):
+    shutdown_logging()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_requests_are_logged_with_request_fields(client, sample_data, login, log_file):
+    book, user = sample_data['books'][0], sample_data['users'][0]
+    login(user)
+    response = client.get(f"/book/{book.id}", headers={'X-Request-ID': 'request-1'})
+    assert response.headers['X-Request-ID'] == 'request-1'
+    assert client.get("/").headers['X-Request-ID'] != 'request-1'
+
+    records = [record for record in read_records(log_file) if record['message'].startswith('Request completed')]
+    assert len(records) == 2
+    assert records[0]['message'] == f"Request completed: GET /book/{book.id}"
+    assert records[0]['request_id'] == 'request-1'
+    assert records[0]['route'] == '/book/<int:book_id>'
+    assert records[0]['user_id'] == str(user.id)
+    assert records[0]['status'] == 200
+    assert records[0]['latency_ms'] > 0
+    assert records[0]['level'] == 'INFO'
+
+
+def test_high_volume_records_are_sampled(client, sample_data, login, log_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'instance').mkdir()
+    client.application.config['LOG_SAMPLING'] = {'Search performed': 0.5}
+    login(sample_data['users'][0])
+    data = {'select_author': '', 'select_genre': '', 'rating_min': '4', 'rating_max': '', 'sort_by': 'rating_desc'}
+    for _ in range(4):
+        client.post("/search", data=data).close()
+
+    records = [record for record in read_records(log_file) if record['message'].startswith('Search performed')]
+    assert len(records) == 2
+    assert {record['sample_rate'] for record in records} == {0.5}
+
+
+def test_warnings_are_never_sampled(client, log_file):
+    client.application.config['LOG_SAMPLING'] = {'Failed': 0}
+    logging.getLogger(LOGGER_NAME).warning("Failed to login")
+    assert [record['message'] for record in read_records(log_file)] == ["Failed to login"]
+
+
+def test_log_file_is_rotated_by_size(tmp_path, logging_config):
+    path = tmp_path / 'test.log'
+    configure_logging({'LOG_FILE': str(path), 'LOG_MAX_BYTES': 500, 'LOG_BACKUP_COUNT': 2})
+    try:
+        for number in range(30):
+            logging.getLogger(LOGGER_NAME).info(f"Record {number}")
+        shutdown_logging()
+    finally:
+        configure_logging(logging_config)
+    assert (tmp_path / 'test.log.1').exists()
+    assert (tmp_path / 'test.log.2').exists()
+    assert not (tmp_path / 'test.log.3').exists()
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    logger = logging.getLogger('test_full_queue')
+    logger.addHandler(handler)
+    try:
+        logger.warning("first")
+        logger.warning("second")
+    finally:
+        logger.removeHandler(handler)
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().getMessage() == "first"
+
+
+def test_benchmark_logging_command(client):
+    result = client.application.test_cli_runner().invoke(args=['benchmark-logging', '--requests', '3',
+                                                                '--records', '100'])
+    lines = result.output.splitlines()
+    assert [line.split(':')[0] for line in lines] == ['synchronous', 'queued']
+    assert all('ms per request' in line and '0 record(s) dropped' in line for line in lines)
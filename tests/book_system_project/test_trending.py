@@ -0,0 +1,54 @@
+import time
+from datetime import datetime, timedelta
+from book_system_project.models import db, Rating, Review
+from book_system_project.trending import TrendingTracker, load_events
+
+
+def test_scores_decay_with_half_life():
+    now = time.time()
+    tracker = TrendingTracker(half_life=3600, window=10 * 3600, now=now)
+    tracker.add(1, 1.0, when=now - 3600)
+    tracker.add(2, 1.0, when=now)
+    top = dict(tracker.top(5, now=now))
+    assert abs(top[1] - 0.5) < 1e-9
+    assert abs(top[2] - 1.0) < 1e-9
+
+
+def test_top_is_ordered_and_updated_incrementally():
+    now = time.time()
+    tracker = TrendingTracker(half_life=3600, window=10 * 3600, now=now)
+    for book_id, count in ((1, 3), (2, 1), (3, 2)):
+        for _ in range(count):
+            tracker.add(book_id, when=now)
+    assert [book_id for book_id, _ in tracker.top(2, now=now)] == [1, 3]
+    tracker.add(2, 5.0, when=now)
+    assert [book_id for book_id, _ in tracker.top(3, now=now)] == [2, 1, 3]
+
+
+def test_events_outside_window_are_forgotten():
+    now = time.time()
+    tracker = TrendingTracker(half_life=3600, window=2 * 3600, now=now - 5 * 3600)
+    tracker.add(1, 10.0, when=now - 4 * 3600)
+    tracker.add(2, 1.0, when=now)
+    assert [book_id for book_id, _ in tracker.top(5, now=now)] == [2]
+
+
+def test_home_shows_trending_books(client, sample_data, login):
+    book = sample_data['books'][4]
+    login(sample_data['users'][0])
+    client.post(f"/write_review/{book.id}", data={'review': 'Trending review'})
+    response = client.get("/")
+    trending = response.data.split(b"Trending in the last 14 days:")[1].split(b"</ol>")[0]
+    assert trending.index(b"War and Peace") < trending.index(b"Anna Karenina") < trending.index(b"Resurrection")
+
+
+def test_resync_counts_recent_changes_of_old_rows(client, sample_data):
+    now = datetime.utcnow()
+    for model in (Rating, Review):
+        model.query.update({'created_at': now - timedelta(days=30), 'updated_at': None})
+    rerated = Rating.query.first()
+    rerated.updated_at = now - timedelta(hours=1)
+    db.session.commit()
+    events = load_events(now - timedelta(days=14))
+    assert [(book_id, weight) for book_id, weight, _ in events] == [(rerated.book_id, 1.0)]
+    assert abs(events[0][2] - (time.time() - 3600)) < 60
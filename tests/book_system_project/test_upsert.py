@@ -0,0 +1,158 @@
+import threading
+import pytest
+from sqlalchemy import event, inspect, text
+from book_system_project import create_app
+from book_system_project.also_liked import rebuild_also_liked, update_also_liked
+from book_system_project.models import (db, User, Book, Author, Rating, Review, ToRead, AlsoLiked, dedupe_activity,
+                                        upsert_previous)
+
+
+@pytest.fixture
+def file_app(tmp_path, database_file):
+    config = tmp_path / 'config.py'
+    config.write_text(f"SECRET_KEY = 'test'\n"
+                      f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{database_file}'\n"
+                      f"WTF_CSRF_ENABLED = False\n")
+    app = create_app(str(config))
+    with app.app_context():
+        users = [User(email=f'user{i}@example.com', password='password', name=f'User {i}') for i in range(8)]
+        book = Book(title='War and Peace', author=Author(name='Leo Tolstoy'))
+        db.session.add_all(users + [book])
+        db.session.commit()
+        yield app, [user.id for user in users], book.id
+        db.session.remove()
+
+
+def test_upsert_previous_reads_once_then_writes_once(file_app):
+    app, user_ids, book_id = file_app
+    values = {'user_id': user_ids[0], 'book_id': book_id}
+    with app.app_context():
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement.split()[0]))
+        for rating, previous in ((3, None), (5, 3), (1, 5)):
+            statements.clear()
+            assert upsert_previous(Rating, dict(values, rating=rating), index_elements=['user_id', 'book_id'],
+                                   update_fields=['rating'], previous_field='rating') == previous
+            assert statements == ['UPDATE', 'INSERT']
+        db.session.commit()
+        assert Rating.query.filter_by(**values).one().rating == 1
+
+
+def test_concurrent_submissions_do_not_duplicate_rows(file_app):
+    app, user_ids, book_id = file_app
+    errors = []
+
+    def submit(user_id, number):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        for attempt in range(number):
+            rating = client.post(f"/rate_book/{book_id}", data={'rating': str(attempt % 5 + 1)})
+            review = client.post(f"/write_review/{book_id}", data={'review': f'Review {attempt}'})
+            if rating.status_code != 302 or review.status_code != 302:
+                errors.append((rating.status_code, review.status_code))
+
+    threads = [threading.Thread(target=submit, args=(user_id, 5)) for user_id in user_ids[:4] for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with app.app_context():
+        assert Rating.query.count() == 4
+        assert Review.query.count() == 4
+        assert {rating.user_id for rating in Rating.query} == set(user_ids[:4])
+
+
+def run_concurrently(app, user_id, requests, threads=4):
+    """Send each list of requests from its own thread and client, logged in as the same user, and return errors."""
+    errors = []
+
+    def send():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        for url, data in requests:
+            response = client.post(url, data=data)
+            if response.status_code != 302:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return errors
+
+
+def also_liked_rows():
+    return sorted((row.book_id, row.related_book_id, row.count) for row in AlsoLiked.query)
+
+
+def test_concurrent_ratings_by_one_user_keep_also_liked_exact(file_app):
+    app, user_ids, book_id = file_app
+    with app.app_context():
+        other = Book(title='Anna Karenina', author_id=db.session.get(Book, book_id).author_id)
+        db.session.add(other)
+        db.session.flush()
+        db.session.add(Rating(user_id=user_ids[0], book_id=other.id, rating=5))
+        db.session.commit()
+
+    requests = [(f"/rate_book/{book_id}", {'rating': str(rating)}) for rating in (5, 1) * 4]
+    assert run_concurrently(app, user_ids[0], requests) == []
+    with app.app_context():
+        counted = also_liked_rows()
+        rebuild_also_liked()
+        assert counted == also_liked_rows()
+
+
+def test_update_also_liked_counts_a_pair_inserted_concurrently(file_app):
+    app, user_ids, book_id = file_app
+    with app.app_context():
+        other = Book(title='Anna Karenina', author_id=db.session.get(Book, book_id).author_id)
+        db.session.add(other)
+        db.session.flush()
+        other_id = other.id
+        db.session.add_all([Rating(user_id=user_ids[0], book_id=other_id, rating=5),
+                            Rating(user_id=user_ids[0], book_id=book_id, rating=5)])
+        db.session.commit()
+
+        def concurrent_like(conn, cursor, statement, *args):
+            if statement.split()[0] in ('INSERT', 'UPDATE') and 'also_liked' in statement and not concurrent:
+                concurrent.append(statement)
+                with db.engine.begin() as other_connection:
+                    other_connection.execute(AlsoLiked.__table__.insert(), [
+                        {'book_id': book_id, 'related_book_id': other_id, 'count': 1},
+                        {'book_id': other_id, 'related_book_id': book_id, 'count': 1}])
+        concurrent = []
+        event.listen(db.engine, 'before_cursor_execute', concurrent_like)
+        update_also_liked(user_ids[0], book_id, None, 5)
+        db.session.commit()
+        event.remove(db.engine, 'before_cursor_execute', concurrent_like)
+        assert also_liked_rows() == [(book_id, other_id, 2), (other_id, book_id, 2)]
+
+
+def test_concurrent_read_list_additions_add_one_row(file_app):
+    app, user_ids, book_id = file_app
+    requests = [(f"/book/{book_id}", {'toread': 'y'})] * 3
+    assert run_concurrently(app, user_ids[0], requests) == []
+    with app.app_context():
+        assert ToRead.query.filter_by(user_id=user_ids[0], book_id=book_id).count() == 1
+
+
+def test_dedupe_activity(file_app):
+    app, user_ids, book_id = file_app
+    with app.app_context():
+        db.session.execute(text("DROP INDEX uq_rating_user_id_book_id"))
+        db.session.add_all([Rating(user_id=user_ids[0], book_id=book_id, rating=rating) for rating in (1, 2, 5)])
+        db.session.add(Rating(user_id=user_ids[1], book_id=book_id, rating=3))
+        db.session.commit()
+
+        assert dedupe_activity() == {'rating': 2, 'review': 0, 'to_read': 0}
+        assert sorted((rating.user_id, rating.rating) for rating in Rating.query) == [(user_ids[0], 5),
+                                                                                      (user_ids[1], 3)]
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('rating')}
+        assert 'uq_rating_user_id_book_id' in indexes
+        assert dedupe_activity() == {'rating': 0, 'review': 0, 'to_read': 0}
@@ -0,0 +1,121 @@
+import shutil
+from sqlalchemy import event
+from book_system_project import create_app
+from book_system_project.models import db, Rating, ToRead, AnalyticsEvent
+from book_system_project.trending import get_trending
+from book_system_project.write_behind import WriteBehindQueue, get_write_behind
+
+
+def enable_write_behind(client):
+    client.application.config.update(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_FLUSH_MS=60000)
+    return get_write_behind()
+
+
+def test_rating_is_queued_and_visible_to_user(client, sample_data, login):
+    queue = enable_write_behind(client)
+    book, user = sample_data['books'][4], sample_data['users'][0]
+    login(user)
+    client.post(f"/rate_book/{book.id}", data={'rating': '4'})
+    client.post(f"/rate_book/{book.id}", data={'rating': '5'})
+    assert Rating.query.filter_by(user_id=user.id, book_id=book.id).first() is None
+    assert b"Update your rating" in client.get(f"/book/{book.id}").data
+
+    assert queue.flush() == 1
+    assert Rating.query.filter_by(user_id=user.id, book_id=book.id).one().rating == 5
+
+
+def test_read_list_changes_are_queued(client, sample_data, login):
+    queue = enable_write_behind(client)
+    books, user = sample_data['books'], sample_data['users'][0]
+    login(user)
+    client.post(f"/book/{books[0].id}")
+    client.post(f"/book/{books[1].id}")
+    client.post(f"/remove_to_read/{books[0].id}")
+    response = client.get("/to_read")
+    assert b"Complete Poems" in response.data
+    assert b"War and Peace" not in response.data
+    assert ToRead.query.count() == 0
+
+    assert queue.flush() == 2
+    assert [toread.book_id for toread in ToRead.query.all()] == [books[1].id]
+    assert AnalyticsEvent.query.count() == 0
+
+
+def test_queued_writes_trend_once_flushed(client, sample_data, login):
+    queue = enable_write_behind(client)
+    book, user = sample_data['books'][4], sample_data['users'][0]
+    login(user)
+    assert book.id not in dict(get_trending().top(5))
+    client.post(f"/rate_book/{book.id}", data={'rating': '4'})
+    client.post(f"/book/{book.id}")
+    assert book.id not in dict(get_trending().top(5))
+
+    assert queue.flush() == 2
+    assert dict(get_trending().top(5))[book.id] > 0
+
+
+def test_journal_is_replayed(client, sample_data, tmp_path):
+    journal = str(tmp_path / 'writes.journal')
+    book, user = sample_data['books'][4], sample_data['users'][0]
+    queue = WriteBehindQueue(client.application, journal_path=journal)
+    queue.enqueue({'kind': 'rating', 'user_id': user.id, 'book_id': book.id, 'value': 3})
+
+    replayed = WriteBehindQueue(client.application, journal_path=journal)
+    assert replayed.pending_rating(user.id, book.id) == 3
+    assert replayed.flush() == 1
+    assert open(journal).read() == ''
+    assert Rating.query.filter_by(user_id=user.id, book_id=book.id).one().rating == 3
+
+
+def test_failing_write_does_not_block_the_queue(client, sample_data, monkeypatch):
+    books = [book.id for book in sample_data['books']]
+    user = sample_data['users'][0].id
+    queue = WriteBehindQueue(client.application, max_attempts=2)
+    apply = WriteBehindQueue._apply
+    seen_during_flush = []
+
+    def apply_or_fail(write):
+        seen_during_flush.append(queue.pending_rating(write['user_id'], write['book_id']))
+        if write['book_id'] == books[4]:
+            raise ValueError("poison write")
+        return apply(write)
+    monkeypatch.setattr(WriteBehindQueue, '_apply', staticmethod(apply_or_fail))
+
+    queue.enqueue({'kind': 'rating', 'user_id': user, 'book_id': books[4], 'value': 1})
+    queue.enqueue({'kind': 'rating', 'user_id': user, 'book_id': books[3], 'value': 4})
+    assert queue.flush() == 1
+    assert seen_during_flush == [1, 1, 4]
+    assert Rating.query.filter_by(user_id=user, book_id=books[3]).one().rating == 4
+    assert Rating.query.filter_by(user_id=user, book_id=books[4]).first() is None
+    assert queue.pending_rating(user, books[4]) == 1
+    assert queue.pending_rating(user, books[3]) is None
+
+    assert queue.flush() == 0
+    assert queue.pending_rating(user, books[4]) is None
+    assert [(write['book_id'], write['attempts']) for write in queue.dead_letters] == [(books[4], 2)]
+
+
+def test_flush_is_one_transaction_on_the_apps_own_engine(tmp_path, database_templates):
+    shutil.copyfile(database_templates['seeded'], tmp_path / 'test.db')
+    config = tmp_path / 'config.py'
+    config.write_text(f"SECRET_KEY = 'test'\n"
+                      f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{tmp_path / 'test.db'}'\n")
+    app = create_app(str(config))
+    books, user = database_templates['sample_data']['books'], database_templates['sample_data']['users'][3]
+    queue = WriteBehindQueue(app)
+    for value, book_id in enumerate(books[2:], start=1):
+        queue.enqueue({'kind': 'rating', 'user_id': user, 'book_id': book_id, 'value': value})
+    queue.enqueue({'kind': 'to_read', 'user_id': user, 'book_id': books[4], 'value': True})
+
+    with app.app_context():
+        commits, savepoints = [], []
+        event.listen(db.engine, 'commit', commits.append)
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: savepoints.append(statement)
+                     if 'SAVEPOINT' in statement.upper() else None)
+        assert queue.flush() == 4
+        assert len(commits) == 1
+        assert savepoints == []
+        assert {rating.book_id: rating.rating for rating in Rating.query.filter_by(user_id=user)} == \
+            {books[1]: 2, books[2]: 1, books[3]: 2, books[4]: 3}
+        db.session.remove()